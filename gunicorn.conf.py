@@ -0,0 +1,26 @@
+"""
+Gunicorn settings, read from this file when gunicorn starts in /app.
+
+SERVER_MODE picks how the site is served:
+
+- "wsgi" (the default): gunicorn's sync workers, one request per worker
+  at a time.
+- "asgi": uvicorn workers running the ASGI application. Each worker holds
+  many connections at once, so slow clients don't tie it up, but a
+  request costs more CPU (Django runs each middleware hook in a thread).
+  Use it when clients reach gunicorn without a buffering proxy in front.
+
+`python manage.py load_test_servers` compares the two.
+
+WEB_CONCURRENCY sets the number of worker processes, as usual.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+if os.environ.get("SERVER_MODE", "wsgi") == "asgi":
+    wsgi_app = "sibford_donations.asgi:application"
+    worker_class = "uvicorn_worker.UvicornWorker"
+else:
+    wsgi_app = "sibford_donations.wsgi:application"
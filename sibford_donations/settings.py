@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 
 import dj_database_url
@@ -48,6 +49,10 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
+    # After WhiteNoise, so static files aren't timed
+    "tickets.instrumentation.InstrumentationMiddleware",
+    # Outside SessionMiddleware, so saving a session counts as a write
+    "tickets.routers.ReplicaStickinessMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -60,10 +65,23 @@ ROOT_URLCONF = "sibford_donations.urls"
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        # The Django backend, timing renders for tickets.instrumentation
+        "BACKEND": "tickets.instrumentation.TimedDjangoTemplates",
         "DIRS": [],
-        "APP_DIRS": True,
         "OPTIONS": {
+            # Compiled templates are cached for the life of the process. HTML
+            # email templates are loaded with their CSS inlined (see
+            # tickets.email_templates), so that's done once, not per email.
+            "loaders": [
+                (
+                    "django.template.loaders.cached.Loader",
+                    [
+                        "tickets.email_templates.InlineCSSLoader",
+                        "django.template.loaders.filesystem.Loader",
+                        "django.template.loaders.app_directories.Loader",
+                    ],
+                ),
+            ],
             "context_processors": [
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
@@ -76,18 +94,132 @@ TEMPLATES = [
 WSGI_APPLICATION = "sibford_donations.wsgi.application"
 
 
+# How the site is served (see gunicorn.conf.py): "wsgi", with gunicorn's sync
+# workers, or "asgi", with uvicorn workers under gunicorn. Under ASGI the
+# booking form and confirmation pages are async views, so one process can
+# hold many slow connections open at once.
+SERVER_MODE = os.environ.get("SERVER_MODE", "wsgi")
+ASYNC_VIEWS = SERVER_MODE == "asgi"
+
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-# Use DATABASE_URL environment variable if available, otherwise fallback to SQLite
+# Use DATABASE_URL environment variable if available, otherwise fallback to SQLite.
+# Under ASGI each request's database work runs in a thread of its own, so a
+# persistent connection would never be reused; connections are closed instead
+# (or, on PostgreSQL, returned to the pool below).
 DATABASES = {
     "default": dj_database_url.config(
         default=f"sqlite:///{BASE_DIR / 'db.sqlite3'}",
-        conn_max_age=600,
+        conn_max_age=0 if SERVER_MODE == "asgi" else 600,
         conn_health_checks=True,
     )
 }
 
+# A read replica, if REPLICA_DATABASE_URL is set. The booking report, export
+# and API and the admin's booking list read from it; everything else, and
+# any client that wrote in the last REPLICA_STICKY_SECONDS, uses the primary
+# (see tickets.routers).
+#
+# The test runner always has a replica, as a second connection to the test
+# database. Reads stay on the primary unless a test turns REPLICA_READS on,
+# because the replica connection can't see rows a TestCase hasn't committed.
+TESTING = sys.argv[1:2] == ["test"]
+REPLICA_DATABASE_URL = os.environ.get("REPLICA_DATABASE_URL")
+if REPLICA_DATABASE_URL:
+    DATABASES["replica"] = dj_database_url.parse(
+        REPLICA_DATABASE_URL,
+        conn_max_age=0 if SERVER_MODE == "asgi" else 600,
+        conn_health_checks=True,
+        test_options={"MIRROR": "default"},
+    )
+elif TESTING:
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "TEST": {**DATABASES["default"].get("TEST", {}), "MIRROR": "default"},
+    }
+REPLICA_READS = "replica" in DATABASES and not TESTING
+DATABASE_ROUTERS = ["tickets.routers.ReplicaRouter"]
+REPLICA_STICKY_SECONDS = int(os.environ.get("REPLICA_STICKY_SECONDS", "10"))
+
+# PostgreSQL tuning:
+# - DB_POOL=True takes connections from a psycopg connection pool of
+#   DB_POOL_MIN_SIZE to DB_POOL_MAX_SIZE per process, rather than keeping
+#   one per thread (or, under ASGI, opening one per request), and drops
+#   the health check query run at the start of each request. It's on by
+#   default under ASGI, where it saves a new connection per request; a
+#   sync worker's persistent connection does as well without one.
+# - DB_STATEMENT_TIMEOUT (ms, 0 for none) cancels queries that run longer.
+# - DB_SERVER_SIDE_CURSORS=False if connections go through PgBouncer in
+#   transaction mode; otherwise QuerySet.iterator() (the CSV exports, Gift
+#   Aid claims and reconciliation) streams rows from a server-side cursor.
+# SQLite tuning, on unless SQLITE_TUNING=False: a WAL journal, so readers
+# don't block the writer; synchronous=NORMAL, which is safe with WAL; and
+# IMMEDIATE transactions with a busy timeout of SQLITE_BUSY_TIMEOUT ms, so
+# concurrent writers queue for the lock instead of failing with "database
+# is locked".
+for database in DATABASES.values():
+    if database["ENGINE"] == "django.db.backends.postgresql":
+        db_options = database.setdefault("OPTIONS", {})
+        if os.environ.get("DB_POOL", "True" if SERVER_MODE == "asgi" else "False") == "True":
+            db_options["pool"] = {
+                "min_size": int(os.environ.get("DB_POOL_MIN_SIZE", "2")),
+                "max_size": int(os.environ.get("DB_POOL_MAX_SIZE", "4")),
+                "timeout": int(os.environ.get("DB_POOL_TIMEOUT", "10")),
+            }
+            database["CONN_MAX_AGE"] = 0
+            database["CONN_HEALTH_CHECKS"] = False
+        statement_timeout = int(os.environ.get("DB_STATEMENT_TIMEOUT", "0"))
+        if statement_timeout:
+            db_options["options"] = (
+                db_options.get("options", "") + f" -c statement_timeout={statement_timeout}"
+            ).strip()
+        database["DISABLE_SERVER_SIDE_CURSORS"] = (
+            os.environ.get("DB_SERVER_SIDE_CURSORS", "True") != "True"
+        )
+    elif database["ENGINE"] == "django.db.backends.sqlite3":
+        if os.environ.get("SQLITE_TUNING", "True") == "True":
+            database.setdefault("OPTIONS", {}).update(
+                {
+                    "init_command": (
+                        "PRAGMA journal_mode=WAL;"
+                        "PRAGMA synchronous=NORMAL;"
+                        f"PRAGMA busy_timeout={int(os.environ.get('SQLITE_BUSY_TIMEOUT', '5000'))};"
+                    ),
+                    "transaction_mode": "IMMEDIATE",
+                }
+            )
+
+# Cache
+# CACHE_URL selects the backend: locmem:// (the default, per process),
+# file:///path/to/dir, redis://host:6379/0 for any Redis-compatible server,
+# or dummy:// to turn caching off
+CACHE_URL = os.environ.get("CACHE_URL", "locmem://")
+if CACHE_URL.startswith(("redis://", "rediss://")):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_URL,
+        }
+    }
+elif CACHE_URL.startswith("file://"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": CACHE_URL.removeprefix("file://"),
+        }
+    }
+elif CACHE_URL.startswith("dummy://"):
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": CACHE_URL.removeprefix("locmem://") or "sibford-donations",
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -123,9 +255,28 @@ USE_TZ = True
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
+# The site's stylesheet, Alpine.js and fonts are built into tickets/static/tickets/
+# by `npm install && npm run build` (the Docker image does this)
 STATIC_URL = "static/"
 STATIC_ROOT = BASE_DIR / "staticfiles"
-STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    # Hashed file names, so WhiteNoise serves them with far-future cache headers.
+    # The names come from the manifest collectstatic writes; until it has run
+    # (in development and tests, where the built assets may be missing too)
+    # files are linked by their plain names instead. The Docker image sets
+    # STATIC_MANIFEST=True for collectstatic, so that it writes the manifest.
+    "staticfiles": {
+        "BACKEND": (
+            "whitenoise.storage.CompressedManifestStaticFilesStorage"
+            if os.environ.get("STATIC_MANIFEST") == "True"
+            or (STATIC_ROOT / "staticfiles.json").exists()
+            else "django.contrib.staticfiles.storage.StaticFilesStorage"
+        ),
+    },
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -133,14 +284,25 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 # Email Configuration
-EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
-EMAIL_HOST = "smtp.resend.com"
-EMAIL_PORT = 587
-EMAIL_USE_TLS = True
-EMAIL_HOST_USER = "resend"
+# Pooled SMTP backend: keeps authenticated connections open between sends
+EMAIL_BACKEND = "tickets.email_backends.PooledEmailBackend"
+EMAIL_POOL_SIZE = int(os.environ.get("EMAIL_POOL_SIZE", "2"))
+EMAIL_POOL_IDLE_TIMEOUT = int(os.environ.get("EMAIL_POOL_IDLE_TIMEOUT", "60"))
+# The SMTP server is Resend's unless overridden, e.g. by the benchmarks' local sink
+EMAIL_HOST = os.environ.get("EMAIL_HOST", "smtp.resend.com")
+EMAIL_PORT = int(os.environ.get("EMAIL_PORT", "587"))
+EMAIL_USE_TLS = os.environ.get("EMAIL_USE_TLS", "True") == "True"
+EMAIL_HOST_USER = os.environ.get("EMAIL_HOST_USER", "resend")
 EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD")  # Resend API key
 DEFAULT_FROM_EMAIL = "Sibford CATS event <sibford@chloe.tomd.org>"
 
+# Email outbox: booking emails are queued in the database and delivered by
+# `python manage.py send_queued_emails --loop`
+EMAIL_OUTBOX_MAX_ATTEMPTS = 8
+EMAIL_OUTBOX_RETRY_DELAY = 60  # seconds, doubled after each failed attempt
+EMAIL_OUTBOX_MAX_RETRY_DELAY = 60 * 60
+EMAIL_OUTBOX_LEASE = 5 * 60  # seconds a claimed batch is held by one worker
+
 # Bank details for payment instructions
 BANK_DETAILS = {
     "account_name": "Mrs S E Bannister",
@@ -154,3 +316,60 @@ if os.environ.get("DATABASE_URL"):
 # For testing purposes, only send to tom@torchbox.com
 else:
     ADMIN_NOTIFICATION_EMAILS = ["tom@torchbox.com"]
+
+# Admin notifications are batched into a digest, sent once this many bookings
+# are waiting or the oldest has waited this many seconds
+ADMIN_NOTIFICATION_DIGEST_SIZE = int(os.environ.get("ADMIN_NOTIFICATION_DIGEST_SIZE", "20"))
+ADMIN_NOTIFICATION_DIGEST_INTERVAL = int(
+    os.environ.get("ADMIN_NOTIFICATION_DIGEST_INTERVAL", "300")
+)
+
+# Public base URL, used for links in emails sent outside a request
+SITE_URL = os.environ.get("SITE_URL", "http://localhost:8000")
+
+# Bearer tokens accepted by the bookings API (/api/bookings/), comma-separated
+BOOKINGS_API_TOKENS = [
+    token for token in os.environ.get("BOOKINGS_API_TOKENS", "").split(",") if token
+]
+
+# Seconds the booking forms may show a cached "tickets remaining" figure for
+EVENT_CACHE_TIMEOUT = int(os.environ.get("EVENT_CACHE_TIMEOUT", "10"))
+
+# Seconds a rendered booking form page is cached for (0 turns it off). Bump
+# the version to discard cached pages, e.g. after changing the templates.
+BOOKING_FORM_CACHE_TIMEOUT = int(os.environ.get("BOOKING_FORM_CACHE_TIMEOUT", "3600"))
+BOOKING_FORM_CACHE_VERSION = os.environ.get("BOOKING_FORM_CACHE_VERSION", "1")
+
+# Seconds a rendered confirmation page is cached for (0 turns it off). Pages
+# are dropped when their booking changes, and the version above applies too.
+# With several processes and a per-process cache, another process's change
+# is only seen when the page expires; a shared CACHE_URL avoids that.
+CONFIRMATION_CACHE_TIMEOUT = int(os.environ.get("CONFIRMATION_CACHE_TIMEOUT", "3600"))
+
+# Instrumentation (see tickets.instrumentation). Requests and queries taking
+# longer than these many seconds are logged at WARNING, queries with their SQL.
+SLOW_REQUEST_THRESHOLD = float(os.environ.get("SLOW_REQUEST_THRESHOLD", "1.0"))
+SLOW_QUERY_THRESHOLD = float(os.environ.get("SLOW_QUERY_THRESHOLD", "0.1"))
+
+# Bearer tokens accepted by /metrics, for a Prometheus scraper, comma-separated
+METRICS_TOKENS = [token for token in os.environ.get("METRICS_TOKENS", "").split(",") if token]
+
+# The app's own logs, including a record of every request, go to the console
+# as JSON lines. Tests only show warnings, not a line for every request.
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "json": {"()": "tickets.instrumentation.JSONFormatter"},
+    },
+    "handlers": {
+        "json_console": {"class": "logging.StreamHandler", "formatter": "json"},
+    },
+    "loggers": {
+        "tickets": {
+            "handlers": ["json_console"],
+            "level": "WARNING" if TESTING else os.environ.get("LOG_LEVEL", "INFO"),
+            "propagate": False,
+        },
+    },
+}
@@ -0,0 +1,10 @@
+/** @type {import('tailwindcss').Config} */
+module.exports = {
+  // Only classes used in these files end up in the stylesheet. Forms and
+  // views set widget classes in Python, so those are scanned too.
+  content: ["./tickets/templates/**/*.html", "./tickets/**/*.py"],
+  theme: {
+    extend: {},
+  },
+  plugins: [],
+};
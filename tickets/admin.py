@@ -1,16 +1,107 @@
-from django.contrib import admin
-from .models import Booking
+import copy
+import tempfile
+
+from django.contrib import admin, messages
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import IGNORED_PARAMS, ChangeList
+from django.core.exceptions import PermissionDenied
+from django.db.models import Count
+from django.http import FileResponse
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils import timezone
+
+from .caching import invalidate_confirmation_pages
+from .forms import BankStatementForm, BookingAdminForm
+from .gift_aid import GiftAidClaim
+from .models import Booking, BookingSummary, Event, OutboxEmail, WaitlistEntry
+from .pagination import CURSOR_VAR, InvalidCursor, KeysetPaginator
+from .reconciliation import Reconciliation, StatementError, parse_statement
+from .routers import use_replica
+from .search import REFERENCE_RE
+from .utils import queue_waitlist_offer_emails
+
+
+class BookingChangeList(ChangeList):
+    """
+    Changelist that pages with cursors instead of ?p= page numbers, so deep
+    pages cost the same as the first, and takes its result count from the
+    BookingSummary table when it can.
+    """
+
+    # Filters BookingSummary can count without touching the bookings table
+    SUMMARY_LOOKUPS = {"is_paid__exact": "is_paid", "gift_aid__exact": "gift_aid"}
+
+    def __init__(self, request, *args, **kwargs):
+        # Keep the cursor out of the parameters ChangeList treats as filters
+        self.cursor = request.GET.get(CURSOR_VAR)
+        if CURSOR_VAR in request.GET:
+            request = copy.copy(request)
+            request.GET = request.GET.copy()
+            del request.GET[CURSOR_VAR]
+        self.keyset_page = None
+        super().__init__(request, *args, **kwargs)
+
+    def get_results(self, request):
+        ordering = self.queryset.query.order_by
+        if (
+            self.show_all
+            or self.list_editable
+            or not all(isinstance(name, str) for name in ordering)
+        ):
+            return super().get_results(request)
+
+        paginator = KeysetPaginator(self.queryset, self.list_per_page, ordering)
+        try:
+            page = paginator.page(self.cursor)
+        except InvalidCursor:
+            raise IncorrectLookupParameters
+
+        self.result_count = self.get_result_count()
+        self.show_full_result_count = False
+        self.full_result_count = None
+        self.show_admin_actions = True
+        self.result_list = page.object_list
+        self.can_show_all = False
+        self.multi_page = False
+        self.paginator = paginator
+        self.keyset_page = page
+        if page.has_next():
+            self.next_page_url = self.get_query_string({CURSOR_VAR: page.next_cursor})
+        if page.has_previous():
+            self.previous_page_url = self.get_query_string(
+                {CURSOR_VAR: page.previous_cursor}
+            )
+
+    def get_result_count(self):
+        lookups = {
+            name: values[-1]
+            for name, values in self.filter_params.items()
+            if name not in IGNORED_PARAMS
+        }
+        if self.query or not set(lookups) <= set(self.SUMMARY_LOOKUPS):
+            return self.queryset.count()
+        flags = {
+            self.SUMMARY_LOOKUPS[name]: value in ("1", "True", "true")
+            for name, value in lookups.items()
+        }
+        return BookingSummary.objects.totals(**flags)["total_bookings"]
+
 
 @admin.register(Booking)
 class BookingAdmin(admin.ModelAdmin):
+    form = BookingAdminForm
     list_display = ('booking_reference', 'full_name', 'email', 'num_tickets', 
                     'donation_amount', 'gift_aid', 'is_paid', 'created_at')
-    list_filter = ('is_paid', 'gift_aid', 'created_at')
-    search_fields = ('full_name', 'email', 'booking_reference')
-    readonly_fields = ('booking_reference', 'created_at', 'updated_at', 'payment_reference')
+    list_filter = ('is_paid', 'gift_aid', 'event', 'created_at')
+    search_fields = ('full_name', 'email')
+    ordering = ('-created_at',)
+    actions = ['generate_gift_aid_claim']
+    readonly_fields = ('booking_reference', 'created_at', 'updated_at', 'checked_in_at',
+                       'payment_reference')
     fieldsets = (
         ('Booking Information', {
-            'fields': ('booking_reference', 'full_name', 'email', 'phone_number', 'num_tickets', 'donation_amount')
+            'fields': ('booking_reference', 'event', 'full_name', 'email', 'phone_number', 'num_tickets', 'donation_amount')
         }),
         ('Payment Status', {
             'fields': ('is_paid', 'payment_reference')
@@ -19,11 +110,135 @@ class BookingAdmin(admin.ModelAdmin):
             'fields': ('gift_aid', 'address_line1', 'address_line2', 'city', 'postcode')
         }),
         ('Timestamps', {
-            'fields': ('created_at', 'updated_at')
+            'fields': ('created_at', 'updated_at', 'checked_in_at')
         })
     )
     
     def payment_reference(self, obj):
         return obj.payment_reference()
     
-    payment_reference.short_description = "Payment Reference"
\ No newline at end of file
+    payment_reference.short_description = "Payment Reference"
+
+    def get_changelist(self, request, **kwargs):
+        return BookingChangeList
+
+    def changelist_view(self, request, extra_context=None):
+        # Browsing and searching bookings reads from the replica, if there is one
+        if request.method == 'GET':
+            use_replica()
+        return super().changelist_view(request, extra_context)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Booking references (SIB-<id>) aren't stored, so look them up by ID
+        match = REFERENCE_RE.fullmatch(search_term)
+        if match:
+            return queryset.filter(id=match[1]), False
+        return super().get_search_results(request, queryset, search_term)
+
+    def get_urls(self):
+        urls = [
+            path('reconcile/', self.admin_site.admin_view(self.reconcile_view),
+                 name='tickets_booking_reconcile'),
+        ]
+        return urls + super().get_urls()
+
+    def reconcile_view(self, request):
+        """Upload a bank statement and mark the bookings it pays for as paid."""
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+
+        form = BankStatementForm(request.POST or None, request.FILES or None)
+        reconciliation = None
+        if request.method == 'POST' and form.is_valid():
+            statement = form.cleaned_data['statement']
+            try:
+                statement_lines = parse_statement(statement.read(), statement.name)
+            except StatementError as e:
+                form.add_error('statement', str(e))
+            else:
+                reconciliation = Reconciliation(statement_lines)
+                reconciliation.match()
+                if not form.cleaned_data['dry_run']:
+                    reconciliation.apply()
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Reconcile bank statement',
+            'form': form,
+            'reconciliation': reconciliation,
+            'dry_run': form.is_bound and form.cleaned_data.get('dry_run'),
+        }
+        return TemplateResponse(request, 'admin/tickets/booking/reconcile.html', context)
+
+    def save_model(self, request, obj, form, change):
+        # Bookings entered by staff don't need to appear in the admin digest
+        if not change:
+            obj.admin_notified_at = timezone.now()
+        super().save_model(request, obj, form, change)
+
+    @admin.action(description="Generate Gift Aid claim for selected bookings")
+    def generate_gift_aid_claim(self, request, queryset):
+        claim = GiftAidClaim(queryset)
+        output = tempfile.SpooledTemporaryFile(max_size=10 * 1024 * 1024)
+        if not claim.write_zip(output):
+            self.message_user(
+                request, "None of the selected bookings can be claimed.", messages.WARNING
+            )
+            return None
+        output.seek(0)
+        filename = f'gift-aid-claim-{timezone.localdate():%Y%m%d}.zip'
+        return FileResponse(output, as_attachment=True, filename=filename)
+
+@admin.register(Event)
+class EventAdmin(admin.ModelAdmin):
+    list_display = ('name', 'starts_at', 'capacity', 'tickets_sold', 'tickets_remaining',
+                    'waitlist_count', 'is_open')
+    list_filter = ('is_open',)
+    readonly_fields = ('tickets_sold', 'created_at')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(waitlist_size=Count('waitlist'))
+
+    @admin.display(description="Waitlist", ordering='waitlist_size')
+    def waitlist_count(self, obj):
+        return obj.waitlist_size
+
+
+@admin.register(WaitlistEntry)
+class WaitlistEntryAdmin(admin.ModelAdmin):
+    list_display = ('full_name', 'email', 'num_tickets', 'event', 'created_at', 'offered_at')
+    list_filter = ('event', 'offered_at')
+    search_fields = ('full_name', 'email')
+    readonly_fields = ('created_at', 'offered_at')
+    actions = ['offer_tickets']
+
+    @admin.action(description="Email selected entries that tickets are available")
+    def offer_tickets(self, request, queryset):
+        queued = queue_waitlist_offer_emails(queryset)
+        self.message_user(request, f"{queued} email(s) queued.")
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at', 'created_at')
+    list_filter = ('status', 'kind')
+    search_fields = ('subject', 'booking__full_name', 'booking__email')
+    readonly_fields = ('booking', 'kind', 'subject', 'recipients', 'body', 'html_body',
+                       'attempts', 'last_error', 'sent_at', 'created_at')
+    actions = ['retry_now']
+
+    @admin.action(description="Retry selected emails now")
+    def retry_now(self, request, queryset):
+        retrying = queryset.exclude(status=OutboxEmail.STATUS_SENT)
+        # The update bypasses the signal that drops the bookings' cached
+        # confirmation pages, which say the email failed
+        invalidate_confirmation_pages(
+            retrying.filter(kind=OutboxEmail.KIND_BOOKING_CONFIRMATION)
+            .exclude(booking=None)
+            .values_list('booking_id', flat=True)
+        )
+        updated = retrying.update(
+            status=OutboxEmail.STATUS_PENDING, next_attempt_at=timezone.now()
+        )
+        self.message_user(request, f"{updated} email(s) queued for retry.")
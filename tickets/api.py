@@ -0,0 +1,118 @@
+"""
+Read-only JSON API over bookings, for the door-check and dashboard scripts.
+
+GET /api/bookings/ takes the booking report's filters (payment_status,
+gift_aid, search) and returns a page of bookings, newest first:
+
+    {"results": [{...}, ...], "next": "<url>", "previous": null}
+
+- ``fields`` selects a comma-separated subset of API_FIELDS.
+- ``limit`` sets the page size (at most API_MAX_PAGE_SIZE).
+- ``cursor`` is taken from a previous page's next or previous URL.
+
+Responses carry an ETag and Last-Modified from the newest updated_at among
+the matching bookings and how many there are, so a client polling with
+If-None-Match or If-Modified-Since gets a 304 without the page being
+fetched or serialised. Any change to a matching booking changes the ETag.
+
+Staff who are signed in can use the API, as can scripts sending
+"Authorization: Bearer <token>" with one of BOOKINGS_API_TOKENS.
+"""
+
+import hashlib
+import hmac
+
+from django.conf import settings
+
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+
+API_FIELDS = (
+    "id",
+    "reference",
+    "full_name",
+    "email",
+    "phone_number",
+    "num_tickets",
+    "donation_amount",
+    "gift_aid",
+    "address_line1",
+    "address_line2",
+    "city",
+    "postcode",
+    "is_paid",
+    "event",
+    "created_at",
+    "updated_at",
+)
+
+# The Booking field each API field is read from, where the names differ
+API_SOURCE_FIELDS = {"reference": "id", "event": "event_id"}
+
+
+class InvalidParameter(Exception):
+    """Raised for a query parameter the API can't use."""
+
+
+def parse_fields(value):
+    """Return the API fields named in a ``fields`` parameter, or all of them."""
+    if not value:
+        return list(API_FIELDS)
+    fields = list(dict.fromkeys(name.strip() for name in value.split(",") if name.strip()))
+    unknown = [name for name in fields if name not in API_FIELDS]
+    if unknown:
+        raise InvalidParameter(f"Unknown field(s): {', '.join(unknown)}")
+    return fields
+
+
+def parse_limit(value):
+    if not value:
+        return API_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise InvalidParameter("limit must be a whole number")
+    if not 1 <= limit <= API_MAX_PAGE_SIZE:
+        raise InvalidParameter(f"limit must be between 1 and {API_MAX_PAGE_SIZE}")
+    return limit
+
+
+def source_fields(fields):
+    """Return the Booking fields to load for the given API fields."""
+    return {API_SOURCE_FIELDS.get(name, name).removesuffix("_id") for name in fields}
+
+
+def serialize_booking(booking, fields):
+    """Return a dict of the given API fields for a booking."""
+    data = {}
+    for name in fields:
+        if name == "reference":
+            data[name] = booking.booking_reference()
+        else:
+            data[name] = getattr(booking, API_SOURCE_FIELDS.get(name, name))
+    return data
+
+
+def has_api_access(request):
+    """Whether the request comes from signed-in staff or carries an API token."""
+    if request.user.is_active and request.user.is_staff:
+        return True
+    return has_bearer_token(request, settings.BOOKINGS_API_TOKENS)
+
+
+def has_bearer_token(request, tokens):
+    """Whether the request's Authorization header carries one of ``tokens``."""
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    return scheme.lower() == "bearer" and any(
+        hmac.compare_digest(token.strip().encode(), allowed.encode()) for allowed in tokens
+    )
+
+
+def bookings_etag(last_modified, count, query_string):
+    """
+    Return an ETag for a page of results. It changes whenever a matching
+    booking is added, changed or deleted, and differs between pages and
+    field selections.
+    """
+    version = f"{last_modified.isoformat() if last_modified else ''}:{count}:{query_string}"
+    return f'"{hashlib.sha1(version.encode()).hexdigest()}"'
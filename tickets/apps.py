@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class TicketsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tickets'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from . import signals  # noqa: F401
+        from .email_templates import preload_email_templates
+        from .instrumentation import install_query_timer
+
+        # Time every query (and log slow ones) on each database connection
+        connection_created.connect(install_query_timer)
+
+        # Compile the email templates (and inline their CSS) at startup,
+        # rather than while the first booking is being saved
+        preload_email_templates()
@@ -0,0 +1,194 @@
+"""
+Helpers for the load tests and benchmarks (the load_test_submissions,
+load_test_servers and benchmark_suite commands): starting gunicorn, a
+local SMTP server that accepts and discards email, an HTTP client for the
+booking forms, and latency summaries.
+"""
+
+import os
+import re
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.cookiejar import CookieJar
+
+from django.conf import settings
+
+HIDDEN_INPUT_RE = r'name="{}" value="([^"]+)"'
+
+
+class BenchmarkError(Exception):
+    """Raised when a server or page under test doesn't behave as expected."""
+
+
+def start_server(mode, port, workers, env=None, log=None):
+    """
+    Start gunicorn in the given SERVER_MODE (see gunicorn.conf.py) and wait
+    until it accepts connections. ``env`` adds environment variables, and
+    the server's output goes to the file object ``log``, if given.
+    """
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--workers", str(workers)],
+        cwd=settings.BASE_DIR,
+        env={**os.environ, **(env or {}), "SERVER_MODE": mode, "PORT": str(port)},
+        stdout=log or subprocess.DEVNULL,
+        stderr=log or subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise BenchmarkError(f"The {mode} server exited with status {server.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise BenchmarkError(f"The {mode} server didn't start on port {port}")
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.reply("220 localhost SMTP sink")
+        while line := self.rfile.readline():
+            command = line.decode(errors="replace").strip().upper()
+            if command.startswith("EHLO"):
+                self.reply("250-localhost")
+                self.reply("250 8BITMIME")
+            elif command.startswith("DATA"):
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while (line := self.rfile.readline()) not in (b".\r\n", b".\n", b""):
+                    pass
+                with self.server.lock:
+                    self.server.messages += 1
+                self.reply("250 OK")
+            elif command.startswith("QUIT"):
+                self.reply("221 Bye")
+                return
+            elif command.startswith(("HELO", "MAIL", "RCPT", "RSET", "NOOP")):
+                self.reply("250 OK")
+            else:
+                self.reply("502 Command not implemented")
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """
+    An SMTP server on localhost that accepts every message and throws it
+    away, counting them in ``messages``. Use it as a context manager.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0):
+        super().__init__(("127.0.0.1", port), SMTPSinkHandler)
+        self.lock = threading.Lock()
+        self.messages = 0
+        self.port = self.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+    @property
+    def environ(self):
+        """Environment variables that point the site's email settings here."""
+        return {
+            "EMAIL_HOST": "127.0.0.1",
+            "EMAIL_PORT": str(self.port),
+            "EMAIL_USE_TLS": "False",
+            "EMAIL_HOST_USER": "",
+            "EMAIL_HOST_PASSWORD": "",
+        }
+
+
+class NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def build_opener():
+    """Return a urllib opener that keeps cookies and doesn't follow redirects."""
+    return urllib.request.build_opener(
+        urllib.request.HTTPCookieProcessor(CookieJar()), NoRedirectHandler
+    )
+
+
+def fetch_form(url, opener=None):
+    """
+    Load a booking form and return an opener holding its cookies and a
+    filled-in POST body.
+    """
+    opener = opener or build_opener()
+    with opener.open(url) as response:
+        html = response.read().decode()
+
+    fields = {}
+    for name in ("csrfmiddlewaretoken", "idempotency_key"):
+        match = re.search(HIDDEN_INPUT_RE.format(name), html)
+        if not match:
+            raise BenchmarkError(f"No {name} field in the form at {url}")
+        fields[name] = match[1]
+
+    body = urllib.parse.urlencode(
+        {
+            **fields,
+            "full_name": "Load Test",
+            "email": f"load-test-{fields['idempotency_key']}@example.com",
+            "num_tickets": 1,
+            "donation_amount": 25,
+            "extra_donation": 0,
+        }
+    ).encode()
+    return opener, body
+
+
+def submit_form(opener, url, body):
+    """Post a form and return (status, redirect location, seconds taken)."""
+    request = urllib.request.Request(url, data=body, headers={"Referer": url})
+    start = time.perf_counter()
+    try:
+        with opener.open(request) as response:
+            status, location = response.status, None
+            response.read()
+    except urllib.error.HTTPError as e:
+        status, location = e.code, e.headers.get("Location")
+    return status, location, time.perf_counter() - start
+
+
+def percentile(ordered, percent):
+    """Return the nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarise_latencies(latencies, duration):
+    """Return request count, requests per second and latency percentiles in ms."""
+    ordered = sorted(latencies)
+
+    def ms(seconds):
+        return None if seconds is None else round(seconds * 1000, 2)
+
+    return {
+        "requests": len(ordered),
+        "requests_per_second": round(len(ordered) / duration, 2) if duration else None,
+        "p50_ms": ms(percentile(ordered, 50)),
+        "p95_ms": ms(percentile(ordered, 95)),
+        "p99_ms": ms(percentile(ordered, 99)),
+        "max_ms": ms(ordered[-1] if ordered else None),
+    }
@@ -0,0 +1,232 @@
+"""
+Caching for the public booking form and confirmation pages.
+
+A booking form page is the same for every anonymous visitor apart from
+its CSRF token and idempotency key. It is rendered once with placeholders
+in their place and cached, and each GET fills the placeholders in, so a
+cache hit costs a string replacement rather than rendering the form's
+widgets.
+
+Cache keys include the view, its form class and ticket price, the current
+event's tickets remaining and BOOKING_FORM_CACHE_VERSION, so a price change
+or a new deploy (bump the version) never serves a stale page.
+
+A confirmation page is cached whole, per booking, with an ETag made from
+the booking's id and updated_at and its confirmation email's status.
+Donors refresh and share the page; a cached copy is served, and a browser
+revalidating its own copy gets a 304, without querying the database.
+Saving or deleting a booking, or its confirmation email, drops the cached
+page (see tickets.signals), as do the bulk updates that bypass signals.
+While the confirmation email is still queued the page isn't cached: the
+outbox worker runs in its own process, so its status change can't clear a
+per-process cache.
+"""
+
+import hashlib
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from .models import Event, OutboxEmail
+
+CSRF_TOKEN_PLACEHOLDER = "__csrf_token__"
+IDEMPOTENCY_KEY_PLACEHOLDER = "__idempotency_key__"
+
+_CURRENT = object()
+
+
+class FormShellCacheMixin:
+    """Serve GET requests for a booking form view from a cached page shell."""
+
+    rendering_shell = False
+
+    def get(self, request, *args, **kwargs):
+        if not self.can_cache_shell(request):
+            return super().get(request, *args, **kwargs)
+
+        key = self.get_shell_cache_key()
+        shell = cache.get(key)
+        if shell is None:
+            self.rendering_shell = True
+            response = super().get(request, *args, **kwargs)
+            response.render()
+            if response.status_code != 200:
+                return response
+            shell = response.content.decode(response.charset)
+            cache.set(key, shell, settings.BOOKING_FORM_CACHE_TIMEOUT)
+
+        return HttpResponse(self.fill_shell(request, shell))
+
+    def can_cache_shell(self, request):
+        # Pages with messages or for signed-in users aren't the same for everyone
+        return (
+            settings.BOOKING_FORM_CACHE_TIMEOUT > 0
+            and not request.GET
+            and not request.user.is_authenticated
+            and not len(get_messages(request))
+        )
+
+    async def aget_shell(self, request):
+        """
+        Return the filled-in cached page for an async view, or None if the
+        page can't be cached or hasn't been yet.
+        """
+        if settings.SESSION_COOKIE_NAME in request.COOKIES:
+            # Loading the session, for the user or messages that overflowed
+            # their cookie, queries the database
+            can_cache = await sync_to_async(self.can_cache_shell)(request)
+        else:
+            can_cache = self.can_cache_shell(request)
+        if not can_cache:
+            return None
+        shell = await cache.aget(self.get_shell_cache_key(await Event.objects.acurrent()))
+        if shell is None:
+            return None
+        return HttpResponse(self.fill_shell(request, shell))
+
+    def get_shell_cache_key(self, event=_CURRENT):
+        form_class = self.get_form_class()
+        if event is _CURRENT:
+            event = Event.objects.current()
+        return ":".join(
+            str(part)
+            for part in (
+                "tickets:form-shell",
+                settings.BOOKING_FORM_CACHE_VERSION,
+                type(self).__name__,
+                form_class.__name__,
+                getattr(form_class, "TICKET_PRICE", ""),
+                getattr(form_class, "SUGGESTED_DONATION", ""),
+                event.pk if event else "",
+                event.tickets_remaining if event else "",
+            )
+        )
+
+    def fill_shell(self, request, shell):
+        # get_token() also makes sure the CSRF cookie is set
+        return shell.replace(CSRF_TOKEN_PLACEHOLDER, get_token(request)).replace(
+            IDEMPOTENCY_KEY_PLACEHOLDER, str(uuid.uuid4())
+        )
+
+    def get_initial(self):
+        initial = super().get_initial()
+        if self.rendering_shell:
+            initial["idempotency_key"] = IDEMPOTENCY_KEY_PLACEHOLDER
+        return initial
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        if self.rendering_shell:
+            context["csrf_token"] = CSRF_TOKEN_PLACEHOLDER
+        return context
+
+
+def confirmation_cache_key(booking_id):
+    return f"tickets:confirmation:{settings.BOOKING_FORM_CACHE_VERSION}:{booking_id}"
+
+
+def invalidate_confirmation_pages(booking_ids):
+    """Drop the cached confirmation pages of bookings once a change commits."""
+    keys = [confirmation_cache_key(booking_id) for booking_id in booking_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+class ConfirmationPageCacheMixin:
+    """Serve a booking's confirmation page from the cache, with conditional GET."""
+
+    def get(self, request, *args, **kwargs):
+        if not self.can_cache_page(request):
+            return super().get(request, *args, **kwargs)
+        page = cache.get(confirmation_cache_key(kwargs["pk"]))
+        if page is not None:
+            return self.page_response(request, page)
+        return self.cache_page(request, kwargs["pk"], super().get(request, *args, **kwargs))
+
+    def cache_page(self, request, booking_id, response):
+        """Render a confirmation page response, cache it, and serve it."""
+        page = self.make_page(response.render())
+        if page is None:
+            return response
+        if page["final"]:
+            cache.set(confirmation_cache_key(booking_id), page, settings.CONFIRMATION_CACHE_TIMEOUT)
+        return self.page_response(request, page)
+
+    async def aget_page(self, booking_id):
+        return await cache.aget(confirmation_cache_key(booking_id))
+
+    async def acache_page(self, request, booking_id, response):
+        """cache_page() for an async view."""
+        page = self.make_page(await sync_to_async(response.render)())
+        if page is None:
+            return response
+        if page["final"]:
+            await cache.aset(
+                confirmation_cache_key(booking_id), page, settings.CONFIRMATION_CACHE_TIMEOUT
+            )
+        return self.page_response(request, page)
+
+    def can_cache_page(self, request):
+        # Pages with messages or for signed-in users aren't the same for everyone
+        return (
+            settings.CONFIRMATION_CACHE_TIMEOUT > 0
+            and not request.user.is_authenticated
+            and not len(get_messages(request))
+        )
+
+    async def acan_cache_page(self, request):
+        if settings.SESSION_COOKIE_NAME in request.COOKIES:
+            # Loading the session queries the database
+            return await sync_to_async(self.can_cache_page)(request)
+        return self.can_cache_page(request)
+
+    def make_page(self, response):
+        """
+        Return what's cached for a rendered confirmation page, or None if
+        the booking wasn't found.
+        """
+        booking = response.context_data.get("booking")
+        if response.status_code != 200 or booking is None:
+            return None
+        email = response.context_data.get("confirmation_email")
+        version = ":".join(
+            str(part)
+            for part in (
+                settings.BOOKING_FORM_CACHE_VERSION,
+                booking.pk,
+                booking.updated_at.isoformat(),
+                email.pk if email else "",
+                email.status if email else "",
+            )
+        )
+        last_modified = max(filter(None, (booking.updated_at, email and email.sent_at)))
+        return {
+            "content": response.content,
+            "content_type": response["Content-Type"],
+            "etag": f'"{hashlib.sha1(version.encode()).hexdigest()}"',
+            "last_modified": int(last_modified.timestamp()),
+            # Nothing but a save (which drops the page) will change it
+            "final": email is None or email.status != OutboxEmail.STATUS_PENDING,
+        }
+
+    def page_response(self, request, page):
+        response = get_conditional_response(
+            request, etag=page["etag"], last_modified=page["last_modified"]
+        )
+        if response is None:
+            response = HttpResponse(page["content"], content_type=page["content_type"])
+        response["ETag"] = page["etag"]
+        response["Last-Modified"] = http_date(page["last_modified"])
+        # The page has the booker's details: browsers may keep it, but must
+        # check it's current, and shared caches mustn't
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ("Cookie",))
+        return response
@@ -0,0 +1,158 @@
+"""
+Door check-in.
+
+The check-in page downloads a compact snapshot of the event's bookings
+once, and its service worker keeps a copy so the page works without a
+connection. Lookups run in the browser against the snapshot. Check-ins
+are queued in the browser and sent back in batches, which
+record_check_ins() applies with a single UPDATE.
+
+The snapshot is a list of rows rather than objects, to keep it small:
+
+    {"version": "...", "fields": ["id", "full_name", ...], "rows": [[...], ...]}
+
+Its version changes whenever one of its bookings is added, changed,
+deleted or checked in. The page asks for the snapshot again with the
+version it holds and gets a 304 if nothing has changed.
+"""
+
+import hashlib
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Max, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Booking, Event
+
+SNAPSHOT_FIELDS = ("id", "full_name", "num_tickets", "is_paid", "checked_in")
+
+# Check-ins accepted in one sync request
+CHECK_IN_BATCH_SIZE = 200
+
+# Static files the check-in page needs, precached by its service worker
+CHECK_IN_ASSETS = (
+    "tickets/css/tickets.css",
+    "tickets/js/alpine.min.js",
+    "tickets/fonts/inter-latin-400-normal.woff2",
+    "tickets/fonts/inter-latin-500-normal.woff2",
+    "tickets/fonts/inter-latin-600-normal.woff2",
+    "tickets/fonts/gowun-batang-latin-400-normal.woff2",
+    "tickets/fonts/gowun-batang-latin-700-normal.woff2",
+)
+
+
+class InvalidCheckIn(Exception):
+    """Raised for a check-in sync request that can't be applied."""
+
+
+def door_event():
+    """
+    Return the event being checked in: the next to start, counting one
+    that started in the last 12 hours, or else the latest.
+    """
+    recent = timezone.now() - timedelta(hours=12)
+    return (
+        Event.objects.filter(starts_at__gte=recent).order_by("starts_at", "id").first()
+        or Event.objects.order_by("-starts_at", "-id").first()
+    )
+
+
+def snapshot_bookings(event):
+    """Return the bookings a snapshot for ``event`` (or every event) covers."""
+    bookings = Booking.objects.all()
+    if event is not None:
+        bookings = bookings.filter(event=event)
+    return bookings
+
+
+def snapshot_version(bookings):
+    """Return (version, last modified time) for a snapshot of ``bookings``."""
+    state = bookings.aggregate(last_modified=Max("updated_at"), count=Count("id"))
+    last_modified = state["last_modified"]
+    version = f"{last_modified.isoformat() if last_modified else ''}:{state['count']}"
+    return hashlib.sha1(version.encode()).hexdigest()[:16], last_modified
+
+
+def snapshot_rows(bookings):
+    """Yield a snapshot row of SNAPSHOT_FIELDS for each booking."""
+    rows = bookings.order_by("id").values_list(
+        "id", "full_name", "num_tickets", "is_paid", "checked_in_at"
+    )
+    for booking_id, full_name, num_tickets, is_paid, checked_in_at in rows.iterator(
+        chunk_size=2000
+    ):
+        yield [booking_id, full_name, num_tickets, is_paid, checked_in_at is not None]
+
+
+def parse_check_ins(data):
+    """
+    Read a sync request's {"check_ins": [{"id": 1, "checked_in_at": "<ISO>"}, ...]}.
+
+    Returns:
+        dict: {booking ID: check-in time}. Times that are missing, invalid
+        or in the future are replaced with the current time.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get("check_ins"), list):
+        raise InvalidCheckIn("Expected a check_ins list")
+    if len(data["check_ins"]) > CHECK_IN_BATCH_SIZE:
+        raise InvalidCheckIn(f"At most {CHECK_IN_BATCH_SIZE} check-ins can be sent at once")
+
+    now = timezone.now()
+    check_ins = {}
+    for item in data["check_ins"]:
+        if not isinstance(item, dict) or not isinstance(item.get("id"), int):
+            raise InvalidCheckIn("Each check-in needs a booking id")
+        try:
+            checked_in_at = datetime.fromisoformat(item.get("checked_in_at") or "")
+        except (TypeError, ValueError):
+            checked_in_at = now
+        if timezone.is_naive(checked_in_at):
+            checked_in_at = timezone.make_aware(checked_in_at)
+        check_ins[item["id"]] = min(checked_in_at, now)
+    return check_ins
+
+
+def record_check_ins(check_ins):
+    """
+    Mark bookings checked in. A booking already checked in, say on another
+    device, keeps its first check-in time.
+
+    Args:
+        check_ins: {booking ID: check-in time}
+
+    Returns:
+        tuple: (IDs checked in by this request, {ID: earlier check-in time}
+        for those already checked in, IDs of bookings that don't exist)
+    """
+    with transaction.atomic():
+        stored = dict(
+            Booking.objects.select_for_update()
+            .filter(pk__in=check_ins)
+            .values_list("id", "checked_in_at")
+        )
+        new = {
+            booking_id: checked_in_at
+            for booking_id, checked_in_at in check_ins.items()
+            if booking_id in stored and stored[booking_id] is None
+        }
+        if new:
+            # One UPDATE, with each booking's own check-in time. COALESCE
+            # keeps a time written since the SELECT, as SQLite doesn't lock
+            # the rows it reads.
+            Booking.objects.filter(pk__in=new).update(
+                checked_in_at=Coalesce(
+                    F("checked_in_at"),
+                    Case(*(When(pk=pk, then=Value(at)) for pk, at in new.items())),
+                ),
+                updated_at=timezone.now(),
+            )
+
+    already = {
+        booking_id: stored[booking_id]
+        for booking_id in check_ins
+        if stored.get(booking_id) is not None
+    }
+    unknown = [booking_id for booking_id in check_ins if booking_id not in stored]
+    return list(new), already, unknown
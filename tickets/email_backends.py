@@ -0,0 +1,172 @@
+import smtplib
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.mail.backends.smtp import EmailBackend
+
+from .instrumentation import record_email_send
+
+
+class SMTPConnectionPool:
+    """
+    A per-process pool of authenticated SMTP connections.
+
+    Connections are keyed on the server settings they were opened with, so
+    backends configured for different servers never share a connection.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = {}
+        self.stats = Counter()
+
+    def acquire(self, key, idle_timeout):
+        """
+        Return a tuple ``(connection, replaced)``. ``connection`` is a live
+        idle connection for ``key``, or None if a new one must be opened, and
+        ``replaced`` says whether any pooled connection was thrown away.
+
+        Connections idle for longer than ``idle_timeout`` seconds are closed,
+        and the rest are checked with NOOP before being reused.
+        """
+        replaced = False
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                if not idle:
+                    return None, replaced
+                connection, last_used = idle.pop()
+
+            replaced = True
+            if time.monotonic() - last_used > idle_timeout:
+                self.discard(connection)
+                self.record("expired")
+                continue
+
+            try:
+                status, _ = connection.noop()
+            except (smtplib.SMTPException, OSError):
+                status = None
+            if status == 250:
+                self.record("reused")
+                return connection, False
+
+            self.discard(connection)
+            self.record("stale")
+
+    def release(self, key, connection, max_size):
+        """Return a connection to the pool, closing it if the pool is full."""
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < max_size:
+                idle.append((connection, time.monotonic()))
+                return
+        self.discard(connection)
+
+    def record(self, event):
+        with self._lock:
+            self.stats[event] += 1
+
+    def clear(self):
+        """Close every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection, _ in connections:
+                self.discard(connection)
+
+    def discard(self, connection):
+        try:
+            connection.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.close()
+
+
+connection_pool = SMTPConnectionPool()
+
+
+def pool_stats():
+    """
+    Return the pool's connection counters.
+
+    ``opened`` counts new connections, ``reused`` idle connections handed
+    out again, and ``reconnects`` connections opened to replace one that
+    had gone stale or passed its idle timeout.
+    """
+    stats = dict(connection_pool.stats)
+    for key in ("opened", "reused", "reconnects", "stale", "expired"):
+        stats.setdefault(key, 0)
+    return stats
+
+
+class PooledEmailBackend(EmailBackend):
+    """
+    SMTP email backend that keeps authenticated connections open between
+    sends instead of running STARTTLS and AUTH for every message.
+
+    Settings:
+        EMAIL_POOL_SIZE: idle connections kept per worker process (default 2)
+        EMAIL_POOL_IDLE_TIMEOUT: seconds before an idle connection is closed
+            rather than reused (default 60)
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool_size = getattr(settings, "EMAIL_POOL_SIZE", 2)
+        self.idle_timeout = getattr(settings, "EMAIL_POOL_IDLE_TIMEOUT", 60)
+
+    @property
+    def pool_key(self):
+        return (self.host, self.port, self.username, self.use_tls, self.use_ssl)
+
+    def open(self):
+        if self.connection:
+            return False
+
+        connection, replaced = connection_pool.acquire(
+            self.pool_key, self.idle_timeout
+        )
+        if connection is not None:
+            self.connection = connection
+            return True
+
+        new_connection = super().open()
+        if self.connection is not None:
+            connection_pool.record("opened")
+            if replaced:
+                connection_pool.record("reconnects")
+        return new_connection
+
+    def close(self):
+        """Hand the connection back to the pool rather than quitting."""
+        if self.connection is None:
+            return super().close()
+        connection, self.connection = self.connection, None
+        connection_pool.release(self.pool_key, connection, self.pool_size)
+
+    def send_messages(self, email_messages):
+        started = time.perf_counter()
+        sent = 0
+        try:
+            sent = super().send_messages(email_messages)
+            return sent
+        finally:
+            record_email_send(time.perf_counter() - started, sent or 0)
+
+    def _send(self, email_message):
+        try:
+            return super()._send(email_message)
+        except smtplib.SMTPServerDisconnected:
+            # The server dropped the connection after the NOOP check. Throw
+            # it away and resend this message once on a fresh connection.
+            connection_pool.discard(self.connection)
+            connection_pool.record("stale")
+            self.connection = None
+            super().open()
+            if self.connection is None:
+                return False
+            connection_pool.record("opened")
+            connection_pool.record("reconnects")
+            return super()._send(email_message)
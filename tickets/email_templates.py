@@ -0,0 +1,116 @@
+"""
+Email template loading and rendering.
+
+HTML email templates (tickets/emails/*.html) are loaded through
+InlineCSSLoader, which copies the rules in their <style> block onto the
+matching elements' style attributes, as most email clients ignore
+stylesheets. This happens once, when the template is first loaded; the
+cached template loader then keeps the compiled result, so sending an email
+only renders it. Each email's plain-text part comes from a .txt template
+alongside the HTML one.
+"""
+
+import re
+
+from django.template.loader import get_template
+from django.template.loaders import app_directories
+
+EMAIL_TEMPLATE_DIR = "tickets/emails/"
+EMAIL_TEMPLATES = (
+    "tickets/emails/booking_confirmation",
+    "tickets/emails/admin_digest",
+    "tickets/emails/waitlist_offer",
+)
+
+STYLE_BLOCK_RE = re.compile(r"<style[^>]*>(.*?)</style>", re.S | re.I)
+CSS_RULE_RE = re.compile(r"([^{}]+)\{([^{}]*)\}")
+TAG_RE = re.compile(r"<([a-zA-Z][a-zA-Z0-9]*)\b([^<>]*)>")
+CLASS_ATTR_RE = re.compile(r'\sclass="([^"]*)"')
+STYLE_ATTR_RE = re.compile(r'\sstyle="([^"]*)"')
+# Only element and single-class selectors are inlined; anything else stays
+# in the <style> block
+INLINABLE_SELECTOR_RE = re.compile(r"^(?:[a-z][a-z0-9]*|\.[\w-]+)$")
+
+
+def inline_css(html):
+    """
+    Move the rules in the first <style> block of ``html`` onto the style
+    attributes of the elements they match, keeping the cascade: element
+    rules, then class rules, in stylesheet order, then any existing style
+    attribute.
+    """
+    match = STYLE_BLOCK_RE.search(html)
+    if not match:
+        return html
+
+    element_rules = {}
+    class_rules = {}
+    remaining = []
+    for position, (selectors, declarations) in enumerate(CSS_RULE_RE.findall(match[1])):
+        declarations = "; ".join(
+            declaration.strip() for declaration in declarations.split(";") if declaration.strip()
+        )
+        for selector in (selector.strip() for selector in selectors.split(",")):
+            if not INLINABLE_SELECTOR_RE.match(selector):
+                remaining.append(f"{selector} {{ {declarations} }}")
+            elif selector.startswith("."):
+                class_rules.setdefault(selector[1:], []).append((position, declarations))
+            else:
+                element_rules.setdefault(selector, []).append((position, declarations))
+
+    def add_style(tag):
+        name, attributes = tag[1], tag[2]
+        rules = sorted(element_rules.get(name.lower(), []))
+        class_attribute = CLASS_ATTR_RE.search(attributes)
+        if class_attribute:
+            rules += sorted(
+                rule
+                for class_name in class_attribute[1].split()
+                for rule in class_rules.get(class_name, [])
+            )
+        if not rules:
+            return tag[0]
+
+        styles = [declarations for _, declarations in rules]
+        style_attribute = STYLE_ATTR_RE.search(attributes)
+        if style_attribute:
+            styles.append(style_attribute[1])
+            attributes = attributes[: style_attribute.start()] + attributes[style_attribute.end() :]
+        self_closing = attributes.rstrip().endswith("/")
+        if self_closing:
+            attributes = attributes.rstrip()[:-1]
+        return f'<{name}{attributes} style="{"; ".join(styles)}"{" /" if self_closing else ""}>'
+
+    head, body = html[: match.start()], html[match.end() :]
+    style_block = f"<style>\n{chr(10).join(remaining)}\n</style>" if remaining else ""
+    return head + style_block + TAG_RE.sub(add_style, body)
+
+
+class InlineCSSLoader(app_directories.Loader):
+    """Loads HTML email templates with their CSS inlined by inline_css()."""
+
+    def get_template_sources(self, template_name):
+        if template_name.startswith(EMAIL_TEMPLATE_DIR) and template_name.endswith(".html"):
+            yield from super().get_template_sources(template_name)
+
+    def get_contents(self, origin):
+        return inline_css(super().get_contents(origin))
+
+
+def render_email(template_name, context):
+    """
+    Render an email from ``template_name``.html and ``template_name``.txt.
+
+    Returns:
+        tuple: (plain_message, html_message)
+    """
+    html_message = get_template(f"{template_name}.html").render(context)
+    plain_message = get_template(f"{template_name}.txt").render(context)
+    return plain_message, html_message
+
+
+def preload_email_templates():
+    """Load and compile every email template into the template cache."""
+    for template_name in EMAIL_TEMPLATES:
+        get_template(f"{template_name}.html")
+        get_template(f"{template_name}.txt")
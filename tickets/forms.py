@@ -1,6 +1,8 @@
+import uuid
+
 from django import forms
 
-from .models import Booking
+from .models import Booking, Event
 
 
 class BookingForm(forms.ModelForm):
@@ -36,6 +38,11 @@ class BookingForm(forms.ModelForm):
         ),
     )
 
+    # Issued with each form so a resubmission can't create a second booking
+    idempotency_key = forms.UUIDField(
+        required=False, initial=uuid.uuid4, widget=forms.HiddenInput()
+    )
+
     class Meta:
         model = Booking
         fields = [
@@ -181,6 +188,11 @@ class BookingFormV2(forms.ModelForm):
         ),
     )
 
+    # Issued with each form so a resubmission can't create a second booking
+    idempotency_key = forms.UUIDField(
+        required=False, initial=uuid.uuid4, widget=forms.HiddenInput()
+    )
+
     class Meta:
         model = Booking
         fields = [
@@ -333,6 +345,11 @@ class BookingFormV3(forms.ModelForm):
         ),
     )
 
+    # Issued with each form so a resubmission can't create a second booking
+    idempotency_key = forms.UUIDField(
+        required=False, initial=uuid.uuid4, widget=forms.HiddenInput()
+    )
+
     class Meta:
         model = Booking
         fields = [
@@ -402,55 +419,77 @@ class BookingFormV3(forms.ModelForm):
         self.fields["city"].required = False
         self.fields["postcode"].required = False
 
-    def clean(self):
-        cleaned_data = super().clean()
-        gift_aid = cleaned_data.get("gift_aid")
-
-        # If gift aid is selected, make sure address fields are provided
-        if gift_aid:
+    @classmethod
+    def gift_aid_errors(cls, cleaned_data):
+        """
+        Return a {field: message} dict of the Gift Aid details missing from
+        ``cleaned_data``: an address and the declaration, if Gift Aid is selected.
+        """
+        errors = {}
+        if cleaned_data.get("gift_aid"):
             for field in ["address_line1", "city", "postcode"]:
                 if not cleaned_data.get(field):
-                    self.add_error(
-                        field, "This field is required when Gift Aid is selected"
-                    )
-                    self.fields[field].widget.attrs.update(
-                        {
-                            "class": self.fields[field].widget.attrs.get("class", "")
-                            + " border-rose-300 text-rose-900 placeholder-rose-300 focus:ring-rose-500 focus:border-rose-500"
-                        }
-                    )
-
-            # Also check that gift_aid_confirmation is checked
+                    errors[field] = "This field is required when Gift Aid is selected"
             if not cleaned_data.get("gift_aid_confirmation"):
-                self.add_error(
-                    "gift_aid_confirmation",
-                    "You must confirm the Gift Aid declaration to proceed with Gift Aid",
-                )
-                self.fields["gift_aid_confirmation"].widget.attrs.update(
-                    {
-                        "class": self.fields["gift_aid_confirmation"].widget.attrs.get(
-                            "class", ""
-                        )
-                        + " border-rose-300"
-                    }
+                errors["gift_aid_confirmation"] = (
+                    "You must confirm the Gift Aid declaration to proceed with Gift Aid"
                 )
+        return errors
+
+    @classmethod
+    def donation_amount(cls, num_tickets, extra_donation):
+        """Calculate the total donation: (tickets * price) + extra donation."""
+        return (num_tickets * cls.TICKET_PRICE) + (extra_donation or 0)
+
+    def clean(self):
+        cleaned_data = super().clean()
+
+        # If gift aid is selected, make sure the address and declaration are provided
+        for field, message in self.gift_aid_errors(cleaned_data).items():
+            self.add_error(field, message)
+            if field == "gift_aid_confirmation":
+                error_classes = " border-rose-300"
+            else:
+                error_classes = " border-rose-300 text-rose-900 placeholder-rose-300 focus:ring-rose-500 focus:border-rose-500"
+            self.fields[field].widget.attrs.update(
+                {"class": self.fields[field].widget.attrs.get("class", "") + error_classes}
+            )
 
         return cleaned_data
 
     def save(self, commit=True):
         """Override save to calculate donation_amount from tickets + extra donation."""
         instance = super().save(commit=False)
-
-        # Calculate total donation: (tickets * price) + extra donation
-        num_tickets = self.cleaned_data.get("num_tickets", 1)
-        extra_donation = self.cleaned_data.get("extra_donation", 0) or 0
-        instance.donation_amount = (num_tickets * self.TICKET_PRICE) + extra_donation
+        instance.donation_amount = self.donation_amount(
+            self.cleaned_data.get("num_tickets", 1), self.cleaned_data.get("extra_donation")
+        )
 
         if commit:
             instance.save()
         return instance
 
 
+class BookingAdminForm(forms.ModelForm):
+    """
+    The admin's booking form. Booking.clean() checks that the event has
+    enough tickets left; this locks the event first, so that no booking
+    made meanwhile can take them and make saving this one fail.
+    """
+
+    class Meta:
+        model = Booking
+        fields = "__all__"
+
+    def clean(self):
+        cleaned_data = super().clean()
+        event = cleaned_data.get("event")
+        if event is not None:
+            # The admin validates and saves in one transaction, so the lock
+            # is held until the booking has reserved its tickets
+            Event.objects.select_for_update().filter(pk=event.pk).first()
+        return cleaned_data
+
+
 class ReportFilterForm(forms.Form):
     """Form for filtering the booking report."""
 
@@ -495,3 +534,15 @@ class ReportFilterForm(forms.Form):
             }
         ),
     )
+
+
+class BankStatementForm(forms.Form):
+    """Form for uploading a bank statement to reconcile."""
+
+    statement = forms.FileField(
+        help_text="A CSV or OFX export of the account's transactions",
+    )
+    dry_run = forms.BooleanField(
+        required=False,
+        label="Only show the matches; don't mark any bookings paid",
+    )
@@ -0,0 +1,327 @@
+"""
+HMRC Gift Aid claim schedules.
+
+Builds the donations schedule for a Charities Online claim from paid
+bookings that opted in to Gift Aid. Each schedule is an OpenDocument
+spreadsheet laid out like HMRC's Gift Aid schedule template: its heading,
+the earliest donation date, then the donations table (item, title, first
+name, last name, house name or number, postcode, aggregated donations,
+sponsored event, donation date as DD/MM/YY, amount), split into files of
+at most GIFT_AID_SCHEDULE_ROWS rows.
+
+Only the donation can be claimed. The ticket price (BookingFormV3's
+TICKET_PRICE per ticket) pays for admission, so it's taken off each
+booking's donation_amount, and bookings that paid no more than that are
+skipped.
+
+Bookings are read as value tuples in chunks and each schedule is written
+as it fills, so a whole tax year can be regenerated without loading Booking
+instances or holding more than one chunk in memory.
+"""
+
+import os
+import re
+import zipfile
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+from xml.sax.saxutils import escape, quoteattr
+
+from django.utils import timezone
+
+from .forms import BookingFormV3
+
+# HMRC accepts at most 1000 donations on each schedule spreadsheet
+GIFT_AID_SCHEDULE_ROWS = 1000
+GIFT_AID_CHUNK_SIZE = 2000
+
+# HMRC field length limits
+MAX_NAME_LENGTH = 35
+MAX_HOUSE_LENGTH = 40
+
+# The rows above the donations table in HMRC's template
+SCHEDULE_TITLE = "Gift Aid schedule"
+EARLIEST_DATE_LABEL = "Earliest donation date in the period of claim. (DD/MM/YY)"
+DATE_FORMAT = "%d/%m/%y"
+
+SCHEDULE_HEADINGS = [
+    "Item",
+    "Title",
+    "First name or initial",
+    "Last name",
+    "House name or number",
+    "Postcode",
+    "Aggregated donations",
+    "Sponsored event",
+    "Donation date (DD/MM/YY)",
+    "Amount",
+]
+
+# HMRC accepts titles of up to four characters
+TITLES = {"MR", "MRS", "MS", "MISS", "MX", "DR", "REV", "PROF", "SIR", "LADY", "LORD"}
+
+POSTCODE_RE = re.compile(r"^([A-Z]{1,2}[0-9][A-Z0-9]?)([0-9][A-Z]{2})$")
+NON_ALPHANUMERIC_RE = re.compile(r"[^A-Z0-9]")
+HOUSE_NUMBER_RE = re.compile(r"^\s*(\d+[A-Za-z]?(?:-\d+[A-Za-z]?)?)\b")
+
+ClaimRow = namedtuple(
+    "ClaimRow",
+    "booking_id title first_name last_name house postcode donation_date amount",
+)
+
+CLAIM_FIELDS = (
+    "id",
+    "full_name",
+    "address_line1",
+    "postcode",
+    "created_at",
+    "num_tickets",
+    "donation_amount",
+)
+
+
+def tax_year_start(day):
+    """Return the 6 April on or before ``day``."""
+    start = day.replace(month=4, day=6)
+    if day < start:
+        start = start.replace(year=start.year - 1)
+    return start
+
+
+def normalise_postcodes(postcodes):
+    """
+    Normalise a batch of postcodes to HMRC's format ("SW1A 1AA").
+
+    Returns a list in the same order, with None for values that aren't
+    valid UK postcodes. Each distinct value is only parsed once.
+    """
+    normalised = {}
+    for postcode in set(postcodes):
+        compact = NON_ALPHANUMERIC_RE.sub("", (postcode or "").upper())
+        match = POSTCODE_RE.match(compact)
+        normalised[postcode] = f"{match[1]} {match[2]}" if match else None
+    return [normalised[postcode] for postcode in postcodes]
+
+
+def split_name(full_name):
+    """Split a full name into (title, first name, last name)."""
+    parts = full_name.split()
+    title = ""
+    if len(parts) > 2 and parts[0].rstrip(".").upper() in TITLES:
+        title = parts.pop(0).rstrip(".")
+    if len(parts) < 2:
+        return title, "", ""
+    return (
+        title,
+        " ".join(parts[:-1])[:MAX_NAME_LENGTH],
+        parts[-1][:MAX_NAME_LENGTH],
+    )
+
+
+def claimable_amount(num_tickets, donation_amount):
+    """The part of a booking's payment that's a donation, not admission."""
+    return donation_amount - num_tickets * BookingFormV3.TICKET_PRICE
+
+
+def house_name_or_number(address_line1):
+    """Take the house number, or failing that the house name, from an address."""
+    address_line1 = (address_line1 or "").strip()
+    match = HOUSE_NUMBER_RE.match(address_line1)
+    if match:
+        return match[1]
+    return address_line1.split(",")[0].strip()[:MAX_HOUSE_LENGTH]
+
+
+class GiftAidClaim:
+    """
+    The Gift Aid schedule rows for ``queryset``, limited to paid bookings
+    with Gift Aid. Bookings that can't be claimed are listed in ``skipped``
+    as (booking_id, reason) once the rows have been read.
+    """
+
+    def __init__(self, queryset, chunk_size=GIFT_AID_CHUNK_SIZE):
+        self.queryset = queryset.filter(gift_aid=True, is_paid=True).order_by(
+            "created_at", "id"
+        )
+        self.chunk_size = chunk_size
+        self.skipped = []
+
+    @classmethod
+    def for_dates(cls, queryset, start, end, **kwargs):
+        """Bookings made between ``start`` and ``end`` (inclusive dates)."""
+        tz = timezone.get_current_timezone()
+        return cls(
+            queryset.filter(
+                created_at__gte=datetime.combine(start, time.min, tzinfo=tz),
+                created_at__lt=datetime.combine(end + timedelta(days=1), time.min, tzinfo=tz),
+            ),
+            **kwargs,
+        )
+
+    def rows(self):
+        """Yield a ClaimRow for each claimable booking."""
+        self.skipped = []
+        chunk = []
+        values = self.queryset.values_list(*CLAIM_FIELDS).iterator(
+            chunk_size=self.chunk_size
+        )
+        for values_row in values:
+            chunk.append(values_row)
+            if len(chunk) >= self.chunk_size:
+                yield from self._claim_rows(chunk)
+                chunk = []
+        yield from self._claim_rows(chunk)
+
+    def _claim_rows(self, chunk):
+        postcodes = normalise_postcodes([values_row[3] for values_row in chunk])
+        for values_row, postcode in zip(chunk, postcodes):
+            booking_id, full_name, address_line1, _, created_at, num_tickets, donation = (
+                values_row
+            )
+            amount = claimable_amount(num_tickets, donation)
+            title, first_name, last_name = split_name(full_name)
+            house = house_name_or_number(address_line1)
+            if not last_name:
+                self.skipped.append((booking_id, "no first and last name"))
+            elif not house:
+                self.skipped.append((booking_id, "no house name or number"))
+            elif postcode is None:
+                self.skipped.append((booking_id, "invalid postcode"))
+            elif amount <= 0:
+                self.skipped.append((booking_id, "no donation beyond the ticket price"))
+            else:
+                yield ClaimRow(
+                    booking_id,
+                    title,
+                    first_name,
+                    last_name,
+                    house,
+                    postcode,
+                    timezone.localtime(created_at).strftime(DATE_FORMAT),
+                    amount,
+                )
+
+    def schedules(self, max_rows=GIFT_AID_SCHEDULE_ROWS):
+        """Yield lists of at most ``max_rows`` rows, one per schedule file."""
+        schedule = []
+        for row in self.rows():
+            schedule.append(row)
+            if len(schedule) >= max_rows:
+                yield schedule
+                schedule = []
+        if schedule:
+            yield schedule
+
+    def write(self, output_dir, prefix="gift-aid-claim", max_rows=GIFT_AID_SCHEDULE_ROWS):
+        """Write the schedules to ``output_dir`` and return their paths."""
+        os.makedirs(output_dir, exist_ok=True)
+        paths = []
+        for number, schedule in enumerate(self.schedules(max_rows), start=1):
+            path = os.path.join(output_dir, f"{prefix}-{number:02d}.ods")
+            with open(path, "wb") as f:
+                write_schedule(schedule, f)
+            paths.append(path)
+        return paths
+
+    def write_zip(self, fileobj, prefix="gift-aid-claim", max_rows=GIFT_AID_SCHEDULE_ROWS):
+        """
+        Write the schedules into a zip archive, with a list of any skipped
+        bookings, and return how many schedules there were.
+        """
+        count = 0
+        with zipfile.ZipFile(fileobj, "w") as archive:
+            for count, schedule in enumerate(self.schedules(max_rows), start=1):
+                with archive.open(f"{prefix}-{count:02d}.ods", "w") as f:
+                    write_schedule(schedule, f)
+            if self.skipped:
+                archive.writestr(
+                    "skipped.txt",
+                    "".join(
+                        f"SIB-{booking_id}: {reason}\n" for booking_id, reason in self.skipped
+                    ),
+                )
+        return count
+
+
+ODS_MANIFEST = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<manifest:manifest xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0" '
+    'manifest:version="1.2">'
+    '<manifest:file-entry manifest:full-path="/" '
+    'manifest:media-type="application/vnd.oasis.opendocument.spreadsheet"/>'
+    '<manifest:file-entry manifest:full-path="content.xml" manifest:media-type="text/xml"/>'
+    "</manifest:manifest>"
+)
+ODS_CONTENT_START = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<office:document-content '
+    'xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+    'xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0" '
+    'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0" '
+    'office:version="1.2">'
+    "<office:body><office:spreadsheet>"
+    '<table:table table:name="Donations">'
+)
+ODS_CONTENT_END = "</table:table></office:spreadsheet></office:body></office:document-content>"
+
+
+def _ods_cell(value):
+    if hasattr(value, "as_tuple"):
+        return (
+            f'<table:table-cell office:value-type="float" office:value={quoteattr(str(value))}>'
+            f"<text:p>{value:.2f}</text:p></table:table-cell>"
+        )
+    if isinstance(value, int):
+        return (
+            f'<table:table-cell office:value-type="float" office:value="{value}">'
+            f"<text:p>{value}</text:p></table:table-cell>"
+        )
+    return (
+        '<table:table-cell office:value-type="string">'
+        f"<text:p>{escape(str(value))}</text:p></table:table-cell>"
+    )
+
+
+def _ods_row(values):
+    return f"<table:table-row>{''.join(_ods_cell(value) for value in values)}</table:table-row>"
+
+
+def schedule_rows(rows):
+    """
+    Yield the cell values of each row of a schedule of ClaimRows, from the
+    template's heading down, in HMRC's layout.
+    """
+    yield [SCHEDULE_TITLE]
+    yield [""]
+    yield [EARLIEST_DATE_LABEL, rows[0].donation_date if rows else ""]
+    yield [""]
+    yield SCHEDULE_HEADINGS
+    for item, row in enumerate(rows, start=1):
+        yield [
+            item,
+            row.title,
+            row.first_name,
+            row.last_name,
+            row.house,
+            row.postcode,
+            "",
+            "",
+            row.donation_date,
+            row.amount,
+        ]
+
+
+def write_schedule(rows, fileobj):
+    """Write one schedule of ClaimRows to ``fileobj`` as an ODS spreadsheet."""
+    with zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        # The mimetype must come first, uncompressed
+        archive.writestr(
+            zipfile.ZipInfo("mimetype"),
+            "application/vnd.oasis.opendocument.spreadsheet",
+            compress_type=zipfile.ZIP_STORED,
+        )
+        archive.writestr("META-INF/manifest.xml", ODS_MANIFEST)
+        with archive.open("content.xml", "w") as content:
+            content.write(ODS_CONTENT_START.encode())
+            for values in schedule_rows(rows):
+                content.write(_ods_row(values).encode())
+            content.write(ODS_CONTENT_END.encode())
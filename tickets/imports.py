@@ -0,0 +1,301 @@
+"""
+Bulk booking imports.
+
+Offline and phone bookings can be imported from a CSV file (with a header
+row) or a JSON Lines file (one object per line) with these columns:
+
+    full_name, email, phone_number, num_tickets, extra_donation, gift_aid,
+    gift_aid_confirmation, address_line1, address_line2, city, postcode,
+    is_paid, idempotency_key
+
+Each row is validated with BookingFormV3's fields and Gift Aid rules, and
+priced the same way (TICKET_PRICE per ticket plus the extra donation).
+Rows that fail are reported and skipped; the rest are inserted with
+bulk_create, one transaction per batch, which also reserves the event's
+tickets and updates the booking summary, as saving bookings one at a time
+would. Rows whose idempotency_key has already been imported are skipped,
+so an import that was interrupted can be run again.
+
+Imported bookings are marked as already notified, so they don't fill the
+next admin digest, and no confirmation emails are sent.
+"""
+
+import csv
+import json
+from collections import namedtuple
+from contextlib import nullcontext
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from .forms import BookingFormV3
+from .models import Booking, BookingSummary, Event, SoldOut
+
+IMPORT_BATCH_SIZE = 1000
+
+IMPORT_COLUMNS = (
+    "full_name",
+    "email",
+    "phone_number",
+    "num_tickets",
+    "extra_donation",
+    "gift_aid",
+    "gift_aid_confirmation",
+    "address_line1",
+    "address_line2",
+    "city",
+    "postcode",
+    "is_paid",
+    "idempotency_key",
+)
+BOOLEAN_COLUMNS = ("gift_aid", "gift_aid_confirmation", "is_paid")
+TRUE_VALUES = {"1", "y", "yes", "true", "t"}
+FALSE_VALUES = {"", "0", "n", "no", "false", "f"}
+
+# Booking fields copied from a row's cleaned data
+BOOKING_FIELDS = (
+    "full_name",
+    "email",
+    "phone_number",
+    "num_tickets",
+    "gift_aid",
+    "address_line1",
+    "address_line2",
+    "city",
+    "postcode",
+    "idempotency_key",
+)
+
+RowError = namedtuple("RowError", "row field message")
+
+
+def read_rows(fileobj, format):
+    """
+    Yield (row number, dict) for each row of a CSV or JSON Lines file.
+    CSV rows are numbered by the line they end on, after the header.
+    """
+    if format == "csv":
+        reader = csv.DictReader(fileobj)
+        for row in reader:
+            yield reader.line_num, row
+    elif format == "jsonl":
+        for line_number, line in enumerate(fileobj, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                row = {"__error__": f"Not valid JSON: {e}"}
+            if not isinstance(row, dict):
+                row = {"__error__": "Not a JSON object"}
+            yield line_number, row
+    else:
+        raise ValueError(f"Unknown import format: {format}")
+
+
+def parse_boolean(value):
+    """Read a yes/no column, accepting JSON booleans and common spellings."""
+    if value is None or isinstance(value, bool):
+        return bool(value)
+    normalised = str(value).strip().lower()
+    if normalised in TRUE_VALUES:
+        return True
+    if normalised in FALSE_VALUES:
+        return False
+    raise ValidationError("Enter yes or no.")
+
+
+class BookingImport:
+    """
+    Validate and insert bookings from rows of import data.
+
+    After run(), ``imported`` and ``already_imported`` count the rows
+    inserted and skipped as duplicates, and ``errors`` lists a
+    RowError(row, field, message) for every problem found.
+    """
+
+    def __init__(self, event=None, is_paid=False, batch_size=IMPORT_BATCH_SIZE, dry_run=False):
+        self.event = event
+        self.is_paid = is_paid
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.imported = 0
+        self.already_imported = 0
+        self.errors = []
+        self.seen_keys = set()
+        # A single copy of the form's fields, with its conditional required
+        # flags, validates every row; building a form for each row would
+        # spend most of the import deep-copying fields and widgets
+        self.fields = {
+            name: field
+            for name, field in BookingFormV3().fields.items()
+            if name in IMPORT_COLUMNS
+        }
+        self.now = timezone.now()
+
+    def run(self, rows):
+        """Import every row, a batch at a time. Returns the number imported."""
+        # A dry run imports everything in one transaction that's rolled
+        # back, so later batches see the tickets reserved by earlier ones
+        with transaction.atomic() if self.dry_run else nullcontext():
+            batch = []
+            for row_number, row in rows:
+                booking = self.build_booking(row_number, row)
+                if booking is not None:
+                    batch.append((row_number, booking))
+                if len(batch) >= self.batch_size:
+                    self.insert(batch)
+                    batch = []
+            if batch:
+                self.insert(batch)
+            if self.dry_run:
+                transaction.set_rollback(True)
+        return self.imported
+
+    def build_booking(self, row_number, row):
+        """Validate a row and return an unsaved Booking, or None if it has errors."""
+        if "__error__" in row:
+            self.errors.append(RowError(row_number, None, row["__error__"]))
+            return None
+
+        cleaned_data = {}
+        errors = {}
+        for name, field in self.fields.items():
+            value = row.get(name)
+            if isinstance(value, str):
+                value = value.strip()
+            try:
+                if name in BOOLEAN_COLUMNS:
+                    value = parse_boolean(value)
+                cleaned_data[name] = field.clean(value)
+            except ValidationError as e:
+                errors[name] = " ".join(e.messages)
+
+        # Rows without a payment status take the import's default
+        is_paid = self.is_paid
+        if row.get("is_paid") not in (None, ""):
+            try:
+                is_paid = parse_boolean(row["is_paid"])
+            except ValidationError as e:
+                errors["is_paid"] = " ".join(e.messages)
+        errors.update(
+            (field, message)
+            for field, message in BookingFormV3.gift_aid_errors(cleaned_data).items()
+            if field not in errors
+        )
+
+        key = cleaned_data.get("idempotency_key")
+        if key is not None and not errors:
+            if key in self.seen_keys:
+                errors["idempotency_key"] = "Appears earlier in the file."
+            self.seen_keys.add(key)
+
+        if errors:
+            self.errors.extend(
+                RowError(row_number, field, message) for field, message in errors.items()
+            )
+            return None
+
+        return Booking(
+            **{name: cleaned_data[name] for name in BOOKING_FIELDS},
+            donation_amount=BookingFormV3.donation_amount(
+                cleaned_data["num_tickets"], cleaned_data["extra_donation"]
+            ),
+            is_paid=is_paid,
+            event=self.event,
+            admin_notified_at=self.now,
+        )
+
+    def insert(self, batch):
+        """
+        Insert a batch of validated bookings in one transaction. Its counts
+        and errors are only recorded once the transaction has committed.
+        """
+        rejected = []
+        try:
+            with transaction.atomic():
+                batch, already_imported = self.skip_already_imported(batch)
+                batch, rejected = self.fit_capacity(batch)
+                self.reserve_tickets(batch)
+                bookings = [booking for _, booking in batch]
+                Booking.objects.bulk_create(bookings)
+                self.adjust_summary(bookings)
+        except SoldOut:
+            # Bookings were made on the site while the batch was checked
+            sold_out = [
+                RowError(row_number, "num_tickets", "Not enough tickets left for this event.")
+                for row_number, _ in batch
+            ]
+            self.errors.extend(sorted(rejected + sold_out, key=lambda error: error.row))
+            return
+        self.errors.extend(rejected)
+        self.already_imported += already_imported
+        self.imported += len(bookings)
+
+    def adjust_summary(self, bookings):
+        # bulk_create bypasses the signals that maintain the summary
+        buckets = {}
+        for booking in bookings:
+            counts = buckets.setdefault((booking.is_paid, booking.gift_aid), [0, 0, 0])
+            counts[0] += 1
+            counts[1] += booking.num_tickets
+            counts[2] += booking.donation_amount
+        for (is_paid, gift_aid), (count, tickets, amount) in buckets.items():
+            BookingSummary.objects.adjust(
+                is_paid, gift_aid, bookings=count, tickets=tickets, amount=amount
+            )
+
+    def skip_already_imported(self, batch):
+        """
+        Return the batch without the rows whose idempotency key has already
+        been imported, and the number skipped.
+        """
+        keys = [booking.idempotency_key for _, booking in batch if booking.idempotency_key]
+        if not keys:
+            return batch, 0
+        existing = set(
+            Booking.objects.filter(idempotency_key__in=keys).values_list(
+                "idempotency_key", flat=True
+            )
+        )
+        return [
+            (row_number, booking)
+            for row_number, booking in batch
+            if booking.idempotency_key not in existing
+        ], len(existing)
+
+    def fit_capacity(self, batch):
+        """
+        Return the rows of the batch that fit in the event's remaining
+        capacity, and a RowError for each that doesn't.
+        """
+        if self.event is None:
+            return batch, []
+
+        capacity, tickets_sold = (
+            Event.objects.filter(pk=self.event.pk).values_list("capacity", "tickets_sold").get()
+        )
+        remaining = capacity - tickets_sold
+        accepted = []
+        rejected = []
+        for row_number, booking in batch:
+            if booking.num_tickets > remaining:
+                rejected.append(
+                    RowError(
+                        row_number,
+                        "num_tickets",
+                        f"Only {remaining} ticket(s) left for this event.",
+                    )
+                )
+                continue
+            remaining -= booking.num_tickets
+            accepted.append((row_number, booking))
+        return accepted, rejected
+
+    def reserve_tickets(self, batch):
+        """Take the batch's tickets from the event, or raise SoldOut."""
+        tickets = sum(booking.num_tickets for _, booking in batch)
+        # reserve() rechecks the capacity, in case bookings were made since
+        if self.event is not None and tickets and not Event.objects.reserve(self.event.pk, tickets):
+            raise SoldOut(self.event.pk, tickets)
@@ -0,0 +1,329 @@
+"""
+Request instrumentation.
+
+InstrumentationMiddleware times each request and tags it with its view: the
+view class's name (BookingCreateViewV3, BookingReportView, ...) or else the
+URL name. While a request runs, the time it spends in database queries,
+template rendering and sending email is added up by the hooks below. When
+it finishes, the request is:
+
+- logged to the "tickets.requests" logger as one structured record (JSON
+  lines, with the logging settings), at WARNING if it took longer than
+  SLOW_REQUEST_THRESHOLD seconds;
+- added to the metrics served at /metrics in Prometheus' text format.
+
+Any query taking longer than SLOW_QUERY_THRESHOLD seconds is logged with
+its SQL to "tickets.db", inside a request or not. Parameters are left out,
+as they hold bookers' personal details.
+
+Metrics are kept per process. The Docker image runs a single gunicorn
+worker; with more, a scrape sees only the worker that answers it. Work done
+outside requests, like the outbox worker's, is logged but not in /metrics.
+"""
+
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates, Template
+
+request_logger = logging.getLogger("tickets.requests")
+db_logger = logging.getLogger("tickets.db")
+
+# Upper bounds, in seconds, of the request duration histogram's buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRICS = {
+    "tickets_requests_total": ("counter", "Requests handled"),
+    "tickets_request_duration_seconds": ("histogram", "Request wall time"),
+    "tickets_db_queries_total": ("counter", "Database queries run"),
+    "tickets_db_query_seconds_total": ("counter", "Time spent in database queries"),
+    "tickets_slow_queries_total": ("counter", "Queries over SLOW_QUERY_THRESHOLD"),
+    "tickets_template_render_seconds_total": ("counter", "Time spent rendering templates"),
+    "tickets_email_send_seconds_total": ("counter", "Time spent sending email"),
+    "tickets_emails_sent_total": ("counter", "Emails sent"),
+}
+
+
+class Metrics:
+    """Counters and histograms for this process, rendered for Prometheus."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        # {(name, labels): [count per bucket..., +Inf count, sum]}
+        self._histograms = {}
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self._counters[name, labels] += value
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            histogram = self._histograms.setdefault(
+                (name, labels), [0] * (len(DURATION_BUCKETS) + 1) + [0.0]
+            )
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += value
+
+    def render(self):
+        """Return the metrics in Prometheus' text exposition format."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(values) for key, values in self._histograms.items()}
+
+        lines = []
+        for name, (kind, description) in METRICS.items():
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+            if kind == "counter":
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{format_labels(labels)} {value:g}")
+                continue
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(DURATION_BUCKETS + ("+Inf",), values):
+                    bucket_labels = labels + (("le", str(bound)),)
+                    lines.append(f"{name}_bucket{format_labels(bucket_labels)} {count}")
+                lines.append(f"{name}_count{format_labels(labels)} {values[-2]}")
+                lines.append(f"{name}_sum{format_labels(labels)} {values[-1]:g}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+metrics = Metrics()
+
+
+class Stats:
+    """What a request, or another tracked unit of work, spent its time on."""
+
+    __slots__ = (
+        "view",
+        "request",
+        "duration",
+        "db_queries",
+        "db_time",
+        "slow_queries",
+        "template_time",
+        "email_time",
+        "emails_sent",
+    )
+
+    def __init__(self, view=None, request=None):
+        self.view = view
+        self.request = request
+        self.duration = 0.0
+        self.db_queries = self.slow_queries = self.emails_sent = 0
+        self.db_time = self.template_time = self.email_time = 0.0
+
+    def get_view(self):
+        if self.view is None and self.request is not None:
+            return view_name(self.request)
+        return self.view
+
+    def as_dict(self):
+        return {
+            "view": self.get_view(),
+            "duration_ms": round(self.duration * 1000, 2),
+            "db_queries": self.db_queries,
+            "db_ms": round(self.db_time * 1000, 2),
+            "slow_queries": self.slow_queries,
+            "template_ms": round(self.template_time * 1000, 2),
+            "email_ms": round(self.email_time * 1000, 2),
+            "emails_sent": self.emails_sent,
+        }
+
+
+_current = contextvars.ContextVar("tickets_instrumentation_stats", default=None)
+
+
+@contextmanager
+def track(view=None, request=None):
+    """
+    Add up the time spent by the code in the block, for one request or
+    other unit of work (such as a batch of outbox emails).
+    """
+    stats = Stats(view, request)
+    token = _current.set(stats)
+    started = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        stats.duration = time.perf_counter() - started
+        _current.reset(token)
+
+
+def view_name(request):
+    """Return the name requests to ``request``'s view are tagged with."""
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unresolved"
+    view_class = getattr(match.func, "view_class", None)
+    if view_class is not None:
+        return view_class.__name__
+    return match.view_name or match.func.__name__
+
+
+def record_request(stats, request, response):
+    """Log a finished request and add it to the metrics."""
+    view = stats.get_view()
+    labels = (("view", view),)
+    metrics.inc(
+        "tickets_requests_total",
+        labels + (("method", request.method), ("status", response.status_code)),
+    )
+    metrics.observe("tickets_request_duration_seconds", labels, stats.duration)
+    metrics.inc("tickets_db_queries_total", labels, stats.db_queries)
+    metrics.inc("tickets_db_query_seconds_total", labels, stats.db_time)
+    metrics.inc("tickets_slow_queries_total", labels, stats.slow_queries)
+    metrics.inc("tickets_template_render_seconds_total", labels, stats.template_time)
+    metrics.inc("tickets_email_send_seconds_total", labels, stats.email_time)
+    metrics.inc("tickets_emails_sent_total", labels, stats.emails_sent)
+
+    slow = stats.duration > settings.SLOW_REQUEST_THRESHOLD
+    request_logger.log(
+        logging.WARNING if slow else logging.INFO,
+        "%s %s %s in %.1f ms",
+        request.method,
+        request.path,
+        response.status_code,
+        stats.duration * 1000,
+        extra={
+            "data": {
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                **stats.as_dict(),
+            }
+        },
+    )
+
+
+class InstrumentationMiddleware:
+    """Time each request and record it (see the module docstring)."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with track(request=request) as stats:
+            response = self.get_response(request)
+        record_request(stats, request, response)
+        return response
+
+    async def __acall__(self, request):
+        with track(request=request) as stats:
+            response = await self.get_response(request)
+        record_request(stats, request, response)
+        return response
+
+
+def time_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper, installed on every connection (see
+    TicketsConfig.ready), that times queries and logs slow ones.
+    """
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        stats = _current.get()
+        if stats is not None:
+            stats.db_queries += 1
+            stats.db_time += duration
+        if duration > settings.SLOW_QUERY_THRESHOLD:
+            if stats is not None:
+                stats.slow_queries += 1
+            view = stats.get_view() if stats is not None else None
+            db_logger.warning(
+                "Slow query in %s (%.1f ms)",
+                view or "no request",
+                duration * 1000,
+                extra={
+                    "data": {
+                        "duration_ms": round(duration * 1000, 2),
+                        "sql": sql,
+                        "many": many,
+                        "view": view,
+                        "database": context["connection"].alias,
+                    }
+                },
+            )
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """connection_created receiver that adds time_query() to a new connection."""
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+def record_email_send(duration, sent):
+    """Add an email backend's send time to the current request's stats."""
+    stats = _current.get()
+    if stats is not None:
+        stats.email_time += duration
+        stats.emails_sent += sent
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats = _current.get()
+            if stats is not None:
+                stats.template_time += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing each template it renders."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+class JSONFormatter(logging.Formatter):
+    """Format log records as JSON lines, with any ``data`` passed in ``extra``."""
+
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **getattr(record, "data", {}),
+        }
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
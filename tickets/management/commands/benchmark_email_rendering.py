@@ -0,0 +1,95 @@
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+from tickets.email_templates import render_email
+from tickets.models import Booking
+from tickets.utils import render_admin_digest_email, render_booking_confirmation_email
+
+
+class Command(BaseCommand):
+    help = (
+        "Time rendering the booking confirmation and admin digest "
+        "emails, with plain text from the .txt templates, against rendering "
+        "the HTML alone and stripping its tags."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=2000,
+            help="Emails to render with each method (default: 2000)",
+        )
+
+    def handle(self, *args, **options):
+        booking = Booking(
+            id=123456,
+            full_name="Ada Lovelace",
+            email="ada@example.com",
+            phone_number="01295 000000",
+            num_tickets=3,
+            donation_amount=Decimal("75.00"),
+            gift_aid=True,
+            address_line1="1 Main Street",
+            city="Sibford Gower",
+            postcode="OX15 5RX",
+            created_at=timezone.now(),
+        )
+        context = {
+            "booking": booking,
+            "payment_reference": booking.payment_reference(),
+            "bank_details": settings.BANK_DETAILS,
+            # The digest's, for a single booking
+            "bookings": [booking],
+            "total_tickets": booking.num_tickets,
+            "total_amount": booking.donation_amount,
+            "gift_aid_count": 1,
+            "admin_url": "#",
+        }
+
+        for label, template_name, render in (
+            (
+                "Booking confirmation",
+                "tickets/emails/booking_confirmation",
+                lambda: render_booking_confirmation_email(booking),
+            ),
+            (
+                "Admin digest",
+                "tickets/emails/admin_digest",
+                lambda: render_admin_digest_email([booking]),
+            ),
+        ):
+            def strip_tags_render():
+                html_message = render_to_string(f"{template_name}.html", context)
+                return strip_tags(html_message), html_message
+
+            # Warm the template cache for both
+            strip_tags_render()
+            render()
+
+            old = self.time(strip_tags_render, options["iterations"])
+            new = self.time(render, options["iterations"])
+            self.stdout.write(
+                f"{label}: {old * 1000:.3f} ms rendering HTML and stripping tags, "
+                f"{new * 1000:.3f} ms rendering HTML and text templates "
+                f"({old / new:.1f}x)"
+            )
+
+        _, html_message = render_email("tickets/emails/booking_confirmation", context)
+        self.stdout.write(
+            f"Booking confirmation HTML: {len(html_message)} bytes, "
+            f"{html_message.count('style=')} inline styles"
+        )
+
+    def time(self, render, iterations):
+        """Return the average seconds ``render`` takes."""
+        start = time.perf_counter()
+        for _ in range(iterations):
+            render()
+        return (time.perf_counter() - start) / iterations
@@ -0,0 +1,462 @@
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+from collections import Counter
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from django.utils import timezone
+
+from tickets.benchmarks import (
+    HIDDEN_INPUT_RE,
+    BenchmarkError,
+    SMTPSink,
+    build_opener,
+    fetch_form,
+    start_server,
+    submit_form,
+    summarise_latencies,
+)
+
+SIZES = (10_000, 100_000, 1_000_000)
+
+# Scenario name: (URL name, query string)
+BOOKING_SCENARIOS = {
+    "booking_v1": ("home_v1", ""),
+    "booking_v2": ("home_v2", ""),
+    "booking_v3": ("home_v3", ""),
+}
+REPORT_SCENARIOS = {
+    "report": ("booking_report", ""),
+    "report_filtered": ("booking_report", "?payment_status=unpaid&gift_aid=yes"),
+    "report_search": ("booking_report", "?search=Smith"),
+}
+SCENARIOS = {**BOOKING_SCENARIOS, **REPORT_SCENARIOS}
+
+BENCHMARK_USERNAME = "benchmark"
+BENCHMARK_PASSWORD = "benchmark-password"
+
+# Run in each benchmark database: a staff user for the report, and an open
+# event with room for every booking, so bookings reserve tickets as usual
+SETUP_SCRIPT = f"""
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.utils import timezone
+from tickets.models import Event
+
+user, _ = User.objects.get_or_create(username="{BENCHMARK_USERNAME}")
+user.is_staff = True
+user.set_password("{BENCHMARK_PASSWORD}")
+user.save()
+if not Event.objects.filter(is_open=True).exists():
+    Event.objects.create(
+        name="Benchmark event",
+        starts_at=timezone.now() + timedelta(days=30),
+        capacity=10**9,
+    )
+"""
+COUNT_SCRIPT = "from tickets.models import Booking; print(Booking.objects.count())"
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the booking forms (V1, V2 and V3) and the booking report "
+        "against a local gunicorn, with databases seeded with 10k, 100k and 1M "
+        "bookings. Email goes to a local SMTP sink, delivered by the outbox "
+        "worker as in production. Reports latency percentiles, requests per "
+        "second and queries per request (from the request logs), and saves "
+        "the results as JSON to compare between commits with --compare. Each "
+        "database is seeded once, in --workdir, and reused by later runs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            type=int,
+            nargs="+",
+            default=list(SIZES),
+            help="Bookings to seed each database with (default: 10000 100000 1000000)",
+        )
+        parser.add_argument(
+            "--scenarios",
+            nargs="+",
+            choices=list(SCENARIOS),
+            default=list(SCENARIOS),
+            help="Scenarios to run (default: all)",
+        )
+        parser.add_argument(
+            "--clients",
+            type=int,
+            default=4,
+            help="Concurrent clients in each scenario (default: 4)",
+        )
+        parser.add_argument(
+            "--duration",
+            type=float,
+            default=10,
+            help="Seconds to run each scenario for (default: 10)",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Gunicorn worker processes (default: 1)",
+        )
+        parser.add_argument(
+            "--server-mode",
+            choices=["wsgi", "asgi"],
+            default="wsgi",
+            help="How gunicorn serves the site; see gunicorn.conf.py (default: wsgi)",
+        )
+        parser.add_argument(
+            "--port",
+            type=int,
+            default=8770,
+            help="Port to run the server on (default: 8770)",
+        )
+        parser.add_argument(
+            "--workdir",
+            default=str(Path(tempfile.gettempdir()) / "sibford-benchmarks"),
+            help="Directory for the seeded databases and server logs "
+            "(default: sibford-benchmarks in the temp directory)",
+        )
+        parser.add_argument(
+            "--reseed",
+            action="store_true",
+            help="Seed the databases again even if they already exist",
+        )
+        parser.add_argument(
+            "--database-url",
+            help="Benchmark this database, already seeded, instead of seeding "
+            "SQLite ones (--sizes is ignored)",
+        )
+        parser.add_argument(
+            "--output",
+            help="JSON file to save the results to "
+            "(default: benchmark-results/<commit>.json)",
+        )
+        parser.add_argument(
+            "--compare",
+            help="JSON results of an earlier run to compare these with",
+        )
+
+    def handle(self, *args, **options):
+        workdir = Path(options["workdir"])
+        workdir.mkdir(parents=True, exist_ok=True)
+        commit = self.git_commit()
+        output = Path(
+            options["output"] or settings.BASE_DIR / "benchmark-results" / f"{commit}.json"
+        )
+        baseline = None
+        if options["compare"]:
+            try:
+                baseline = json.loads(Path(options["compare"]).read_text())
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Can't read {options['compare']}: {e}")
+
+        results = {
+            "commit": commit,
+            "created_at": timezone.now().isoformat(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "debug": settings.DEBUG,
+            "options": {
+                key: options[key]
+                for key in ("clients", "duration", "workers", "server_mode", "scenarios")
+            },
+            # The database tuning settings the server ran with
+            "environment": {
+                key: value
+                for key, value in sorted(os.environ.items())
+                if key.startswith(("DB_", "SQLITE_")) or key == "CACHE_URL"
+            },
+            "sizes": {},
+        }
+
+        with SMTPSink() as sink:
+            if options["database_url"]:
+                env = {
+                    **sink.environ,
+                    "DATABASE_URL": options["database_url"],
+                    "LOG_LEVEL": "INFO",
+                }
+                self.manage(env, "migrate", "--no-input")
+                self.manage(env, "shell", "-c", SETUP_SCRIPT)
+                size = int(self.manage(env, "shell", "-c", COUNT_SCRIPT).split()[-1])
+                self.stdout.write(f"{size} bookings:")
+                results["sizes"][str(size)] = self.run_size(size, env, workdir, sink, options)
+            else:
+                for size in options["sizes"]:
+                    database = workdir / f"bookings-{size}.sqlite3"
+                    env = {
+                        **sink.environ,
+                        "DATABASE_URL": f"sqlite:///{database}",
+                        "LOG_LEVEL": "INFO",
+                    }
+                    self.prepare_database(database, size, env, options["reseed"])
+                    self.stdout.write(f"{size} bookings:")
+                    results["sizes"][str(size)] = self.run_size(
+                        size, env, workdir, sink, options
+                    )
+
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2) + "\n")
+        self.stdout.write(self.style.SUCCESS(f"Saved the results to {output}"))
+
+        if baseline is not None:
+            self.compare(baseline, results)
+
+    def git_commit(self):
+        """Return the current commit's short hash, marked -dirty if there are changes."""
+        try:
+            commit = subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=settings.BASE_DIR,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+            dirty = subprocess.run(
+                ["git", "status", "--porcelain", "--untracked-files=no"],
+                cwd=settings.BASE_DIR,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return "unknown"
+        return f"{commit}-dirty" if dirty else commit
+
+    def manage(self, env, *args):
+        """Run a manage.py command against a benchmark database and return its output."""
+        result = subprocess.run(
+            [sys.executable, "manage.py", *args],
+            cwd=settings.BASE_DIR,
+            env={**os.environ, **env},
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode:
+            raise CommandError(f"manage.py {args[0]} failed:\n{result.stderr}")
+        return result.stdout
+
+    def prepare_database(self, database, size, env, reseed):
+        if reseed and database.exists():
+            database.unlink()
+        if not database.exists():
+            self.stdout.write(f"Seeding {database} with {size} bookings...")
+            started = time.perf_counter()
+            try:
+                self.manage(env, "migrate", "--no-input")
+                self.manage(env, "seed_bookings", str(size))
+            except CommandError:
+                database.unlink(missing_ok=True)
+                raise
+            self.stdout.write(f"Seeded in {time.perf_counter() - started:.0f}s")
+        else:
+            # Bring a database seeded by an earlier version up to date
+            self.manage(env, "migrate", "--no-input")
+        self.manage(env, "shell", "-c", SETUP_SCRIPT)
+
+    def run_size(self, size, env, workdir, sink, options):
+        base_url = f"http://127.0.0.1:{options['port']}"
+        log_path = workdir / f"server-{size}.log"
+        scenarios = {}
+        with open(log_path, "w") as log, open(workdir / f"outbox-{size}.log", "w") as outbox_log:
+            worker = subprocess.Popen(
+                [sys.executable, "manage.py", "send_queued_emails", "--loop", "--interval", "1"],
+                cwd=settings.BASE_DIR,
+                env={**os.environ, **env},
+                stdout=outbox_log,
+                stderr=outbox_log,
+            )
+            try:
+                server = start_server(
+                    options["server_mode"], options["port"], options["workers"], env, log
+                )
+            except BenchmarkError as e:
+                worker.terminate()
+                raise CommandError(e)
+
+            emails_before = sink.messages
+            try:
+                staff_opener = self.log_in(base_url)
+                for name in options["scenarios"]:
+                    url_name, query = SCENARIOS[name]
+                    url = base_url + reverse(url_name) + query
+                    log.flush()
+                    log_offset = log_path.stat().st_size
+                    if name in BOOKING_SCENARIOS:
+                        result = self.run_clients(
+                            lambda: self.book(url), options["clients"], options["duration"]
+                        )
+                        method = "POST"
+                    else:
+                        result = self.run_clients(
+                            lambda: self.get(staff_opener, url),
+                            options["clients"],
+                            options["duration"],
+                        )
+                        method = "GET"
+                    result.update(self.query_counts(log_path, log_offset, method))
+                    scenarios[name] = result
+                    self.report(name, result)
+            finally:
+                server.terminate()
+                server.wait()
+                # Give the outbox worker a moment to deliver what's queued
+                time.sleep(2)
+                worker_status = worker.poll()
+                worker.terminate()
+                worker.wait()
+
+        emails_delivered = sink.messages - emails_before
+        self.stdout.write(f"  {emails_delivered} email(s) delivered to the SMTP sink")
+        if worker_status is not None:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"  The outbox worker exited with status {worker_status}; "
+                    f"see {outbox_log.name}"
+                )
+            )
+        return {"scenarios": scenarios, "emails_delivered": emails_delivered}
+
+    def log_in(self, base_url):
+        """Sign in as the benchmark staff user and return an opener holding the session."""
+        url = base_url + reverse("admin:login")
+        opener = build_opener()
+        with opener.open(url) as response:
+            match = re.search(HIDDEN_INPUT_RE.format("csrfmiddlewaretoken"), response.read().decode())
+        if not match:
+            raise CommandError(f"No CSRF token in the login form at {url}")
+        body = urllib.parse.urlencode(
+            {
+                "csrfmiddlewaretoken": match[1],
+                "username": BENCHMARK_USERNAME,
+                "password": BENCHMARK_PASSWORD,
+                "next": reverse("booking_report"),
+            }
+        ).encode()
+        status, _, _ = submit_form(opener, url, body)
+        if status != 302:
+            raise CommandError(f"Couldn't sign in to {url} (status {status})")
+        return opener
+
+    def book(self, url):
+        """Fetch a booking form and submit it; return (status, seconds the POST took)."""
+        opener, body = fetch_form(url)
+        status, _, elapsed = submit_form(opener, url, body)
+        return status == 302, status, elapsed
+
+    def get(self, opener, url):
+        started = time.perf_counter()
+        try:
+            with opener.open(url) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        return status == 200, status, time.perf_counter() - started
+
+    def run_clients(self, work, clients, duration):
+        """
+        Call ``work`` from ``clients`` threads for ``duration`` seconds and
+        summarise the latencies of the calls that succeeded.
+        """
+        latencies = []
+        statuses = Counter()
+        lock = threading.Lock()
+        stop = time.monotonic() + duration
+
+        def client():
+            while time.monotonic() < stop:
+                try:
+                    ok, status, elapsed = work()
+                except (OSError, BenchmarkError) as e:
+                    ok, status, elapsed = False, type(e).__name__, None
+                with lock:
+                    statuses[status] += 1
+                    if ok:
+                        latencies.append(elapsed)
+
+        started = time.monotonic()
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        result = summarise_latencies(latencies, time.monotonic() - started)
+        result["errors"] = sum(statuses.values()) - len(latencies)
+        result["statuses"] = {str(status): count for status, count in statuses.items()}
+        return result
+
+    def query_counts(self, log_path, offset, method):
+        """Summarise the request logs written since ``offset`` for ``method`` requests."""
+        queries, db_ms, template_ms = [], [], []
+        with open(log_path) as log:
+            log.seek(offset)
+            for line in log:
+                if not line.startswith("{"):
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("logger") != "tickets.requests" or record.get("method") != method:
+                    continue
+                queries.append(record["db_queries"])
+                db_ms.append(record["db_ms"])
+                template_ms.append(record["template_ms"])
+        if not queries:
+            return {"queries_mean": None, "queries_max": None, "db_ms_mean": None}
+        return {
+            "queries_mean": round(sum(queries) / len(queries), 2),
+            "queries_max": max(queries),
+            "db_ms_mean": round(sum(db_ms) / len(db_ms), 2),
+            "template_ms_mean": round(sum(template_ms) / len(template_ms), 2),
+        }
+
+    def report(self, name, result):
+        def ms(value):
+            return "-" if value is None else f"{value:.1f}"
+
+        self.stdout.write(
+            f"  {name:<16} {result['requests']:>6} req {result['requests_per_second']:>8.1f}/s"
+            f"  p50 {ms(result['p50_ms'])}  p95 {ms(result['p95_ms'])}"
+            f"  p99 {ms(result['p99_ms'])} ms"
+            f"  queries {result['queries_mean'] if result['queries_mean'] is not None else '-'}"
+            f"  errors {result['errors']}"
+        )
+
+    def compare(self, baseline, results):
+        """Print how requests per second and p95 latency changed since ``baseline``."""
+        self.stdout.write(f"Compared with {baseline.get('commit', 'the baseline')}:")
+
+        def change(old, new):
+            if not old or new is None:
+                return "n/a"
+            return f"{(new - old) / old * 100:+.1f}%"
+
+        for size, size_results in results["sizes"].items():
+            old_scenarios = baseline.get("sizes", {}).get(size, {}).get("scenarios", {})
+            for name, result in size_results["scenarios"].items():
+                old = old_scenarios.get(name)
+                if old is None:
+                    continue
+                self.stdout.write(
+                    f"  {size} {name:<16} req/s {change(old['requests_per_second'], result['requests_per_second'])}"
+                    f"  p95 {change(old['p95_ms'], result['p95_ms'])}"
+                    f"  queries {old['queries_mean']} -> {result['queries_mean']}"
+                )
@@ -0,0 +1,96 @@
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from tickets.models import Booking
+
+
+class Command(BaseCommand):
+    help = (
+        "Print the query plan and average run time of the duplicate booking "
+        "checks and booking report queries."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--runs",
+            type=int,
+            default=20,
+            help="Times to run each query when timing it (default: 20)",
+        )
+        parser.add_argument(
+            "--analyze",
+            action="store_true",
+            help="Use EXPLAIN ANALYZE (PostgreSQL only)",
+        )
+        parser.add_argument(
+            "--without-indexes",
+            action="store_true",
+            help=(
+                "Drop the booking indexes for the duration, in a transaction "
+                "that is rolled back, to compare plans without them (locks "
+                "the bookings table while it runs)"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        sample = Booking.objects.order_by("-id").first()
+        if sample is None:
+            self.stderr.write("No bookings to query; run seed_bookings first")
+            return
+
+        if options["analyze"] and connection.vendor != "postgresql":
+            raise CommandError("--analyze needs PostgreSQL")
+
+        self.stdout.write(
+            f"{connection.vendor}, {Booking.objects.count()} bookings\n"
+        )
+        with transaction.atomic():
+            if options["without_indexes"]:
+                # Plain DROP INDEX rather than a schema editor, which SQLite
+                # won't open inside a transaction; both roll it back
+                with connection.cursor() as cursor:
+                    for index in Booking._meta.indexes:
+                        cursor.execute(f"DROP INDEX {connection.ops.quote_name(index.name)}")
+                self.stdout.write("Without the booking indexes\n")
+            for label, queryset in self.get_queries(sample):
+                self.explain(label, queryset, options)
+            transaction.set_rollback(True)
+
+    def get_queries(self, sample):
+        yield "Idempotency key lookup", Booking.objects.filter(
+            idempotency_key=sample.idempotency_key or uuid.uuid4()
+        ).order_by("pk")[:1]
+        # As BookingSubmissionMixin.recent_duplicate
+        yield "Duplicate check, no idempotency key", Booking.objects.filter(
+            idempotency_key=None,
+            email=sample.email,
+            num_tickets=sample.num_tickets,
+            donation_amount=sample.donation_amount,
+            created_at__gte=timezone.now() - timedelta(seconds=60),
+        ).order_by("pk")[:1]
+
+        report = Booking.objects.order_by("-created_at", "-id")
+        for label, filters in (
+            ("Report, all bookings", {}),
+            ("Report, paid", {"payment_status": "paid"}),
+            ("Report, unpaid", {"payment_status": "unpaid"}),
+            ("Report, with Gift Aid", {"gift_aid": "yes"}),
+        ):
+            yield label, report.filter_for_report(filters)[:20]
+
+    def explain(self, label, queryset, options):
+        explain_options = {"analyze": True} if options["analyze"] else {}
+        plan = queryset.explain(**explain_options)
+
+        start = time.perf_counter()
+        for _ in range(options["runs"]):
+            list(queryset.all())
+        elapsed = (time.perf_counter() - start) / options["runs"] * 1000
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"{label}: {elapsed:.2f} ms"))
+        self.stdout.write(plan + "\n")
@@ -0,0 +1,75 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from tickets.gift_aid import (
+    GIFT_AID_CHUNK_SIZE,
+    GIFT_AID_SCHEDULE_ROWS,
+    GiftAidClaim,
+    tax_year_start,
+)
+from tickets.models import Booking
+
+
+def parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"'{value}' is not a date in YYYY-MM-DD format")
+
+
+class Command(BaseCommand):
+    help = (
+        "Write HMRC Gift Aid claim schedules (ODS) for paid Gift Aid bookings "
+        "made between two dates. Defaults to the current tax year."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", help="First booking date to claim (YYYY-MM-DD)")
+        parser.add_argument("--end", help="Last booking date to claim (YYYY-MM-DD)")
+        parser.add_argument(
+            "--output-dir", default=".", help="Directory to write the schedules to"
+        )
+        parser.add_argument(
+            "--max-rows",
+            type=int,
+            default=GIFT_AID_SCHEDULE_ROWS,
+            help="Donations per schedule file",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=GIFT_AID_CHUNK_SIZE,
+            help="Bookings read from the database at a time",
+        )
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        start = parse_date(options["start"]) if options["start"] else tax_year_start(today)
+        end = parse_date(options["end"]) if options["end"] else today
+        if end < start:
+            raise CommandError("--end is before --start")
+
+        started = time.perf_counter()
+        claim = GiftAidClaim.for_dates(
+            Booking.objects.all(), start, end, chunk_size=options["chunk_size"]
+        )
+        paths = claim.write(
+            options["output_dir"],
+            prefix=f"gift-aid-claim-{start:%Y%m%d}-{end:%Y%m%d}",
+            max_rows=options["max_rows"],
+        )
+        elapsed = time.perf_counter() - started
+
+        for booking_id, reason in claim.skipped:
+            self.stdout.write(f"Skipped SIB-{booking_id}: {reason}")
+        for path in paths:
+            self.stdout.write(path)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Wrote {len(paths)} schedule(s) for {start} to {end} in {elapsed:.1f}s, "
+                f"skipped {len(claim.skipped)} booking(s)"
+            )
+        )
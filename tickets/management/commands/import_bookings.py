@@ -0,0 +1,96 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tickets.imports import IMPORT_BATCH_SIZE, IMPORT_COLUMNS, BookingImport, read_rows
+from tickets.models import Event
+
+
+class Command(BaseCommand):
+    help = (
+        "Import offline and phone bookings from a CSV or JSON Lines file, "
+        "validated like the booking form. Rows with errors are reported and "
+        f"skipped. Columns: {', '.join(IMPORT_COLUMNS)}."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to import, or - for standard input")
+        parser.add_argument(
+            "--format",
+            choices=["csv", "jsonl"],
+            help="File format (default: from the file extension, else csv)",
+        )
+        parser.add_argument(
+            "--event",
+            type=int,
+            help="ID of the event the bookings are for (default: the current open event)",
+        )
+        parser.add_argument(
+            "--no-event",
+            action="store_true",
+            help="Don't link the bookings to an event or take its tickets",
+        )
+        parser.add_argument(
+            "--paid",
+            action="store_true",
+            help="Mark bookings without an is_paid column as paid",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=IMPORT_BATCH_SIZE,
+            help=f"Bookings inserted per transaction (default: {IMPORT_BATCH_SIZE})",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Validate the file and report errors without importing anything",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        format = options["format"] or (
+            "jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv"
+        )
+
+        event = None
+        if options["event"] and options["no_event"]:
+            raise CommandError("--event and --no-event can't be used together")
+        if options["event"]:
+            event = Event.objects.filter(pk=options["event"]).first()
+            if event is None:
+                raise CommandError(f"There is no event with ID {options['event']}")
+        elif not options["no_event"]:
+            event = Event.objects.filter(is_open=True).order_by("starts_at", "id").first()
+
+        booking_import = BookingImport(
+            event=event,
+            is_paid=options["paid"],
+            batch_size=options["batch_size"],
+            dry_run=options["dry_run"],
+        )
+        started = time.perf_counter()
+        if path == "-":
+            booking_import.run(read_rows(sys.stdin, format))
+        else:
+            try:
+                with open(path, newline="", encoding="utf-8-sig") as fileobj:
+                    booking_import.run(read_rows(fileobj, format))
+            except OSError as e:
+                raise CommandError(f"Can't read {path}: {e}")
+        elapsed = time.perf_counter() - started
+
+        for row, field, message in booking_import.errors:
+            self.stderr.write(f"Row {row}: " + (f"{field}: " if field else "") + message)
+
+        rows_with_errors = len({row for row, _, _ in booking_import.errors})
+        self.stdout.write(
+            self.style.SUCCESS(
+                ("Would import" if options["dry_run"] else "Imported")
+                + f" {booking_import.imported} booking(s)"
+                + (f" for {event}" if event else "")
+                + f" in {elapsed:.1f}s; {rows_with_errors} row(s) had errors, "
+                f"{booking_import.already_imported} were already imported"
+            )
+        )
@@ -0,0 +1,198 @@
+import asyncio
+import statistics
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from tickets.benchmarks import BenchmarkError, start_server
+from tickets.models import Booking
+
+SERVER_MODES = ("wsgi", "asgi")
+
+# Bytes a slow client says its form submission holds; it never sends them all
+SLOW_BODY_LENGTH = 100_000
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare how the sync (WSGI) and async (ASGI) setups in gunicorn.conf.py "
+        "cope with slow clients. Each setup is started in turn on the current "
+        "database. While --slow-clients connections trickle in a booking form "
+        "submission a byte at a time, like phones on a poor signal, --clients "
+        "clients request the booking form and confirmation pages as fast as "
+        "they can, and their throughput and latency are reported."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--modes",
+            nargs="+",
+            choices=SERVER_MODES,
+            default=list(SERVER_MODES),
+            help="Setups to test (default: both)",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Gunicorn worker processes for each setup (default: 1)",
+        )
+        parser.add_argument(
+            "--slow-clients",
+            type=int,
+            default=50,
+            help="Connections held open by slow clients (default: 50)",
+        )
+        parser.add_argument(
+            "--clients",
+            type=int,
+            default=10,
+            help="Clients making requests as fast as they can (default: 10)",
+        )
+        parser.add_argument(
+            "--duration",
+            type=float,
+            default=10,
+            help="Seconds to run each test for (default: 10)",
+        )
+        parser.add_argument(
+            "--port",
+            type=int,
+            default=8765,
+            help="Port to start the servers on (default: 8765)",
+        )
+        parser.add_argument(
+            "--path",
+            action="append",
+            dest="paths",
+            help="Path for the fast clients to request; repeat for several "
+            "(default: the booking form and the latest booking's confirmation page)",
+        )
+
+    def handle(self, *args, **options):
+        paths = options["paths"] or [reverse("home")]
+        if not options["paths"]:
+            latest = Booking.objects.order_by("-id").values_list("id", flat=True).first()
+            if latest:
+                paths.append(reverse("booking_confirmation", args=[latest]))
+
+        results = {}
+        for mode in options["modes"]:
+            try:
+                server = start_server(mode, options["port"], options["workers"])
+            except BenchmarkError as e:
+                raise CommandError(e)
+            try:
+                results[mode] = asyncio.run(
+                    self.run_load(
+                        options["port"],
+                        paths,
+                        options["slow_clients"],
+                        options["clients"],
+                        options["duration"],
+                    )
+                )
+            finally:
+                server.terminate()
+                server.wait()
+            self.report(mode, results[mode], options["duration"])
+
+        if len(results) == 2:
+            wsgi, asgi = (len(results[mode]["latencies"]) for mode in SERVER_MODES)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"ASGI completed {asgi} request(s) to WSGI's {wsgi} with "
+                    f"{options['slow_clients']} slow client(s) connected"
+                )
+            )
+
+    async def run_load(self, port, paths, slow_clients, clients, duration):
+        loop = asyncio.get_running_loop()
+        slow = [asyncio.create_task(self.slow_client(port)) for _ in range(slow_clients)]
+        # Give the slow clients time to connect and take up the server first
+        await asyncio.sleep(1)
+
+        stop = loop.time() + duration
+        latencies = []
+        statuses = Counter()
+
+        async def client(number):
+            requests = number
+            while loop.time() < stop:
+                path = paths[requests % len(paths)]
+                requests += 1
+                started = loop.time()
+                try:
+                    status = await asyncio.wait_for(
+                        self.request(port, path), timeout=stop - started
+                    )
+                except (TimeoutError, asyncio.TimeoutError):
+                    # Still waiting for a response when the test ended
+                    statuses["unfinished"] += 1
+                    return
+                except OSError as e:
+                    statuses[type(e).__name__] += 1
+                    continue
+                statuses[status] += 1
+                latencies.append(loop.time() - started)
+
+        await asyncio.gather(*(client(number) for number in range(clients)))
+        for task in slow:
+            task.cancel()
+        await asyncio.gather(*slow, return_exceptions=True)
+        return {"latencies": sorted(latencies), "statuses": statuses}
+
+    async def slow_client(self, port):
+        """Open a connection and send a form submission one byte a second."""
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        except OSError:
+            return
+        try:
+            writer.write(
+                (
+                    f"POST {reverse('home')} HTTP/1.1\r\n"
+                    f"Host: 127.0.0.1:{port}\r\n"
+                    "Content-Type: application/x-www-form-urlencoded\r\n"
+                    f"Content-Length: {SLOW_BODY_LENGTH}\r\n\r\n"
+                ).encode()
+            )
+            while True:
+                await writer.drain()
+                await asyncio.sleep(1)
+                writer.write(b"x")
+        except OSError:
+            pass
+        finally:
+            writer.close()
+
+    async def request(self, port, path):
+        """Make a GET request and return its status code, once it's been read."""
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            writer.write(
+                f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nConnection: close\r\n\r\n".encode()
+            )
+            await writer.drain()
+            status_line = await reader.readline()
+            await reader.read()
+        finally:
+            writer.close()
+        if not status_line:
+            raise ConnectionResetError("No response")
+        return int(status_line.split()[1])
+
+    def report(self, mode, result, duration):
+        latencies = result["latencies"]
+        statuses = ", ".join(f"{status}: {count}" for status, count in result["statuses"].items())
+        if not latencies:
+            self.stdout.write(f"{mode}: no requests completed ({statuses})")
+            return
+        self.stdout.write(
+            f"{mode}: {len(latencies)} request(s) in {duration:.0f}s "
+            f"({len(latencies) / duration:.1f}/s); latency median "
+            f"{statistics.median(latencies) * 1000:.0f} ms, "
+            f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.0f} ms, "
+            f"max {latencies[-1] * 1000:.0f} ms ({statuses})"
+        )
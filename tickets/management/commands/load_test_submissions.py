@@ -0,0 +1,151 @@
+import statistics
+import threading
+import urllib.parse
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+
+from tickets.benchmarks import BenchmarkError, fetch_form, submit_form
+from tickets.models import Booking, Event
+
+
+class Command(BaseCommand):
+    help = (
+        "Submit the same booking form many times at once against a running "
+        "server, and check every submission ends at one booking. With "
+        "--distinct, submit many different bookings at once instead and check "
+        "the current event isn't oversold."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url",
+            default="http://127.0.0.1:8000/",
+            help="Booking form URL (default: http://127.0.0.1:8000/)",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=20,
+            help="Simultaneous submissions of each form (default: 20)",
+        )
+        parser.add_argument(
+            "--rounds",
+            type=int,
+            default=5,
+            help="Forms to fetch and submit (default: 5)",
+        )
+        parser.add_argument(
+            "--distinct",
+            action="store_true",
+            help="Submit a different form from each client, like a ticket release",
+        )
+        parser.add_argument(
+            "--no-db-check",
+            action="store_true",
+            help="Don't count bookings in the database (when the server uses a different one)",
+        )
+
+    def handle(self, *args, **options):
+        if options["distinct"]:
+            return self.handle_distinct(options)
+
+        failures = 0
+        timings = []
+        for round_number in range(1, options["rounds"] + 1):
+            key, results = self.run_round(options["url"], options["concurrency"], round_number)
+            timings.extend(elapsed for _, _, elapsed in results)
+
+            statuses = Counter(status for status, _, _ in results)
+            locations = {location for status, location, _ in results if status == 302}
+            bookings = (
+                None
+                if options["no_db_check"]
+                else Booking.objects.filter(idempotency_key=key).count()
+            )
+            ok = statuses == {302: len(results)} and len(locations) == 1 and bookings in (None, 1)
+            failures += not ok
+
+            self.stdout.write(
+                f"Round {round_number}: {dict(statuses)}, "
+                f"{len(locations)} confirmation page(s)"
+                + ("" if bookings is None else f", {bookings} booking(s)")
+                + ("" if ok else " - FAILED")
+            )
+
+        timings.sort()
+        self.stdout.write(
+            f"Latency: median {statistics.median(timings) * 1000:.0f} ms, "
+            f"max {timings[-1] * 1000:.0f} ms"
+        )
+        if failures:
+            raise CommandError(f"{failures} of {options['rounds']} round(s) failed")
+        self.stdout.write(self.style.SUCCESS("Every form was booked exactly once"))
+
+    def handle_distinct(self, options):
+        concurrency = options["concurrency"]
+        results = []
+        barrier = threading.Barrier(concurrency)
+
+        def book():
+            opener, body = self.fetch_form(options["url"])
+            barrier.wait()
+            results.append(submit_form(opener, options["url"], body))
+
+        self.run_threads(book, concurrency)
+
+        statuses = Counter(status for status, _, _ in results)
+        booked = len({location for status, location, _ in results if status == 302})
+        timings = sorted(elapsed for _, _, elapsed in results)
+        self.stdout.write(
+            f"{concurrency} bookings submitted: {dict(statuses)}, "
+            f"{booked} distinct redirect(s)"
+        )
+        self.stdout.write(
+            f"Latency: median {statistics.median(timings) * 1000:.0f} ms, "
+            f"p95 {timings[int(len(timings) * 0.95) - 1] * 1000:.0f} ms, "
+            f"max {timings[-1] * 1000:.0f} ms"
+        )
+        if options["no_db_check"]:
+            return
+
+        event = Event.objects.filter(is_open=True).order_by("starts_at", "id").first()
+        if event is None:
+            return
+        booked_tickets = event.bookings.aggregate(total=Sum("num_tickets", default=0))["total"]
+        self.stdout.write(
+            f"{event.name}: capacity {event.capacity}, {event.tickets_sold} sold, "
+            f"{booked_tickets} booked, {event.waitlist.count()} on the waitlist"
+        )
+        if event.tickets_sold != booked_tickets or booked_tickets > event.capacity:
+            raise CommandError("Tickets sold doesn't match the bookings")
+        self.stdout.write(self.style.SUCCESS("The event was not oversold"))
+
+    def run_round(self, url, concurrency, round_number):
+        """Fetch a form, then post it ``concurrency`` times at once."""
+        opener, body = self.fetch_form(url)
+        key = urllib.parse.parse_qs(body.decode())["idempotency_key"][0]
+
+        results = []
+        barrier = threading.Barrier(concurrency)
+
+        def submit():
+            barrier.wait()
+            results.append(submit_form(opener, url, body))
+
+        self.run_threads(submit, concurrency)
+        return key, results
+
+    def fetch_form(self, url):
+        try:
+            return fetch_form(url)
+        except BenchmarkError as e:
+            raise CommandError(e)
+
+    def run_threads(self, target, count):
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tickets.models import BookingSummary
+
+
+class Command(BaseCommand):
+    help = "Rebuild the BookingSummary table from the bookings, or verify it."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="Only compare the summary with the bookings; exit with an error if they differ",
+        )
+
+    def handle(self, *args, **options):
+        if options["verify"]:
+            differences = BookingSummary.objects.compare()
+        else:
+            differences = BookingSummary.objects.rebuild()
+
+        for is_paid, gift_aid, field, stored, actual in differences:
+            self.stdout.write(
+                f"{'paid' if is_paid else 'unpaid'}, "
+                f"{'gift aid' if gift_aid else 'no gift aid'}: "
+                f"{field} was {stored}, should be {actual}"
+            )
+
+        if options["verify"]:
+            if differences:
+                raise CommandError(
+                    f"Booking summary is out of date ({len(differences)} difference(s))"
+                )
+            self.stdout.write(self.style.SUCCESS("Booking summary is up to date"))
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Rebuilt booking summary, corrected {len(differences)} figure(s)"
+                )
+            )
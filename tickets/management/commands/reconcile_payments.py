@@ -0,0 +1,102 @@
+import csv
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tickets.reconciliation import (
+    RECONCILE_WINDOW_DAYS,
+    Reconciliation,
+    StatementError,
+    parse_statement,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Match the payments in a bank statement export (CSV or OFX) to "
+        "unpaid bookings and mark them paid, listing the payments that need "
+        "checking by hand."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Bank statement file")
+        parser.add_argument(
+            "--window-days",
+            type=int,
+            default=RECONCILE_WINDOW_DAYS,
+            help="How long before a payment without a reference its booking can "
+            f"have been made (default: {RECONCILE_WINDOW_DAYS})",
+        )
+        parser.add_argument(
+            "--report", help="Also write the matched and unmatched payments to this CSV file"
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Match payments without marking any bookings paid",
+        )
+
+    def handle(self, *args, **options):
+        path = Path(options["path"])
+        started = time.perf_counter()
+        try:
+            statement_lines = parse_statement(path.read_bytes(), path.name)
+        except (OSError, StatementError) as e:
+            raise CommandError(f"Can't read {path}: {e}")
+
+        reconciliation = Reconciliation(statement_lines, window_days=options["window_days"])
+        reconciliation.match()
+        if not options["dry_run"]:
+            reconciliation.apply()
+        elapsed = time.perf_counter() - started
+
+        for line, reason, booking_ids in reconciliation.unmatched:
+            bookings = ", ".join(f"SIB-{booking_id}" for booking_id in booking_ids)
+            self.stdout.write(
+                f"Line {line.line}: {line.date} £{line.amount} {line.description!r} - {reason}"
+                + (f" ({bookings})" if bookings else "")
+            )
+        if options["report"]:
+            self.write_report(options["report"], reconciliation)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Read {len(statement_lines)} transaction(s) in {elapsed:.2f}s: "
+                f"{len(reconciliation.matches)} payment(s) matched, "
+                + (
+                    ""
+                    if options["dry_run"]
+                    else f"{reconciliation.marked_paid} booking(s) marked paid, "
+                )
+                + f"{len(reconciliation.unmatched)} need checking, "
+                f"{reconciliation.debits} debit(s) ignored"
+            )
+        )
+
+    def write_report(self, path, reconciliation):
+        with open(path, "w", newline="") as output:
+            writer = csv.writer(output)
+            writer.writerow(["Line", "Date", "Amount", "Description", "Result", "Bookings"])
+            for line, booking_id, method in reconciliation.matches:
+                writer.writerow(
+                    [
+                        line.line,
+                        line.date,
+                        line.amount,
+                        line.description,
+                        f"Matched by {method}",
+                        f"SIB-{booking_id}",
+                    ]
+                )
+            for line, reason, booking_ids in reconciliation.unmatched:
+                writer.writerow(
+                    [
+                        line.line,
+                        line.date,
+                        line.amount,
+                        line.description,
+                        reason,
+                        " ".join(f"SIB-{booking_id}" for booking_id in booking_ids),
+                    ]
+                )
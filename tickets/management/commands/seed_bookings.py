@@ -0,0 +1,95 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from tickets.models import Booking, BookingSummary
+
+FIRST_NAMES = [
+    "Alice", "Ben", "Charlotte", "David", "Emma", "Freddie", "Grace", "Harry",
+    "Isla", "Jack", "Katie", "Liam", "Mia", "Noah", "Olivia", "Poppy",
+    "Ruby", "Sam", "Thomas", "Zara",
+]
+LAST_NAMES = [
+    "Bannister", "Clarke", "Davies", "Evans", "Fletcher", "Green", "Hughes",
+    "Jones", "King", "Lewis", "Morris", "Parker", "Roberts", "Smith",
+    "Taylor", "Walker", "White", "Wilson", "Wright", "Young",
+]
+TOWNS = ["Banbury", "Sibford Gower", "Sibford Ferris", "Hook Norton", "Oxford"]
+
+
+class Command(BaseCommand):
+    help = "Insert realistic fake bookings, for benchmarking queries at scale."
+
+    def add_arguments(self, parser):
+        parser.add_argument("count", type=int, help="Number of bookings to create")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=10000,
+            help="Bookings inserted per query (default: 10000)",
+        )
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=365,
+            help="Spread creation dates over this many days before now (default: 365)",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="Random seed (default: 0)"
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        count = options["count"]
+        batch_size = options["batch_size"]
+        now = timezone.now()
+        span = options["days"] * 24 * 60 * 60
+
+        # Keep the spread-out creation dates rather than stamping every
+        # booking with the current time
+        created_at_field = Booking._meta.get_field("created_at")
+        created_at_field.auto_now_add = False
+        try:
+            self.seed(rng, count, batch_size, now, span)
+        finally:
+            created_at_field.auto_now_add = True
+
+        # bulk_create bypasses the signals that maintain the summary
+        BookingSummary.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Seeded {count} bookings"))
+
+    def seed(self, rng, count, batch_size, now, span):
+        created = 0
+        while created < count:
+            batch = []
+            for _ in range(min(batch_size, count - created)):
+                first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+                num_tickets = rng.choice((1, 1, 2, 2, 2, 3, 4))
+                gift_aid = rng.random() < 0.4
+                created_at = now - timedelta(seconds=rng.randrange(span))
+                batch.append(
+                    Booking(
+                        full_name=f"{first} {last}",
+                        email=f"{first}.{last}{rng.randrange(100000)}@example.com".lower(),
+                        phone_number=f"07{rng.randrange(10**9):09d}",
+                        num_tickets=num_tickets,
+                        donation_amount=Decimal(
+                            num_tickets * 25 + rng.choice((0, 0, 0, 5, 10, 20))
+                        ),
+                        gift_aid=gift_aid,
+                        address_line1=f"{rng.randrange(1, 200)} High Street" if gift_aid else None,
+                        city=rng.choice(TOWNS) if gift_aid else None,
+                        postcode=f"OX{rng.randrange(1, 30)} {rng.randrange(1, 10)}AB" if gift_aid else None,
+                        is_paid=rng.random() < 0.7,
+                        created_at=created_at,
+                        admin_notified_at=created_at,
+                    )
+                )
+            with transaction.atomic():
+                Booking.objects.bulk_create(batch)
+            created += len(batch)
+            self.stdout.write(f"Created {created}/{count} bookings")
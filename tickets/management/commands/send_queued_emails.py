@@ -0,0 +1,76 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from tickets.instrumentation import track
+from tickets.utils import (
+    claim_outbox_batch,
+    deliver_outbox_batch,
+    queue_admin_notification_digest,
+)
+
+logger = logging.getLogger("tickets.outbox")
+
+
+class Command(BaseCommand):
+    help = (
+        "Deliver queued booking emails from the outbox, queueing an admin "
+        "notification digest first whenever one is due."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=50,
+            help="Maximum number of emails to send per batch (default: 50)",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep running, polling the outbox for new emails",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5,
+            help="Seconds to wait between polls when the outbox is empty (default: 5)",
+        )
+        parser.add_argument(
+            "--flush-digest",
+            action="store_true",
+            help="Send the admin digest now, even if its window hasn't elapsed",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        flush_digest = options["flush_digest"]
+
+        while True:
+            total_sent = total_failed = 0
+            if queue_admin_notification_digest(force=flush_digest):
+                self.stdout.write("Queued admin notification digest")
+            flush_digest = False
+
+            # Drain everything that is currently due, one batch at a time
+            while batch := claim_outbox_batch(batch_size):
+                with track("send_queued_emails") as stats:
+                    sent, failed = deliver_outbox_batch(batch)
+                logger.info(
+                    "Delivered a batch of %d email(s), %d failed",
+                    sent,
+                    failed,
+                    extra={"data": {"sent": sent, "failed": failed, **stats.as_dict()}},
+                )
+                total_sent += sent
+                total_failed += failed
+
+            if total_sent or total_failed or not options["loop"]:
+                self.stdout.write(
+                    f"Sent {total_sent} email(s), {total_failed} failed"
+                )
+
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,59 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tickets.routers import REPLICA
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database over the replica one "
+        "(REPLICA_DATABASE_URL), to stand in for replication when trying the "
+        "read replica locally. With --loop, the replica lags the primary by "
+        "up to --interval seconds, as a real one might."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep copying, every --interval seconds",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5,
+            help="Seconds between copies with --loop (default: 5)",
+        )
+
+    def handle(self, *args, **options):
+        if REPLICA not in settings.DATABASES:
+            raise CommandError("Set REPLICA_DATABASE_URL to use a replica")
+        primary = settings.DATABASES["default"]
+        replica = settings.DATABASES[REPLICA]
+        engine = "django.db.backends.sqlite3"
+        if primary["ENGINE"] != engine or replica["ENGINE"] != engine:
+            raise CommandError("Both the primary and the replica must be SQLite databases")
+        if str(primary["NAME"]) == str(replica["NAME"]):
+            raise CommandError("The replica is the primary database")
+
+        while True:
+            started = time.perf_counter()
+            # The backup API copies a consistent snapshot, even while the
+            # site is writing to the primary
+            source = sqlite3.connect(primary["NAME"])
+            target = sqlite3.connect(replica["NAME"])
+            try:
+                source.backup(target)
+            finally:
+                source.close()
+                target.close()
+            self.stdout.write(
+                f"Copied {primary['NAME']} to {replica['NAME']} "
+                f"in {(time.perf_counter() - started) * 1000:.0f} ms"
+            )
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:06
+
+from django.db import migrations, models
+
+
+def mark_existing_bookings_notified(apps, schema_editor):
+    # Bookings made before digests existed were notified individually
+    Booking = apps.get_model("tickets", "Booking")
+    Booking.objects.update(admin_notified_at=models.F("created_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0003_outboxemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='admin_notified_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(
+            mark_existing_bookings_notified, migrations.RunPython.noop
+        ),
+        migrations.AlterField(
+            model_name='outboxemail',
+            name='kind',
+            field=models.CharField(choices=[('booking_confirmation', 'Booking confirmation'), ('admin_notification', 'Admin notification'), ('admin_digest', 'Admin digest')], max_length=32),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('admin_notified_at__isnull', True)), fields=['created_at'], name='booking_awaiting_digest_idx'),
+        ),
+    ]
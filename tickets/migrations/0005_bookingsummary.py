@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:07
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def populate_booking_summary(apps, schema_editor):
+    Booking = apps.get_model("tickets", "Booking")
+    BookingSummary = apps.get_model("tickets", "BookingSummary")
+    BookingSummary.objects.bulk_create(
+        BookingSummary(**bucket)
+        for bucket in Booking.objects.order_by()
+        .values("is_paid", "gift_aid")
+        .annotate(
+            booking_count=Count("id"),
+            ticket_count=Sum("num_tickets", default=0),
+            donation_total=Sum("donation_amount", default=0),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0004_booking_admin_notified_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookingSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_paid', models.BooleanField()),
+                ('gift_aid', models.BooleanField()),
+                ('booking_count', models.IntegerField(default=0)),
+                ('ticket_count', models.IntegerField(default=0)),
+                ('donation_total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+            options={
+                'verbose_name_plural': 'booking summaries',
+                'constraints': [models.UniqueConstraint(fields=('is_paid', 'gift_aid'), name='unique_booking_summary_bucket')],
+            },
+        ),
+        migrations.RunPython(populate_booking_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:08
+
+from django.db import migrations, models
+
+# Compare the query plans with and without these indexes using
+# `manage.py explain_booking_queries --analyze [--without-indexes]`.
+# booking_duplicate_check_idx is dropped again in 0008, when idempotency
+# keys replaced the duplicate check; 0012 adds a smaller one for the check
+# kept for forms posted without a key.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0005_bookingsummary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['email', 'num_tickets', 'donation_amount', 'created_at'], name='booking_duplicate_check_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['-created_at', '-id'], name='booking_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('is_paid', True)), fields=['-created_at', '-id'], name='booking_paid_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('is_paid', False)), fields=['-created_at', '-id'], name='booking_unpaid_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('gift_aid', True)), fields=['-created_at', '-id'], name='booking_gift_aid_created_idx'),
+        ),
+    ]
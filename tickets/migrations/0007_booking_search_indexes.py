@@ -0,0 +1,71 @@
+from django.db import migrations
+
+# The search indexes used by tickets.search, for each database vendor. The
+# SQL lives here rather than being imported, so that this migration keeps
+# doing what it did when it was written.
+INSTALL_SQL = {
+    "postgresql": [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS booking_full_name_trgm_idx ON tickets_booking "
+        "USING gin (UPPER(full_name::text) gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS booking_email_trgm_idx ON tickets_booking "
+        "USING gin (UPPER(email::text) gin_trgm_ops)",
+    ],
+    "sqlite": [
+        # An external-content FTS5 table over the booking names and emails,
+        # kept in sync by triggers
+        "CREATE VIRTUAL TABLE IF NOT EXISTS tickets_booking_search USING fts5("
+        "full_name, email, content='tickets_booking', content_rowid='id', "
+        "tokenize='trigram')",
+        "CREATE TRIGGER IF NOT EXISTS tickets_booking_search_insert "
+        "AFTER INSERT ON tickets_booking BEGIN "
+        "INSERT INTO tickets_booking_search(rowid, full_name, email) "
+        "VALUES (new.id, new.full_name, new.email); END",
+        "CREATE TRIGGER IF NOT EXISTS tickets_booking_search_delete "
+        "AFTER DELETE ON tickets_booking BEGIN "
+        "INSERT INTO tickets_booking_search(tickets_booking_search, rowid, full_name, email) "
+        "VALUES ('delete', old.id, old.full_name, old.email); END",
+        "CREATE TRIGGER IF NOT EXISTS tickets_booking_search_update "
+        "AFTER UPDATE OF full_name, email ON tickets_booking BEGIN "
+        "INSERT INTO tickets_booking_search(tickets_booking_search, rowid, full_name, email) "
+        "VALUES ('delete', old.id, old.full_name, old.email); "
+        "INSERT INTO tickets_booking_search(rowid, full_name, email) "
+        "VALUES (new.id, new.full_name, new.email); END",
+        # Index the bookings already made
+        "INSERT INTO tickets_booking_search(tickets_booking_search) VALUES ('rebuild')",
+    ],
+}
+
+REMOVE_SQL = {
+    "postgresql": [
+        "DROP INDEX IF EXISTS booking_full_name_trgm_idx",
+        "DROP INDEX IF EXISTS booking_email_trgm_idx",
+    ],
+    "sqlite": [
+        "DROP TRIGGER IF EXISTS tickets_booking_search_insert",
+        "DROP TRIGGER IF EXISTS tickets_booking_search_delete",
+        "DROP TRIGGER IF EXISTS tickets_booking_search_update",
+        "DROP TABLE IF EXISTS tickets_booking_search",
+    ],
+}
+
+
+def install_search_indexes(apps, schema_editor):
+    for statement in INSTALL_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def remove_search_indexes(apps, schema_editor):
+    for statement in REMOVE_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0006_booking_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_indexes, remove_search_indexes),
+    ]
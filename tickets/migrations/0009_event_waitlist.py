@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0008_booking_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='outboxemail',
+            name='kind',
+            field=models.CharField(choices=[('booking_confirmation', 'Booking confirmation'), ('admin_notification', 'Admin notification'), ('admin_digest', 'Admin digest'), ('waitlist_offer', 'Waitlist offer')], max_length=32),
+        ),
+        migrations.CreateModel(
+            name='Event',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('starts_at', models.DateTimeField()),
+                ('capacity', models.PositiveIntegerField()),
+                ('tickets_sold', models.PositiveIntegerField(default=0, editable=False)),
+                ('is_open', models.BooleanField(default=True, help_text='Whether the booking forms take bookings for this event')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.CheckConstraint(condition=models.Q(('tickets_sold__lte', models.F('capacity'))), name='event_not_oversold')],
+            },
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='event',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='bookings', to='tickets.event'),
+        ),
+        migrations.CreateModel(
+            name='WaitlistEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('full_name', models.CharField(max_length=255)),
+                ('email', models.EmailField(max_length=254)),
+                ('num_tickets', models.PositiveIntegerField(default=1)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('offered_at', models.DateTimeField(blank=True, null=True)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist', to='tickets.event')),
+            ],
+            options={
+                'verbose_name_plural': 'waitlist entries',
+                'ordering': ['created_at', 'id'],
+                'constraints': [models.UniqueConstraint(fields=('event', 'email'), name='unique_waitlist_entry_per_event')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0010_booking_updated_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='checked_in_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0011_booking_checked_in_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('idempotency_key__isnull', True)), fields=['email', 'created_at'], name='booking_keyless_duplicate_idx'),
+        ),
+    ]
@@ -1,4 +1,163 @@
-from django.db import models
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+from .search import get_search_backend
+
+
+class BookingQuerySet(models.QuerySet):
+    def filter_for_report(self, filters):
+        """Apply the cleaned data of a ReportFilterForm."""
+        queryset = self
+
+        # Filter by payment status
+        payment_status = filters.get("payment_status")
+        if payment_status == "paid":
+            queryset = queryset.filter(is_paid=True)
+        elif payment_status == "unpaid":
+            queryset = queryset.filter(is_paid=False)
+
+        # Filter by gift aid status
+        gift_aid = filters.get("gift_aid")
+        if gift_aid == "yes":
+            queryset = queryset.filter(gift_aid=True)
+        elif gift_aid == "no":
+            queryset = queryset.filter(gift_aid=False)
+
+        # Search by name or email
+        search_query = filters.get("search")
+        if search_query:
+            queryset = get_search_backend(queryset.db).filter(queryset, search_query)
+
+        return queryset
+
+    def summary(self):
+        """
+        Return booking, ticket, amount and Gift Aid totals for the queryset,
+        computed with conditional aggregation in a single query.
+        """
+        return self.order_by().aggregate(
+            total_bookings=Count("id"),
+            total_tickets=Sum("num_tickets", default=0),
+            total_amount=Sum("donation_amount", default=0),
+            paid_amount=Sum("donation_amount", filter=Q(is_paid=True), default=0),
+            unpaid_amount=Sum("donation_amount", filter=Q(is_paid=False), default=0),
+            gift_aid_count=Count("id", filter=Q(gift_aid=True)),
+        )
+
+
+CURRENT_EVENT_CACHE_KEY = "tickets:current-event"
+_MISSING = object()
+
+
+class SoldOut(Exception):
+    """Raised when an event doesn't have enough tickets left for a booking."""
+
+    def __init__(self, event_id, tickets):
+        super().__init__(f"Event {event_id} can't supply {tickets} ticket(s)")
+        self.event_id = event_id
+        self.tickets = tickets
+
+
+class EventQuerySet(models.QuerySet):
+    def current(self):
+        """
+        Return the open event that bookings are taken for, or None.
+
+        The event is cached for EVENT_CACHE_TIMEOUT seconds so the booking
+        forms can show the tickets remaining without a query on every GET;
+        the figure may be that many seconds out of date, but reserve()
+        always checks the database.
+        """
+        event = cache.get(CURRENT_EVENT_CACHE_KEY, _MISSING)
+        if event is _MISSING:
+            event = self.filter(is_open=True).order_by("starts_at", "id").first()
+            cache.set(CURRENT_EVENT_CACHE_KEY, event, settings.EVENT_CACHE_TIMEOUT)
+        return event
+
+    async def acurrent(self):
+        """current() for async views."""
+        event = await cache.aget(CURRENT_EVENT_CACHE_KEY, _MISSING)
+        if event is _MISSING:
+            event = await self.filter(is_open=True).order_by("starts_at", "id").afirst()
+            await cache.aset(CURRENT_EVENT_CACHE_KEY, event, settings.EVENT_CACHE_TIMEOUT)
+        return event
+
+    def clear_cache(self):
+        cache.delete(CURRENT_EVENT_CACHE_KEY)
+
+    def reserve(self, event_id, tickets):
+        """
+        Take tickets from an event's inventory with a single conditional
+        UPDATE, and return whether there were enough left.
+
+        Concurrent reservations queue on the event's row lock rather than
+        racing a read, so the event can never be oversold.
+        """
+        return bool(
+            self.filter(pk=event_id, tickets_sold__lte=F("capacity") - tickets).update(
+                tickets_sold=F("tickets_sold") + tickets
+            )
+        )
+
+    def release(self, event_id, tickets):
+        """Return tickets to an event's inventory."""
+        self.filter(pk=event_id).update(tickets_sold=F("tickets_sold") - tickets)
+
+
+class Event(models.Model):
+    """An event with a limited number of tickets."""
+
+    name = models.CharField(max_length=255)
+    starts_at = models.DateTimeField()
+    capacity = models.PositiveIntegerField()
+    # Maintained by reserve() and release(); never written by save()
+    tickets_sold = models.PositiveIntegerField(default=0, editable=False)
+    is_open = models.BooleanField(
+        default=True, help_text="Whether the booking forms take bookings for this event"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = EventQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(tickets_sold__lte=F("capacity")),
+                name="event_not_oversold",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.starts_at:%d %b %Y})"
+
+    @property
+    def tickets_remaining(self):
+        return max(self.capacity - self.tickets_sold, 0)
+
+    @property
+    def is_sold_out(self):
+        return self.tickets_remaining == 0
+
+    def clean(self):
+        if self.capacity is not None and self.capacity < self.tickets_sold:
+            raise ValidationError(
+                {"capacity": f"{self.tickets_sold} tickets have already been sold."}
+            )
+
+    def save(self, *args, **kwargs):
+        # Don't overwrite reservations made since this instance was loaded
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != "tickets_sold"
+            ]
+        super().save(*args, **kwargs)
+
 
 class Booking(models.Model):
     """Model representing a ticket booking."""
@@ -19,9 +178,119 @@ class Booking(models.Model):
     is_paid = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    # Set once the booking has been included in an admin notification digest
+    admin_notified_at = models.DateTimeField(blank=True, null=True, editable=False)
+
+    event = models.ForeignKey(
+        Event,
+        on_delete=models.PROTECT,
+        related_name="bookings",
+        blank=True,
+        null=True,
+    )
+
+    # Issued with the booking form, so a resubmitted form can't create a
+    # second booking
+    idempotency_key = models.UUIDField(blank=True, null=True, editable=False)
+
+    # Set when the booking's guests arrive, by the door check-in page
+    checked_in_at = models.DateTimeField(blank=True, null=True, editable=False)
+
+    objects = BookingQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["created_at"],
+                condition=models.Q(admin_notified_at__isnull=True),
+                name="booking_awaiting_digest_idx",
+            ),
+            # Booking report ordering, unfiltered and by payment/Gift Aid status
+            models.Index(fields=["-created_at", "-id"], name="booking_created_idx"),
+            models.Index(
+                fields=["-created_at", "-id"],
+                condition=models.Q(is_paid=True),
+                name="booking_paid_created_idx",
+            ),
+            models.Index(
+                fields=["-created_at", "-id"],
+                condition=models.Q(is_paid=False),
+                name="booking_unpaid_created_idx",
+            ),
+            models.Index(
+                fields=["-created_at", "-id"],
+                condition=models.Q(gift_aid=True),
+                name="booking_gift_aid_created_idx",
+            ),
+            # Duplicate check for booking forms posted without an idempotency key
+            models.Index(
+                fields=["email", "created_at"],
+                condition=models.Q(idempotency_key__isnull=True),
+                name="booking_keyless_duplicate_idx",
+            ),
+            # Last-Modified and ETag of the bookings API
+            models.Index(fields=["updated_at"], name="booking_updated_idx"),
+        ]
+        constraints = [
+            # Partial so that SQLite can add it without rebuilding the table
+            models.UniqueConstraint(
+                fields=["idempotency_key"],
+                condition=models.Q(idempotency_key__isnull=False),
+                name="booking_idempotency_key_unique",
+            ),
+        ]
     
     def __str__(self):
         return f"Booking {self.booking_reference()} - {self.full_name}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored summary bucket so saves can adjust it
+        if all(name in field_names for name in cls.SUMMARY_FIELDS):
+            instance._summary_snapshot = instance.summary_values()
+        if all(name in field_names for name in cls.INVENTORY_FIELDS):
+            instance._inventory_snapshot = instance.inventory_values()
+        return instance
+
+    # Fields that determine how a booking counts towards BookingSummary
+    SUMMARY_FIELDS = ("is_paid", "gift_aid", "num_tickets", "donation_amount")
+
+    def summary_values(self):
+        """Return this booking's (is_paid, gift_aid, num_tickets, donation_amount)."""
+        return tuple(getattr(self, name) for name in self.SUMMARY_FIELDS)
+
+    # Fields that determine the tickets a booking takes from an event
+    INVENTORY_FIELDS = ("event_id", "num_tickets")
+
+    def inventory_values(self):
+        """Return this booking's (event_id, num_tickets)."""
+        return tuple(getattr(self, name) for name in self.INVENTORY_FIELDS)
+
+    def clean(self):
+        super().clean()
+        # A friendly check for forms; the reservation itself is enforced in
+        # the database when the booking is saved
+        if self.event_id is None or self.num_tickets is None:
+            return
+        previous = getattr(self, "_inventory_snapshot", (None, 0))
+        already_held = previous[1] if previous[0] == self.event_id else 0
+        remaining = (
+            Event.objects.filter(pk=self.event_id)
+            .values_list("capacity", "tickets_sold")
+            .first()
+        )
+        if remaining and self.num_tickets - already_held > remaining[0] - remaining[1]:
+            raise ValidationError(
+                {"num_tickets": f"Only {remaining[0] - remaining[1]} ticket(s) left for this event."}
+            )
+
+    def save(self, *args, **kwargs):
+        # Reserving the event's tickets happens in a post_save signal and
+        # must roll back with the booking if there aren't enough
+        with transaction.atomic(using=kwargs.get("using")):
+            super().save(*args, **kwargs)
     
     def total_amount(self):
         """Calculate the total donation amount."""
@@ -33,4 +302,244 @@ class Booking(models.Model):
         
     def payment_reference(self):
         """Generate a payment reference from the booking ID."""
-        return f"SIB-{self.id}"
\ No newline at end of file
+        return f"SIB-{self.id}"
+
+
+class OutboxEmail(models.Model):
+    """An outgoing email queued for delivery by the send_queued_emails worker."""
+
+    KIND_BOOKING_CONFIRMATION = "booking_confirmation"
+    KIND_ADMIN_NOTIFICATION = "admin_notification"
+    KIND_ADMIN_DIGEST = "admin_digest"
+    KIND_WAITLIST_OFFER = "waitlist_offer"
+    KIND_CHOICES = (
+        (KIND_BOOKING_CONFIRMATION, "Booking confirmation"),
+        (KIND_ADMIN_NOTIFICATION, "Admin notification"),
+        (KIND_ADMIN_DIGEST, "Admin digest"),
+        (KIND_WAITLIST_OFFER, "Waitlist offer"),
+    )
+
+    STATUS_PENDING = "pending"
+    STATUS_SENT = "sent"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = (
+        (STATUS_PENDING, "Pending"),
+        (STATUS_SENT, "Sent"),
+        (STATUS_FAILED, "Failed"),
+    )
+
+    booking = models.ForeignKey(
+        Booking,
+        on_delete=models.SET_NULL,
+        related_name="outbox_emails",
+        blank=True,
+        null=True,
+    )
+    kind = models.CharField(max_length=32, choices=KIND_CHOICES)
+    subject = models.CharField(max_length=255)
+    recipients = models.JSONField(default=list)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+
+    # Delivery state
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["next_attempt_at"],
+                condition=models.Q(status="pending"),
+                name="outbox_pending_due_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} to {', '.join(self.recipients)} ({self.status})"
+
+
+class WaitlistEntry(models.Model):
+    """Someone waiting for tickets to a sold-out event."""
+
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name="waitlist")
+    full_name = models.CharField(max_length=255)
+    email = models.EmailField()
+    num_tickets = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Set when the person is emailed that tickets are available
+    offered_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name_plural = "waitlist entries"
+        ordering = ["created_at", "id"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["event", "email"], name="unique_waitlist_entry_per_event"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.full_name} waiting for {self.num_tickets} ticket(s) to {self.event.name}"
+
+
+
+class BookingSummaryQuerySet(models.QuerySet):
+    def adjust(self, is_paid, gift_aid, bookings=0, tickets=0, amount=0):
+        """Add the given deltas to one summary bucket with a single UPDATE."""
+        bucket = self.filter(is_paid=is_paid, gift_aid=gift_aid)
+        deltas = {
+            "booking_count": F("booking_count") + bookings,
+            "ticket_count": F("ticket_count") + tickets,
+            "donation_total": F("donation_total") + amount,
+        }
+        if bucket.update(**deltas):
+            return
+        try:
+            with transaction.atomic():
+                self.create(
+                    is_paid=is_paid,
+                    gift_aid=gift_aid,
+                    booking_count=bookings,
+                    ticket_count=tickets,
+                    donation_total=amount,
+                )
+        except IntegrityError:
+            # Another process created the bucket first
+            bucket.update(**deltas)
+
+    def totals(self, is_paid=None, gift_aid=None):
+        """
+        Return the same figures as BookingQuerySet.summary() for all bookings
+        matching the given paid and Gift Aid flags, read from the (at most
+        four) summary rows rather than the bookings table.
+        """
+        buckets = self.all()
+        if is_paid is not None:
+            buckets = buckets.filter(is_paid=is_paid)
+        if gift_aid is not None:
+            buckets = buckets.filter(gift_aid=gift_aid)
+
+        totals = {
+            "total_bookings": 0,
+            "total_tickets": 0,
+            "total_amount": 0,
+            "paid_amount": 0,
+            "unpaid_amount": 0,
+            "gift_aid_count": 0,
+        }
+        for bucket in buckets:
+            totals["total_bookings"] += bucket.booking_count
+            totals["total_tickets"] += bucket.ticket_count
+            totals["total_amount"] += bucket.donation_total
+            if bucket.is_paid:
+                totals["paid_amount"] += bucket.donation_total
+            else:
+                totals["unpaid_amount"] += bucket.donation_total
+            if bucket.gift_aid:
+                totals["gift_aid_count"] += bucket.booking_count
+        return totals
+
+    def for_report(self, filters):
+        """
+        Return totals for a ReportFilterForm's cleaned data, or None if the
+        filters include a search, which the summary can't answer.
+        """
+        if filters.get("search"):
+            return None
+        return self.totals(
+            is_paid={"paid": True, "unpaid": False}.get(filters.get("payment_status")),
+            gift_aid={"yes": True, "no": False}.get(filters.get("gift_aid")),
+        )
+
+    def rebuild(self):
+        """
+        Recalculate every bucket from the bookings table.
+
+        Returns:
+            list: (is_paid, gift_aid, field, stored, actual) for every figure
+            that was wrong before the rebuild
+        """
+        with transaction.atomic():
+            differences = self.compare()
+            actual = Booking.objects.order_by().values("is_paid", "gift_aid").annotate(
+                booking_count=Count("id"),
+                ticket_count=Sum("num_tickets", default=0),
+                donation_total=Sum("donation_amount", default=0),
+            )
+            self.all().delete()
+            self.bulk_create(self.model(**bucket) for bucket in actual)
+        return differences
+
+    def compare(self):
+        """
+        Compare every bucket with the bookings table.
+
+        Returns:
+            list: (is_paid, gift_aid, field, stored, actual) for every figure
+            that differs
+        """
+        actual = {
+            (bucket["is_paid"], bucket["gift_aid"]): bucket
+            for bucket in Booking.objects.order_by()
+            .values("is_paid", "gift_aid")
+            .annotate(
+                booking_count=Count("id"),
+                ticket_count=Sum("num_tickets", default=0),
+                donation_total=Sum("donation_amount", default=0),
+            )
+        }
+        stored = {
+            (bucket["is_paid"], bucket["gift_aid"]): bucket
+            for bucket in self.values(
+                "is_paid", "gift_aid", "booking_count", "ticket_count", "donation_total"
+            )
+        }
+
+        differences = []
+        for key in sorted(set(actual) | set(stored)):
+            for field in ("booking_count", "ticket_count", "donation_total"):
+                stored_value = stored.get(key, {}).get(field, 0)
+                actual_value = actual.get(key, {}).get(field, 0)
+                if stored_value != actual_value:
+                    differences.append((*key, field, stored_value, actual_value))
+        return differences
+
+
+class BookingSummary(models.Model):
+    """
+    Denormalised booking totals, one row per paid status and Gift Aid flag.
+
+    Kept up to date by the Booking signal handlers in tickets.signals, so
+    report headers can read four rows instead of scanning every booking.
+    Bulk operations that bypass signals must adjust the buckets themselves;
+    `python manage.py rebuild_booking_summary` recalculates them from scratch.
+    """
+
+    is_paid = models.BooleanField()
+    gift_aid = models.BooleanField()
+    booking_count = models.IntegerField(default=0)
+    ticket_count = models.IntegerField(default=0)
+    donation_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    objects = BookingSummaryQuerySet.as_manager()
+
+    class Meta:
+        verbose_name_plural = "booking summaries"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["is_paid", "gift_aid"], name="unique_booking_summary_bucket"
+            ),
+        ]
+
+    def __str__(self):
+        return (
+            f"{'Paid' if self.is_paid else 'Unpaid'}, "
+            f"{'with' if self.gift_aid else 'without'} Gift Aid: "
+            f"{self.booking_count} bookings"
+        )
@@ -0,0 +1,153 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of OFFSET, each page is fetched with a WHERE clause on the ordering
+columns of the last row of the previous page, so every page costs the same
+as the first. Pages link to each other with opaque, signed cursor tokens.
+"""
+
+from decimal import Decimal
+
+from django.core import signing
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+
+CURSOR_VAR = "cursor"
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Paginate ``queryset`` by the given ordering, which must end in a unique
+    column (such as ``-id``) so that every row has a distinct position.
+
+    Ordering names may be model fields or annotations on the queryset.
+    """
+
+    salt = "tickets.pagination.cursor"
+
+    def __init__(self, queryset, per_page, ordering):
+        self.queryset = queryset.order_by(*ordering)
+        self.per_page = per_page
+        self.ordering = [
+            (name.lstrip("-"), name.startswith("-")) for name in ordering
+        ]
+
+    def page(self, cursor=None):
+        """
+        Return the page the cursor points to, or the first page.
+
+        Raises:
+            InvalidCursor: if the cursor was tampered with or doesn't fit
+                this ordering
+        """
+        if not cursor:
+            return self._page_after(None)
+
+        try:
+            direction, values = signing.loads(cursor, salt=self.salt)
+        except (signing.BadSignature, TypeError, ValueError):
+            raise InvalidCursor(cursor)
+        if direction not in ("next", "previous") or len(values) != len(self.ordering):
+            raise InvalidCursor(cursor)
+        values = self._decode(values)
+
+        if direction == "next":
+            return self._page_after(values)
+        return self._page_before(values)
+
+    def _page_after(self, values):
+        queryset = self.queryset
+        if values is not None:
+            queryset = queryset.filter(self._seek(values, forwards=True))
+        rows = list(queryset[: self.per_page + 1])
+
+        has_next = len(rows) > self.per_page
+        rows = rows[: self.per_page]
+        return KeysetPage(
+            rows,
+            next_cursor=self._cursor("next", rows[-1]) if has_next else None,
+            previous_cursor=(
+                self._cursor("previous", rows[0]) if values is not None and rows else None
+            ),
+        )
+
+    def _page_before(self, values):
+        queryset = self.queryset.filter(self._seek(values, forwards=False)).reverse()
+        rows = list(queryset[: self.per_page + 1])
+
+        has_previous = len(rows) > self.per_page
+        rows = rows[: self.per_page][::-1]
+        return KeysetPage(
+            rows,
+            next_cursor=self._cursor("next", rows[-1]) if rows else None,
+            previous_cursor=self._cursor("previous", rows[0]) if has_previous else None,
+        )
+
+    def _seek(self, values, forwards):
+        """
+        Build the condition for rows after (or before) ``values``:
+        (a > x) OR (a = x AND b > y) OR ..., flipping each comparison for
+        descending columns.
+        """
+        condition = Q()
+        equal = Q()
+        for (name, descending), value in zip(self.ordering, values):
+            lookup = "lt" if descending == forwards else "gt"
+            condition |= equal & Q(**{f"{name}__{lookup}": value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def _cursor(self, direction, row):
+        values = [self._encode(getattr(row, name)) for name, _ in self.ordering]
+        return signing.dumps([direction, values], salt=self.salt, compress=True)
+
+    def _field(self, name):
+        try:
+            return self.queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+
+    @staticmethod
+    def _encode(value):
+        if hasattr(value, "isoformat"):
+            return value.isoformat()
+        if isinstance(value, Decimal):
+            return str(value)
+        return value
+
+    def _decode(self, values):
+        decoded = []
+        for (name, _), value in zip(self.ordering, values):
+            field = self._field(name)
+            try:
+                decoded.append(field.to_python(value) if field is not None else value)
+            except Exception:
+                raise InvalidCursor(value)
+        return decoded
+
@@ -0,0 +1,369 @@
+"""
+Bank statement reconciliation.
+
+Bookings are paid by bank transfer quoting the booking's payment reference
+(SIB-<id>). Reconciliation reads a bank statement export (CSV or OFX),
+matches the money paid in against unpaid bookings and marks the matched
+bookings paid with a single UPDATE.
+
+Each credit is matched in two passes, against indexes of the candidate
+bookings built in memory up front:
+
+1. By reference: a SIB-<id> anywhere in the transaction's description
+   (spaces, dashes and leading zeros are tolerated) names the booking.
+   It's matched if the amount covers the booking's donation.
+2. By amount, date and name: otherwise, an unpaid booking for exactly the
+   amount, made no more than RECONCILE_WINDOW_DAYS before the payment,
+   whose surname appears in the description. If more than one booking fits
+   equally well, the payment is reported as ambiguous rather than guessed.
+
+Debits are ignored. Payments that can't be matched, that pay for a booking
+that's already paid, or that are ambiguous are listed in the result for
+staff to resolve by hand.
+"""
+
+import csv
+import io
+import re
+from bisect import bisect_left
+from collections import defaultdict, namedtuple
+from datetime import datetime, time, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from .caching import invalidate_confirmation_pages
+from .models import Booking, BookingSummary
+
+# How long before a payment a booking matched without its reference can
+# have been made
+RECONCILE_WINDOW_DAYS = 30
+
+StatementLine = namedtuple("StatementLine", "line date amount description")
+Match = namedtuple("Match", "statement_line booking_id method")
+Unmatched = namedtuple("Unmatched", "statement_line reason booking_ids")
+
+REFERENCE_RE = re.compile(r"\bSIB[\s\-_/.]*0*(\d+)\b", re.I)
+WORD_RE = re.compile(r"[A-Z]+")
+
+DATE_FORMATS = (
+    "%d/%m/%Y",
+    "%d/%m/%y",
+    "%Y-%m-%d",
+    "%d-%m-%Y",
+    "%d %b %Y",
+    "%d %B %Y",
+    "%d-%b-%Y",
+    "%d-%b-%y",
+)
+
+# Lower-cased CSV headings used by common UK bank exports
+DATE_HEADINGS = ("date", "transaction date", "posting date", "posted date", "value date")
+AMOUNT_HEADINGS = ("amount", "value", "amount (gbp)", "transaction amount")
+CREDIT_HEADINGS = ("paid in", "money in", "credit", "credit amount", "in")
+DEBIT_HEADINGS = ("paid out", "money out", "debit", "debit amount", "out")
+DESCRIPTION_HEADINGS = (
+    "description",
+    "transaction description",
+    "details",
+    "narrative",
+    "reference",
+    "memo",
+    "name",
+    "payee",
+    "counter party",
+    "transaction details",
+)
+
+# OFX 1.x is SGML, where closing tags are optional
+OFX_TRANSACTION_RE = re.compile(
+    r"<STMTTRN>(.*?)(?:</STMTTRN>|(?=<STMTTRN>)|</BANKTRANLIST>)", re.S | re.I
+)
+OFX_FIELD_RE = re.compile(r"<(DTPOSTED|TRNAMT|NAME|MEMO|PAYEE)>([^<\r\n]*)", re.I)
+
+
+class StatementError(Exception):
+    """Raised when a bank statement can't be read."""
+
+
+def parse_amount(value):
+    """Parse an amount like "£1,234.50", "(12.00)" or "12.00 CR"."""
+    value = value.strip().replace(",", "").replace("£", "").replace(" ", "")
+    if not value:
+        return None
+    sign = 1
+    if value.startswith("(") and value.endswith(")"):
+        sign, value = -1, value[1:-1]
+    elif value.upper().endswith("DR"):
+        sign, value = -1, value[:-2]
+    elif value.upper().endswith("CR"):
+        value = value[:-2]
+    try:
+        return sign * Decimal(value)
+    except InvalidOperation:
+        raise StatementError(f"'{value}' is not an amount")
+
+
+def parse_date(value):
+    value = value.strip()
+    for format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, format).date()
+        except ValueError:
+            pass
+    raise StatementError(f"'{value}' is not a date")
+
+
+def _find_heading(headings, candidates):
+    for candidate in candidates:
+        if candidate in headings:
+            return headings[candidate]
+    return None
+
+
+def parse_csv(text):
+    """Yield a StatementLine for each row of a CSV statement export."""
+    reader = csv.reader(io.StringIO(text))
+    # Some banks put account details above the column headings
+    for header in reader:
+        headings = {heading.strip().lower(): index for index, heading in enumerate(header)}
+        date_column = _find_heading(headings, DATE_HEADINGS)
+        if date_column is not None:
+            break
+    else:
+        raise StatementError("No date column found in the CSV statement")
+
+    amount_column = _find_heading(headings, AMOUNT_HEADINGS)
+    credit_column = _find_heading(headings, CREDIT_HEADINGS)
+    debit_column = _find_heading(headings, DEBIT_HEADINGS)
+    if amount_column is None and credit_column is None:
+        raise StatementError("No amount or paid in column found in the CSV statement")
+    description_columns = [
+        index for heading, index in headings.items() if heading in DESCRIPTION_HEADINGS
+    ]
+
+    def cell(row, index):
+        return row[index] if index is not None and index < len(row) else ""
+
+    for row in reader:
+        if not any(value.strip() for value in row):
+            continue
+        line = reader.line_num
+        try:
+            if amount_column is not None:
+                amount = parse_amount(cell(row, amount_column))
+            else:
+                amount = parse_amount(cell(row, credit_column)) or -(
+                    parse_amount(cell(row, debit_column)) or 0
+                )
+            date = parse_date(cell(row, date_column))
+        except StatementError as e:
+            raise StatementError(f"Line {line}: {e}")
+        description = " ".join(
+            filter(None, (cell(row, index).strip() for index in description_columns))
+        )
+        yield StatementLine(line, date, amount or Decimal(0), description)
+
+
+def parse_ofx(text):
+    """Yield a StatementLine for each transaction in an OFX (1.x SGML or 2.x XML) statement."""
+    for number, match in enumerate(OFX_TRANSACTION_RE.finditer(text), start=1):
+        fields = defaultdict(list)
+        for name, value in OFX_FIELD_RE.findall(match[1]):
+            fields[name.upper()].append(value.strip())
+        try:
+            amount = parse_amount(fields["TRNAMT"][0])
+            date = datetime.strptime(fields["DTPOSTED"][0][:8], "%Y%m%d").date()
+        except (IndexError, ValueError, StatementError):
+            raise StatementError(f"Transaction {number} has no valid amount or date")
+        description = " ".join(fields["NAME"] + fields["PAYEE"] + fields["MEMO"])
+        yield StatementLine(number, date, amount, description)
+
+
+def parse_statement(content, filename=""):
+    """
+    Parse a bank statement export from its bytes, as OFX if it looks like
+    OFX and as CSV otherwise.
+
+    Returns:
+        list: StatementLine tuples
+    """
+    try:
+        text = content.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        text = content.decode("latin-1")
+    if filename.lower().endswith((".ofx", ".qfx")) or "<OFX>" in text[:4096].upper():
+        return list(parse_ofx(text))
+    return list(parse_csv(text))
+
+
+def name_words(full_name):
+    return WORD_RE.findall(full_name.upper())
+
+
+class Reconciliation:
+    """
+    Match the credits in a list of StatementLines to bookings.
+
+    After match(), ``matches`` holds a Match(statement_line, booking_id,
+    method) for each payment matched to an unpaid booking, and
+    ``unmatched`` an Unmatched(statement_line, reason, booking_ids) for each
+    payment that needs a person to look at it.
+    """
+
+    def __init__(self, statement_lines, window_days=RECONCILE_WINDOW_DAYS):
+        self.credits = [line for line in statement_lines if line.amount > 0]
+        self.debits = len(statement_lines) - len(self.credits)
+        self.window = timedelta(days=window_days)
+        self.matches = []
+        self.unmatched = []
+        self.marked_paid = 0
+
+    def load_bookings(self):
+        """
+        Index the bookings the statement could be paying for: every booking
+        it quotes a reference for, and every unpaid booking made in the
+        window before the statement's payments.
+        """
+        references = {
+            int(reference)
+            for line in self.credits
+            for reference in REFERENCE_RE.findall(line.description)
+        }
+        fields = ("id", "full_name", "donation_amount", "is_paid", "created_at")
+        bookings = {}
+        if references:
+            for booking in Booking.objects.filter(pk__in=references).values_list(*fields):
+                bookings[booking[0]] = booking
+        if self.credits:
+            # A datetime range rather than __date lookups, so the created_at
+            # index can be used
+            start = min(line.date for line in self.credits) - self.window
+            end = max(line.date for line in self.credits) + timedelta(days=1)
+            unpaid = Booking.objects.filter(
+                is_paid=False,
+                created_at__gte=timezone.make_aware(datetime.combine(start, time.min)),
+                created_at__lt=timezone.make_aware(datetime.combine(end, time.min)),
+            ).values_list(*fields)
+            for booking in unpaid.iterator(chunk_size=2000):
+                bookings[booking[0]] = booking
+
+        # (date made, ID, first name) of unpaid bookings by amount and
+        # surname, in date order, for matching payments without a reference
+        by_surname = defaultdict(list)
+        for booking_id, full_name, donation_amount, is_paid, created_at in bookings.values():
+            words = name_words(full_name)
+            if not is_paid and words:
+                first = words[0] if len(words) > 1 else ""
+                by_surname[donation_amount, words[-1]].append(
+                    (timezone.localdate(created_at), booking_id, first)
+                )
+        for candidates in by_surname.values():
+            candidates.sort()
+        return bookings, by_surname
+
+    def match(self):
+        bookings, by_surname = self.load_bookings()
+        matched_ids = set()
+        without_reference = []
+
+        for line in self.credits:
+            referenced = [
+                int(reference)
+                for reference in dict.fromkeys(REFERENCE_RE.findall(line.description))
+                if int(reference) in bookings
+            ]
+            if not referenced:
+                without_reference.append(line)
+            elif len(referenced) > 1:
+                self.unmatched.append(
+                    Unmatched(line, "Quotes more than one booking reference", referenced)
+                )
+            else:
+                self.match_reference(line, bookings[referenced[0]], matched_ids)
+
+        for line in without_reference:
+            self.match_details(line, by_surname, matched_ids)
+        return self.matches
+
+    def match_reference(self, line, booking, matched_ids):
+        booking_id, _, donation_amount, is_paid, _ = booking
+        if is_paid or booking_id in matched_ids:
+            self.unmatched.append(
+                Unmatched(line, "Booking is already paid, or paid twice in this statement", [booking_id])
+            )
+        elif line.amount < donation_amount:
+            self.unmatched.append(
+                Unmatched(line, f"Less than the £{donation_amount} due", [booking_id])
+            )
+        else:
+            matched_ids.add(booking_id)
+            self.matches.append(Match(line, booking_id, "reference"))
+
+    def match_details(self, line, by_surname, matched_ids):
+        payment_words = set(name_words(line.description))
+        earliest = (line.date - self.window,)
+        latest = (line.date + timedelta(days=1),)
+        scored = defaultdict(list)
+        for word in payment_words:
+            candidates = by_surname.get((line.amount, word))
+            if not candidates:
+                continue
+            for _, booking_id, first in candidates[
+                bisect_left(candidates, earliest) : bisect_left(candidates, latest)
+            ]:
+                if booking_id in matched_ids:
+                    continue
+                # Surname, plus first name or initial if the bank shows them
+                score = 1 + (first in payment_words or first[:1] in payment_words)
+                scored[score].append(booking_id)
+
+        if not scored:
+            self.unmatched.append(Unmatched(line, "No matching booking", []))
+            return
+        best = scored[max(scored)]
+        if len(best) > 1:
+            self.unmatched.append(
+                Unmatched(line, "Matches more than one booking equally well", best)
+            )
+            return
+        matched_ids.add(best[0])
+        self.matches.append(Match(line, best[0], "amount, date and name"))
+
+    def apply(self):
+        """
+        Mark every matched booking paid with a single UPDATE, adjusting the
+        booking summary as saving each booking would.
+
+        Returns:
+            int: The number of bookings marked paid
+        """
+        booking_ids = [match.booking_id for match in self.matches]
+        if not booking_ids:
+            return 0
+        with transaction.atomic():
+            # Lock the rows, and skip any marked paid since they were matched
+            unpaid = Booking.objects.select_for_update().filter(pk__in=booking_ids, is_paid=False)
+            rows = list(unpaid.values_list("id", "gift_aid", "num_tickets", "donation_amount"))
+            Booking.objects.filter(pk__in=[row[0] for row in rows]).update(
+                is_paid=True, updated_at=timezone.now()
+            )
+
+            # The UPDATE bypasses the signals that maintain the summary
+            buckets = defaultdict(lambda: [0, 0, 0])
+            for _, gift_aid, num_tickets, donation_amount in rows:
+                counts = buckets[gift_aid]
+                counts[0] += 1
+                counts[1] += num_tickets
+                counts[2] += donation_amount
+            for gift_aid, (count, tickets, amount) in buckets.items():
+                BookingSummary.objects.adjust(
+                    False, gift_aid, bookings=-count, tickets=-tickets, amount=-amount
+                )
+                BookingSummary.objects.adjust(
+                    True, gift_aid, bookings=count, tickets=tickets, amount=amount
+                )
+            invalidate_confirmation_pages(row[0] for row in rows)
+        self.marked_paid = len(rows)
+        return self.marked_paid
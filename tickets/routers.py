@@ -0,0 +1,132 @@
+"""
+Database routing for an optional read replica.
+
+When REPLICA_DATABASE_URL is set, settings add a "replica" database. Views
+that call use_replica() read from it for the rest of the request: the
+booking report, export and API, and the admin's booking list. During a
+sale, that keeps staff reports from competing with booking inserts on the
+primary ("default"). Every write goes to the primary, and so does every
+other read, including the whole booking flow.
+
+A replica lags behind the primary. A client that has just written
+shouldn't read from it, or it might not see its own change. After a
+request writes, ReplicaStickinessMiddleware sets a cookie, and while the
+cookie lasts (REPLICA_STICKY_SECONDS) that client's reads stay on the
+primary. So a confirmation page reached by redirect always finds its
+booking, and a report reloaded after marking a booking paid shows it as
+paid.
+
+Without a replica configured, or with REPLICA_READS off (as it is in
+tests, unless a test turns it on), the router sends everything to the
+primary.
+For local testing with SQLite, point REPLICA_DATABASE_URL at a second file
+and keep it updated with `manage.py sync_sqlite_replica --loop`.
+"""
+
+import contextvars
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+REPLICA = "replica"
+STICKY_COOKIE = "db_primary"
+
+
+class Routing:
+    """Where the current request's queries go."""
+
+    __slots__ = ("replica", "pinned", "wrote")
+
+    def __init__(self, pinned=False):
+        # Reads may go to the replica
+        self.replica = False
+        # Reads must stay on the primary, as the client has written recently
+        self.pinned = pinned
+        # This request has written to the primary
+        self.wrote = False
+
+
+_current = contextvars.ContextVar("tickets_db_routing", default=None)
+
+
+def has_replica():
+    return settings.REPLICA_READS and REPLICA in settings.DATABASES
+
+
+def use_replica():
+    """
+    Read from the replica for the rest of the current request, if there
+    is one and the client hasn't written recently.
+    """
+    routing = _current.get()
+    if routing is not None:
+        routing.replica = True
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        routing = _current.get()
+        if routing is not None and routing.replica and not routing.pinned and has_replica():
+            return REPLICA
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        routing = _current.get()
+        if routing is not None:
+            # Read what this request writes back from the primary too
+            routing.wrote = routing.pinned = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica's schema comes from the primary
+        return db != REPLICA
+
+
+class ReplicaStickinessMiddleware:
+    """Route each request's queries (see the module docstring)."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        routing = Routing(pinned=STICKY_COOKIE in request.COOKIES)
+        token = _current.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.stick(request, response, routing)
+
+    async def __acall__(self, request):
+        routing = Routing(pinned=STICKY_COOKIE in request.COOKIES)
+        token = _current.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.stick(request, response, routing)
+
+    def stick(self, request, response, routing):
+        """Keep a client that has just written on the primary for a while."""
+        if routing.wrote and has_replica():
+            response.set_cookie(
+                STICKY_COOKIE,
+                "1",
+                max_age=settings.REPLICA_STICKY_SECONDS,
+                secure=request.is_secure(),
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
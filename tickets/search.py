@@ -0,0 +1,126 @@
+"""
+Name and email search over bookings.
+
+The backend is chosen from the database vendor, or set explicitly with the
+BOOKING_SEARCH_BACKEND setting (a dotted path to a SearchBackend subclass):
+
+- PostgreSQL: ICONTAINS lookups served by pg_trgm GIN indexes on
+  UPPER(full_name) and UPPER(email), ranked by trigram word similarity.
+- SQLite: an FTS5 table with the trigram tokenizer, kept in sync with
+  tickets_booking by triggers and ranked by bm25.
+- Anything else: plain ICONTAINS with no ranking.
+
+A booking reference (SIB-<id>) is looked up by ID on every backend.
+
+Migration 0007 creates the indexes, FTS table and triggers. A migration
+that makes SQLite rebuild tickets_booking drops the triggers, so it must
+create them again.
+"""
+
+import re
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+BOOKING_TABLE = "tickets_booking"
+SQLITE_SEARCH_TABLE = "tickets_booking_search"
+
+# Trigram indexes can't help with queries shorter than one trigram
+MIN_TRIGRAM_QUERY_LENGTH = 3
+
+# Booking references aren't stored, so they can't be matched as text
+REFERENCE_RE = re.compile(r"\s*SIB-?(\d+)\s*", re.IGNORECASE)
+
+
+class SearchBackend:
+    """Unranked substring search. Subclasses add indexing and ranking."""
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def filter(self, queryset, query):
+        """Return ``queryset`` limited to bookings matching ``query``."""
+        reference = REFERENCE_RE.fullmatch(query)
+        if reference:
+            return queryset.filter(id=reference[1])
+        return queryset.filter(Q(full_name__icontains=query) | Q(email__icontains=query))
+
+    def rank(self, queryset, query):
+        """Return ``queryset`` annotated with ``search_rank`` (higher is better)."""
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+class PostgresSearchBackend(SearchBackend):
+    def rank(self, queryset, query):
+        from django.contrib.postgres.search import TrigramWordSimilarity
+        from django.db.models.functions import Greatest
+
+        return queryset.annotate(
+            search_rank=Greatest(
+                TrigramWordSimilarity(query, "full_name"),
+                TrigramWordSimilarity(query, "email"),
+            )
+        )
+
+
+class SQLiteSearchBackend(SearchBackend):
+    def filter(self, queryset, query):
+        if len(query) < MIN_TRIGRAM_QUERY_LENGTH or REFERENCE_RE.fullmatch(query):
+            return super().filter(queryset, query)
+        return queryset.filter(
+            id__in=RawSQL(
+                f"SELECT rowid FROM {SQLITE_SEARCH_TABLE} "
+                f"WHERE {SQLITE_SEARCH_TABLE} MATCH %s",
+                [self.match_expression(query)],
+            )
+        )
+
+    def rank(self, queryset, query):
+        if len(query) < MIN_TRIGRAM_QUERY_LENGTH or REFERENCE_RE.fullmatch(query):
+            return super().rank(queryset, query)
+        # Join the FTS table so bm25() is computed in the same index scan;
+        # it is lower for better matches, so negate it
+        return queryset.extra(
+            tables=[SQLITE_SEARCH_TABLE],
+            where=[
+                f"{SQLITE_SEARCH_TABLE} MATCH %s",
+                f"{SQLITE_SEARCH_TABLE}.rowid = {BOOKING_TABLE}.id",
+            ],
+            params=[self.match_expression(query)],
+        ).annotate(
+            search_rank=RawSQL(
+                f"-bm25({SQLITE_SEARCH_TABLE})", [], output_field=FloatField()
+            )
+        )
+
+    @staticmethod
+    def match_expression(query):
+        """Quote ``query`` as an FTS5 string, which the trigram tokenizer
+        matches as a case-insensitive substring."""
+        return '"' + query.replace('"', '""') + '"'
+
+
+_backends = {}
+
+
+def get_search_backend(alias="default"):
+    """Return the search backend for a database alias."""
+    if alias not in _backends:
+        backend_path = getattr(settings, "BOOKING_SEARCH_BACKEND", None)
+        if backend_path:
+            backend_class = import_string(backend_path)
+        else:
+            connection = connections[alias]
+            backend_class = SearchBackend
+            if connection.vendor == "postgresql":
+                backend_class = PostgresSearchBackend
+            elif connection.vendor == "sqlite":
+                with connection.cursor() as cursor:
+                    tables = connection.introspection.table_names(cursor)
+                if SQLITE_SEARCH_TABLE in tables:
+                    backend_class = SQLiteSearchBackend
+        _backends[alias] = backend_class(alias)
+    return _backends[alias]
@@ -0,0 +1,105 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .caching import invalidate_confirmation_pages
+from .models import Booking, BookingSummary, Event, OutboxEmail, SoldOut
+
+
+@receiver(pre_save, sender=Booking)
+def remember_stored_values(sender, instance, raw, **kwargs):
+    """
+    Make sure an updated booking knows which summary bucket it came from
+    and which event tickets it holds.
+    """
+    if raw or instance._state.adding:
+        return
+    if hasattr(instance, "_summary_snapshot") and hasattr(instance, "_inventory_snapshot"):
+        return
+    stored = (
+        Booking.objects.filter(pk=instance.pk)
+        .values_list(*Booking.SUMMARY_FIELDS, *Booking.INVENTORY_FIELDS)
+        .first()
+    )
+    if stored is not None:
+        split = len(Booking.SUMMARY_FIELDS)
+        instance.__dict__.setdefault("_summary_snapshot", stored[:split])
+        instance.__dict__.setdefault("_inventory_snapshot", stored[split:])
+
+
+@receiver(post_save, sender=Booking)
+def update_summary_on_save(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    previous = None if created else getattr(instance, "_summary_snapshot", None)
+    current = instance.summary_values()
+    if previous == current:
+        return
+
+    if previous is not None:
+        is_paid, gift_aid, num_tickets, donation_amount = previous
+        BookingSummary.objects.adjust(
+            is_paid, gift_aid, bookings=-1, tickets=-num_tickets, amount=-donation_amount
+        )
+    is_paid, gift_aid, num_tickets, donation_amount = current
+    BookingSummary.objects.adjust(
+        is_paid, gift_aid, bookings=1, tickets=num_tickets, amount=donation_amount
+    )
+    instance._summary_snapshot = current
+
+
+@receiver(post_delete, sender=Booking)
+def update_summary_on_delete(sender, instance, **kwargs):
+    is_paid, gift_aid, num_tickets, donation_amount = getattr(
+        instance, "_summary_snapshot", instance.summary_values()
+    )
+    BookingSummary.objects.adjust(
+        is_paid, gift_aid, bookings=-1, tickets=-num_tickets, amount=-donation_amount
+    )
+
+
+@receiver(post_save, sender=Booking)
+def update_event_inventory_on_save(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    previous = None if created else getattr(instance, "_inventory_snapshot", None)
+    current = instance.inventory_values()
+    if previous == current:
+        return
+
+    if previous is not None and previous[0] is not None:
+        Event.objects.release(*previous)
+    if current[0] is not None and not Event.objects.reserve(*current):
+        raise SoldOut(*current)
+    instance._inventory_snapshot = current
+
+
+@receiver(post_delete, sender=Booking)
+def update_event_inventory_on_delete(sender, instance, **kwargs):
+    event_id, num_tickets = getattr(
+        instance, "_inventory_snapshot", instance.inventory_values()
+    )
+    if event_id is not None:
+        Event.objects.release(event_id, num_tickets)
+
+
+@receiver([post_save, post_delete], sender=Event)
+def clear_current_event_cache(sender, **kwargs):
+    Event.objects.clear_cache()
+
+
+@receiver([post_save, post_delete], sender=Booking)
+def clear_confirmation_page_cache(sender, instance, created=False, raw=False, **kwargs):
+    # A new booking's page hasn't been cached yet
+    if not (created or raw):
+        invalidate_confirmation_pages([instance.pk])
+
+
+@receiver(post_save, sender=OutboxEmail)
+def clear_confirmation_page_cache_for_email(sender, instance, created, raw, **kwargs):
+    # The page shows whether its confirmation email has been sent
+    if (
+        not (created or raw)
+        and instance.kind == OutboxEmail.KIND_BOOKING_CONFIRMATION
+        and instance.booking_id
+    ):
+        invalidate_confirmation_pages([instance.booking_id])
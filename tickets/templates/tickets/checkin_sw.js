@@ -0,0 +1,55 @@
+// Service worker for the door check-in page. It keeps the page, its
+// static files and the latest bookings snapshot, so the page still loads
+// and searches when the venue's connection drops.
+const CACHE = "checkin-{{ cache_version }}";
+const PAGE_URL = "{% url 'checkin' %}";
+const SNAPSHOT_URL = "{% url 'checkin_snapshot' %}";
+const ASSETS = [{% for asset in assets %}"{{ asset|escapejs }}"{% if not forloop.last %}, {% endif %}{% endfor %}];
+
+self.addEventListener("install", (event) => {
+    event.waitUntil(
+        caches.open(CACHE).then((cache) => cache.addAll(ASSETS)).then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener("activate", (event) => {
+    event.waitUntil(
+        caches.keys()
+            .then((keys) => Promise.all(
+                keys.filter((key) => key.startsWith("checkin-") && key !== CACHE).map((key) => caches.delete(key))
+            ))
+            .then(() => self.clients.claim())
+    );
+});
+
+self.addEventListener("fetch", (event) => {
+    const request = event.request;
+    if (request.method !== "GET") return;
+    const url = new URL(request.url);
+    if (url.origin !== self.location.origin) return;
+
+    if (ASSETS.includes(url.pathname)) {
+        // Static file names are hashed, so a cached copy is always current
+        event.respondWith(caches.match(request).then((cached) => cached || fetch(request)));
+    } else if (url.pathname === PAGE_URL || url.pathname === SNAPSHOT_URL) {
+        event.respondWith(networkFirst(request));
+    }
+});
+
+// Use the network when there is one, keeping a copy of each full
+// response; fall back to the copy when there isn't
+async function networkFirst(request) {
+    const cache = await caches.open(CACHE);
+    try {
+        const response = await fetch(request);
+        // Not 304s, or the login page after a session has expired
+        if (response.status === 200 && !response.redirected) {
+            await cache.put(request.url, response.clone());
+        }
+        return response;
+    } catch (error) {
+        const cached = await cache.match(request.url);
+        if (cached) return cached;
+        throw error;
+    }
+}
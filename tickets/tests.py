@@ -1,3 +1,2293 @@
-from django.test import TestCase
+import csv
+import importlib
+import io
+import json
+import re
+import uuid
+import zipfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+from smtplib import SMTPException, SMTPServerDisconnected
+from unittest import mock, skipUnless
+from xml.etree import ElementTree
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.auth.models import User
+from django.core import mail, signing
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail import EmailMessage
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Q, Sum
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, resolve, reverse
+from django.utils import timezone
+
+from . import urls as ticket_urls
+from .caching import confirmation_cache_key
+from .checkin import snapshot_version
+from .email_backends import PooledEmailBackend, SMTPConnectionPool, pool_stats
+from .exports import EXPORT_COLUMNS, stream_xlsx
+from .forms import BookingFormV3
+from .gift_aid import SCHEDULE_HEADINGS, GiftAidClaim, write_schedule
+from .imports import BookingImport, RowError, read_rows
+from .instrumentation import Metrics
+from .models import Booking, BookingSummary, Event, OutboxEmail, SoldOut, WaitlistEntry
+from .pagination import InvalidCursor, KeysetPaginator
+from .reconciliation import (
+    Reconciliation,
+    StatementError,
+    StatementLine,
+    parse_amount,
+    parse_csv,
+    parse_ofx,
+    parse_statement,
+)
+from .routers import REPLICA, STICKY_COOKIE, ReplicaStickinessMiddleware, use_replica
+from .search import (
+    SQLITE_SEARCH_TABLE,
+    PostgresSearchBackend,
+    SQLiteSearchBackend,
+    get_search_backend,
+)
+from .utils import (
+    claim_outbox_batch,
+    claim_outbox_email,
+    deliver_outbox_batch,
+    outbox_retry_delay,
+    queue_admin_notification_digest,
+)
+from .views import BookingConfirmationViewAsync, BookingCreateViewAsync, BookingReportView
+
+
+def make_booking(**fields):
+    values = {
+        "full_name": "Ada Lovelace",
+        "email": "ada@example.com",
+        "num_tickets": 1,
+        "donation_amount": Decimal("10.00"),
+    }
+    values.update(fields)
+    return Booking.objects.create(**values)
+
+
+def make_event(**fields):
+    values = {"name": "Gala", "starts_at": timezone.now(), "capacity": 10}
+    values.update(fields)
+    return Event.objects.create(**values)
+
+
+class StaffTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user("staff", password="password", is_staff=True)
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+
+
+class BookingReportTests(StaffTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for i in range(45):
+            make_booking(
+                full_name=f"Booker {i}",
+                email=f"booker{i}@example.com",
+                num_tickets=i % 4 + 1,
+                donation_amount=Decimal(10 + i),
+                gift_aid=i % 3 == 0,
+                is_paid=i % 2 == 0,
+            )
+
+    def old_summary(self, bookings):
+        """The figures as the report worked them out, one query per figure."""
+        return {
+            "total_bookings": bookings.count(),
+            "total_tickets": bookings.aggregate(Sum("num_tickets"))["num_tickets__sum"] or 0,
+            "total_amount": (
+                bookings.aggregate(Sum("donation_amount"))["donation_amount__sum"] or 0
+            ),
+            "paid_amount": (
+                bookings.filter(is_paid=True).aggregate(Sum("donation_amount"))[
+                    "donation_amount__sum"
+                ]
+                or 0
+            ),
+            "unpaid_amount": (
+                bookings.filter(is_paid=False).aggregate(Sum("donation_amount"))[
+                    "donation_amount__sum"
+                ]
+                or 0
+            ),
+            "gift_aid_count": bookings.filter(gift_aid=True).count(),
+        }
+
+    def assertReportSummary(self, response, bookings):
+        expected = self.old_summary(bookings)
+        self.assertEqual(
+            {name: response.context[name] for name in expected}, expected
+        )
+
+    def test_unfiltered_report_queries(self):
+        # The session and user, the summary rows and the page of bookings
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse("booking_report"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["bookings"]), 20)
+        self.assertReportSummary(response, Booking.objects.all())
+
+    def test_filtered_report_queries(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(
+                reverse("booking_report"), {"payment_status": "paid", "gift_aid": "yes"}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertReportSummary(
+            response, Booking.objects.filter(is_paid=True, gift_aid=True)
+        )
+
+    def test_searched_report_queries(self):
+        # A search is summarised with one aggregate query over the matches.
+        # The search backend is picked once per process, by introspection.
+        get_search_backend()
+        with self.assertNumQueries(4):
+            response = self.client.get(
+                reverse("booking_report"), {"payment_status": "unpaid", "search": "Booker 1"}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertReportSummary(
+            response,
+            Booking.objects.filter(
+                Q(full_name__icontains="Booker 1") | Q(email__icontains="Booker 1"),
+                is_paid=False,
+            ),
+        )
+
+    def test_summary_matches_per_field_queries(self):
+        for filters in (
+            {},
+            {"is_paid": True},
+            {"is_paid": False, "gift_aid": True},
+            {"full_name__icontains": "no such booker"},
+        ):
+            with self.subTest(filters=filters):
+                bookings = Booking.objects.filter(**filters)
+                with self.assertNumQueries(1):
+                    summary = bookings.summary()
+                self.assertEqual(summary, self.old_summary(bookings))
+
+
+class KeysetPaginationTests(StaffTestCase):
+    def setUp(self):
+        super().setUp()
+        created_at = timezone.now() - timedelta(days=1)
+        for i in range(7):
+            make_booking(
+                full_name=f"Booker {i}",
+                email=f"booker{i}@example.com",
+                num_tickets=i % 2 + 1,
+                is_paid=i % 3 != 0,
+            )
+        # Every booking ties on created_at, so pages are told apart by id
+        Booking.objects.update(created_at=created_at)
+        self.ids = list(Booking.objects.order_by("-id").values_list("id", flat=True))
+
+    def walk(self, paginator):
+        """Follow next cursors to the last page, then previous cursors back."""
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        backwards = [pages[-1]]
+        while backwards[-1].has_previous():
+            backwards.append(paginator.page(backwards[-1].previous_cursor))
+        return [[booking.pk for booking in page] for page in pages], [
+            [booking.pk for booking in page] for page in backwards[::-1]
+        ]
+
+    def test_pages_with_tied_sort_keys(self):
+        paginator = KeysetPaginator(Booking.objects.all(), 3, ["-created_at", "-id"])
+        forwards, backwards = self.walk(paginator)
+        self.assertEqual(forwards, [self.ids[0:3], self.ids[3:6], self.ids[6:]])
+        self.assertEqual(backwards, forwards)
+
+        first = paginator.page()
+        self.assertFalse(first.has_previous())
+        last = paginator.page(paginator.page(first.next_cursor).next_cursor)
+        self.assertFalse(last.has_next())
+
+    def test_ascending_ordering_with_ties(self):
+        paginator = KeysetPaginator(Booking.objects.all(), 2, ["num_tickets", "-id"])
+        forwards, backwards = self.walk(paginator)
+        expected = list(
+            Booking.objects.order_by("num_tickets", "-id").values_list("id", flat=True)
+        )
+        self.assertEqual([pk for page in forwards for pk in page], expected)
+        self.assertEqual(backwards, forwards)
+
+    def test_invalid_cursors(self):
+        paginator = KeysetPaginator(Booking.objects.all(), 3, ["-created_at", "-id"])
+        cursor = paginator.page().next_cursor
+        other_ordering = KeysetPaginator(Booking.objects.all(), 3, ["-id"])
+        for bad in (
+            "garbage",
+            cursor[:-1] + ("A" if cursor[-1] != "A" else "B"),
+            other_ordering.page().next_cursor,
+            signing.dumps(["sideways", ["2026-01-01T00:00:00", 1]], salt=paginator.salt),
+            signing.dumps(["next", ["not a date", 1]], salt=paginator.salt),
+        ):
+            with self.subTest(cursor=bad), self.assertRaises(InvalidCursor):
+                paginator.page(bad)
+
+    def get_report_pages(self, params):
+        """Follow the report's next links, returning each page's booking ids."""
+        response = self.client.get(reverse("booking_report"), params)
+        pages = [[booking.pk for booking in response.context["bookings"]]]
+        while "next_page_url" in response.context:
+            url = reverse("booking_report") + response.context["next_page_url"]
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([booking.pk for booking in response.context["bookings"]])
+        return pages, response
+
+    def test_report_pages(self):
+        with mock.patch.object(BookingReportView, "paginate_by", 3):
+            pages, last = self.get_report_pages({})
+            self.assertEqual(pages, [self.ids[0:3], self.ids[3:6], self.ids[6:]])
+
+            url = reverse("booking_report") + last.context["previous_page_url"]
+            response = self.client.get(url)
+        self.assertEqual([booking.pk for booking in response.context["bookings"]], self.ids[3:6])
+
+    def test_report_pages_keep_filters_and_search(self):
+        get_search_backend()
+        expected = list(
+            Booking.objects.filter(is_paid=True).order_by("-id").values_list("id", flat=True)
+        )
+        with mock.patch.object(BookingReportView, "paginate_by", 2):
+            pages, last = self.get_report_pages({"payment_status": "paid", "search": "Booker"})
+        self.assertEqual(sorted(pk for page in pages for pk in page), sorted(expected))
+        self.assertEqual([len(page) for page in pages], [2, 2])
+        self.assertIn("payment_status=paid", last.context["previous_page_url"])
+        self.assertIn("search=Booker", last.context["previous_page_url"])
+
+    def test_report_invalid_cursor_is_not_found(self):
+        response = self.client.get(reverse("booking_report"), {"cursor": "garbage"})
+        self.assertEqual(response.status_code, 404)
+
+
+class BookingSearchTests(StaffTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ada = make_booking(full_name="Ada Lovelace", email="lovelace@example.com")
+        self.grace = make_booking(full_name="Grace Hopper", email="grace@example.com")
+        self.backend = get_search_backend()
+
+    def search(self, query):
+        queryset = self.backend.filter(Booking.objects.all(), query)
+        ranked = self.backend.rank(queryset, query).order_by("-search_rank", "id")
+        return list(ranked)
+
+    def indexed_ids(self, query):
+        """Booking IDs the SQLite search table itself matches."""
+        with connections["default"].cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {SQLITE_SEARCH_TABLE} WHERE {SQLITE_SEARCH_TABLE} MATCH %s",
+                [SQLiteSearchBackend.match_expression(query)],
+            )
+            return sorted(row[0] for row in cursor.fetchall())
+
+    @skipUnless(connections["default"].vendor == "sqlite", "SQLite search table")
+    def test_migrate_creates_sqlite_search_table_and_triggers(self):
+        with connections["default"].cursor() as cursor:
+            cursor.execute(
+                "SELECT type, name FROM sqlite_master WHERE tbl_name LIKE %s",
+                ["tickets_booking%"],
+            )
+            objects = set(cursor.fetchall())
+        self.assertLessEqual(
+            {
+                ("table", SQLITE_SEARCH_TABLE),
+                ("trigger", "tickets_booking_search_insert"),
+                ("trigger", "tickets_booking_search_delete"),
+                ("trigger", "tickets_booking_search_update"),
+            },
+            objects,
+        )
+        self.assertIsInstance(self.backend, SQLiteSearchBackend)
+
+    @skipUnless(connections["default"].vendor == "postgresql", "PostgreSQL trigram indexes")
+    def test_migrate_creates_trigram_indexes(self):
+        with connections["default"].cursor() as cursor:
+            cursor.execute(
+                "SELECT indexname FROM pg_indexes WHERE tablename = 'tickets_booking'"
+            )
+            indexes = {row[0] for row in cursor.fetchall()}
+        self.assertLessEqual({"booking_full_name_trgm_idx", "booking_email_trgm_idx"}, indexes)
+        self.assertIsInstance(self.backend, PostgresSearchBackend)
+
+    def test_search_matches_name_and_email_substrings(self):
+        self.assertEqual(self.search("LOVEL"), [self.ada])
+        self.assertEqual(self.search("grace@ex"), [self.grace])
+        self.assertCountEqual(self.search("example.com"), [self.ada, self.grace])
+        self.assertEqual(self.search("Babbage"), [])
+        # Shorter than a trigram
+        self.assertEqual(self.search("op"), [self.grace])
+
+    def test_search_ranks_better_matches_first(self):
+        namesake = make_booking(full_name="Ada Lovelace", email="ada@example.com")
+        self.assertEqual(self.search("lovelace"), [self.ada, namesake])
+        ranks = [booking.search_rank for booking in self.search("lovelace")]
+        self.assertGreater(ranks[0], ranks[1])
+
+    def test_booking_reference_finds_booking(self):
+        for query in (f"SIB-{self.grace.pk}", f"sib{self.grace.pk}", f" SIB-{self.grace.pk} "):
+            with self.subTest(query=query):
+                self.assertEqual(self.search(query), [self.grace])
+        self.assertEqual(self.search("SIB-999999"), [])
+
+        response = self.client.get(
+            reverse("booking_report"), {"search": f"SIB-{self.grace.pk}"}
+        )
+        self.assertEqual(list(response.context["bookings"]), [self.grace])
+        self.assertEqual(response.context["total_bookings"], 1)
+
+    def test_report_search(self):
+        response = self.client.get(reverse("booking_report"), {"search": "hopper"})
+        self.assertEqual(list(response.context["bookings"]), [self.grace])
+
+    @skipUnless(connections["default"].vendor == "sqlite", "SQLite search table")
+    def test_sqlite_search_table_follows_inserts_updates_and_deletes(self):
+        self.assertEqual(self.indexed_ids("lovelace"), [self.ada.pk])
+
+        babbage = make_booking(full_name="Charles Babbage", email="charles@example.com")
+        self.assertEqual(self.indexed_ids("babbage"), [babbage.pk])
+
+        babbage.full_name = "Charles B"
+        babbage.save()
+        self.assertEqual(self.indexed_ids("babbage"), [])
+        self.assertEqual(self.indexed_ids("Charles B"), [babbage.pk])
+
+        Booking.objects.filter(pk=babbage.pk).update(email="cb@example.org")
+        self.assertEqual(self.indexed_ids("charles@"), [])
+        self.assertEqual(self.indexed_ids("example.org"), [babbage.pk])
+
+        babbage.delete()
+        self.assertEqual(self.indexed_ids("Charles"), [])
+        self.assertEqual(self.indexed_ids("example.com"), [self.ada.pk, self.grace.pk])
+
+
+class BookingExportTests(StaffTestCase):
+    SHEET_NS = {"s": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+    HEADINGS = [heading for heading, _ in EXPORT_COLUMNS]
+
+    def export(self, export_format, **params):
+        response = self.client.get(reverse("booking_export"), {"format": export_format, **params})
+        self.assertEqual(response.status_code, 200)
+        return response, b"".join(response.streaming_content)
+
+    def read_csv(self, **params):
+        response, content = self.export("csv", **params)
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        self.assertIn("attachment;", response["Content-Disposition"])
+        return list(csv.reader(io.StringIO(content.decode())))
+
+    def read_sheet(self, content):
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertIn("[Content_Types].xml", archive.namelist())
+            sheet = ElementTree.fromstring(archive.read("xl/worksheets/sheet1.xml"))
+        return [
+            ["".join(cell.itertext()) for cell in row.findall("s:c", self.SHEET_NS)]
+            for row in sheet.iterfind("s:sheetData/s:row", self.SHEET_NS)
+        ]
+
+    def test_csv_rows(self):
+        booking = make_booking(
+            phone_number="01295 000000",
+            num_tickets=2,
+            donation_amount=Decimal("45.50"),
+            gift_aid=True,
+            address_line1="1 High Street",
+            city="Banbury",
+            postcode="OX15 5QL",
+            is_paid=True,
+        )
+        make_booking(full_name="Grace Hopper", email="grace@example.com")
+
+        rows = self.read_csv(payment_status="paid")
+        self.assertEqual(rows[0], self.HEADINGS)
+        self.assertEqual(
+            rows[1:],
+            [
+                [
+                    booking.booking_reference(),
+                    "Ada Lovelace",
+                    "ada@example.com",
+                    "01295 000000",
+                    "2",
+                    "45.50",
+                    "Yes",
+                    "1 High Street",
+                    "",
+                    "Banbury",
+                    "OX15 5QL",
+                    "Yes",
+                    timezone.localtime(booking.created_at).strftime("%Y-%m-%d %H:%M"),
+                ]
+            ],
+        )
+        self.assertEqual(len(self.read_csv()), 3)
+
+    def test_csv_formula_guard(self):
+        names = ["=1+2", "+1", "-1", "@SUM(A1)", "\tcmd", "\rcmd", "Ada = Lovelace"]
+        for i, name in enumerate(names):
+            make_booking(full_name=name, email=f"booker{i}@example.com")
+        rows = self.read_csv()
+        exported = {row[2]: row[1] for row in rows[1:]}
+        self.assertEqual(
+            [exported[f"booker{i}@example.com"] for i in range(len(names))],
+            ["'=1+2", "'+1", "'-1", "'@SUM(A1)", "'\tcmd", "'\rcmd", "Ada = Lovelace"],
+        )
+
+    def test_xlsx_opens_and_parses(self):
+        # Control characters aren't allowed in XML, even escaped
+        booking = make_booking(
+            full_name="Ada <Lovelace> & Co\x01\x1f", donation_amount=Decimal("12.50")
+        )
+        response, content = self.export("xlsx")
+        self.assertEqual(
+            response["Content-Type"],
+            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        )
+        rows = self.read_sheet(content)
+        self.assertEqual(rows[0], self.HEADINGS)
+        self.assertEqual(rows[1][:2], [booking.booking_reference(), "Ada <Lovelace> & Co"])
+        self.assertEqual(rows[1][5], "12.50")
+
+    def test_xlsx_streams_in_chunks(self):
+        rows = [(f"SIB-{i}", f"Booker {i}\tTab\nLine", i) for i in range(5)]
+        chunks = list(stream_xlsx(rows, rows_per_chunk=2))
+        self.assertGreater(len(chunks), 3)
+        sheet = self.read_sheet(b"".join(chunks))
+        self.assertEqual(len(sheet), 6)
+        self.assertEqual(sheet[5], ["SIB-4", "Booker 4\tTab\nLine", "4"])
+
+    def test_unknown_format(self):
+        response = self.client.get(reverse("booking_export"), {"format": "pdf"})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(BOOKINGS_API_TOKENS=["api-token"])
+class BookingApiTests(TestCase):
+    def setUp(self):
+        self.booking = make_booking(full_name="Ada Lovelace")
+        self.newer = make_booking(full_name="Grace Hopper", email="grace@example.com")
+
+    def get(self, etag=None, **params):
+        headers = {"Authorization": "Bearer api-token"}
+        if etag:
+            headers["If-None-Match"] = etag
+        return self.client.get(reverse("booking_api"), params, headers=headers)
+
+    def assertChanged(self, etag):
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        return response["ETag"]
+
+    def test_requires_token(self):
+        response = self.client.get(reverse("booking_api"))
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get(
+            reverse("booking_api"), headers={"Authorization": "Bearer wrong"}
+        )
+        self.assertEqual(response.status_code, 401)
+
+    def test_not_modified_while_etag_matches(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 2)
+        etag = response["ETag"]
+
+        for _ in range(2):
+            response = self.get(etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response["ETag"], etag)
+            self.assertEqual(response.content, b"")
+
+    def test_etag_changes_with_bookings(self):
+        etag = self.get()["ETag"]
+
+        self.booking.is_paid = True
+        self.booking.save()
+        etag = self.assertChanged(etag)
+        self.assertEqual(self.get(etag).status_code, 304)
+
+        make_booking(full_name="Alan Turing", email="alan@example.com")
+        etag = self.assertChanged(etag)
+
+        # MAX(updated_at) is unchanged by this delete; the count changes
+        Booking.objects.filter(pk=self.newer.pk).delete()
+        etag = self.assertChanged(etag)
+        self.assertEqual(self.get(etag).status_code, 304)
+
+    def test_etag_differs_between_queries(self):
+        etag = self.get()["ETag"]
+        response = self.get(etag, payment_status="unpaid")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(self.get(response["ETag"], payment_status="unpaid").status_code, 304)
+
+
+@override_settings(REPLICA_READS=True, REPLICA_STICKY_SECONDS=10)
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    The test runner's replica is a mirror of the test database, reached
+    through a second connection, so rows must be committed to be read
+    from it; hence a TransactionTestCase.
+    """
+
+    databases = {"default", REPLICA}
+
+    def setUp(self):
+        make_booking()
+
+    def request(self, view, cookies=None):
+        """Run ``view`` through the middleware, returning the response and
+        the queries it ran on each database."""
+        request = RequestFactory().get("/")
+        request.COOKIES.update(cookies or {})
+        middleware = ReplicaStickinessMiddleware(view)
+        with (
+            CaptureQueriesContext(connections["default"]) as primary,
+            CaptureQueriesContext(connections[REPLICA]) as replica,
+        ):
+            response = middleware(request)
+        return response, len(primary), len(replica)
+
+    def test_reads_go_to_replica_after_use_replica(self):
+        def view(request):
+            self.assertEqual(Booking.objects.count(), 1)
+            use_replica()
+            self.assertEqual(Booking.objects.count(), 1)
+            return HttpResponse()
+
+        response, primary, replica = self.request(view)
+        self.assertEqual((primary, replica), (1, 1))
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+    def test_writes_pin_request_to_primary(self):
+        def view(request):
+            use_replica()
+            make_booking(full_name="Grace Hopper")
+            self.assertEqual(Booking.objects.count(), 2)
+            return HttpResponse()
+
+        response, primary, replica = self.request(view)
+        self.assertEqual(replica, 0)
+        self.assertGreater(primary, 0)
+
+    def test_sticky_cookie_set_only_when_request_wrote(self):
+        def read(request):
+            use_replica()
+            list(Booking.objects.all())
+            return HttpResponse()
+
+        def write(request):
+            Booking.objects.update(is_paid=True)
+            return HttpResponse()
+
+        response, _, _ = self.request(read)
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+        response, _, _ = self.request(write)
+        cookie = response.cookies[STICKY_COOKIE]
+        self.assertEqual(cookie["max-age"], 10)
+        self.assertTrue(cookie["httponly"])
+
+    def test_pinned_client_reads_from_primary(self):
+        def view(request):
+            use_replica()
+            self.assertEqual(Booking.objects.count(), 1)
+            return HttpResponse()
+
+        response, primary, replica = self.request(view, cookies={STICKY_COOKIE: "1"})
+        self.assertEqual((primary, replica), (1, 0))
+        # Reading doesn't extend the pin
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+    def test_report_reads_from_replica(self):
+        staff = User.objects.create_user("staff", password="password", is_staff=True)
+        self.client.force_login(staff)
+        with CaptureQueriesContext(connections[REPLICA]) as replica:
+            response = self.client.get(reverse("booking_report"))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "ada@example.com")
+        self.assertGreater(len(replica), 0)
+
+    @override_settings(REPLICA_READS=False)
+    def test_reads_stay_on_primary_without_replica(self):
+        def view(request):
+            use_replica()
+            make_booking()
+            return HttpResponse()
+
+        response, _, replica = self.request(view)
+        self.assertEqual(replica, 0)
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+
+class EventInventoryTests(TestCase):
+    def setUp(self):
+        self.event = make_event(capacity=5)
+
+    def assertTicketsSold(self, event, tickets):
+        event.refresh_from_db()
+        self.assertEqual(event.tickets_sold, tickets)
+
+    def test_create_reserves_tickets(self):
+        make_booking(event=self.event, num_tickets=3)
+        self.assertTicketsSold(self.event, 3)
+
+    def test_edit_adjusts_reservation(self):
+        booking = make_booking(event=self.event, num_tickets=3)
+        booking.num_tickets = 5
+        booking.save()
+        self.assertTicketsSold(self.event, 5)
+
+        booking = Booking.objects.get(pk=booking.pk)
+        booking.num_tickets = 1
+        booking.save()
+        self.assertTicketsSold(self.event, 1)
+
+        # Other changes leave the inventory alone
+        booking.is_paid = True
+        booking.save()
+        self.assertTicketsSold(self.event, 1)
+
+    def test_event_change_moves_reservation(self):
+        other = make_event(name="Matinee", capacity=5)
+        booking = make_booking(event=self.event, num_tickets=2)
+        booking.event = other
+        booking.save()
+        self.assertTicketsSold(self.event, 0)
+        self.assertTicketsSold(other, 2)
+
+        booking.event = None
+        booking.save()
+        self.assertTicketsSold(other, 0)
+
+    def test_delete_releases_tickets(self):
+        booking = make_booking(event=self.event, num_tickets=2)
+        Booking.objects.get(pk=booking.pk).delete()
+        self.assertTicketsSold(self.event, 0)
+
+    def test_oversold_booking_is_rolled_back(self):
+        make_booking(event=self.event, num_tickets=4)
+        with self.assertRaises(SoldOut):
+            make_booking(event=self.event, num_tickets=2)
+        self.assertEqual(Booking.objects.count(), 1)
+        self.assertTicketsSold(self.event, 4)
+
+    def test_oversold_edit_is_rolled_back(self):
+        booking = make_booking(event=self.event, num_tickets=4)
+        booking.num_tickets = 6
+        with self.assertRaises(SoldOut):
+            booking.save()
+        self.assertEqual(Booking.objects.get(pk=booking.pk).num_tickets, 4)
+        self.assertTicketsSold(self.event, 4)
+
+
+class SoldOutBookingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.event = make_event(capacity=2)
+
+    def book(self, num_tickets=1, email="grace@example.com"):
+        return self.client.post(
+            reverse("home_v3"),
+            {
+                "full_name": "Grace Hopper",
+                "email": email,
+                "num_tickets": num_tickets,
+                "extra_donation": 0,
+                "idempotency_key": uuid.uuid4(),
+            },
+        )
+
+    def test_booking_reserves_tickets_for_current_event(self):
+        response = self.book(num_tickets=2)
+        booking = Booking.objects.get()
+        self.assertRedirects(response, reverse("booking_confirmation", args=[booking.pk]))
+        self.assertEqual(booking.event, self.event)
+        self.event.refresh_from_db()
+        self.assertTrue(self.event.is_sold_out)
+
+    def test_too_many_tickets_offers_the_rest(self):
+        make_booking(event=self.event)
+        response = self.book(num_tickets=2)
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(
+            response.context["form"], "num_tickets", "Sorry, only 1 ticket(s) are left."
+        )
+        self.assertFalse(WaitlistEntry.objects.exists())
+
+    def test_sold_out_joins_waitlist(self):
+        make_booking(event=self.event, num_tickets=2)
+        response = self.book(num_tickets=2)
+        self.assertRedirects(response, reverse("home_v3"), fetch_redirect_response=False)
+        self.assertEqual(Booking.objects.count(), 1)
+        entry = WaitlistEntry.objects.get()
+        self.assertEqual(
+            (entry.event, entry.email, entry.num_tickets),
+            (self.event, "grace@example.com", 2),
+        )
+
+        # Trying again doesn't join twice
+        self.book(num_tickets=1)
+        self.assertEqual(WaitlistEntry.objects.count(), 1)
+
+
+class BookingAdminTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser("admin", password="password")
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        self.event = make_event(capacity=3)
+
+    def post_booking(self, url, **fields):
+        data = {
+            "event": self.event.pk,
+            "full_name": "Grace Hopper",
+            "email": "grace@example.com",
+            "num_tickets": 1,
+            "donation_amount": "25.00",
+        }
+        data.update(fields)
+        return self.client.post(url, data)
+
+    def test_add_reserves_tickets(self):
+        response = self.post_booking(reverse("admin:tickets_booking_add"), num_tickets=2)
+        self.assertEqual(response.status_code, 302)
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.tickets_sold, 2)
+
+    def test_add_to_full_event_shows_form_error(self):
+        make_booking(event=self.event, num_tickets=3)
+        response = self.post_booking(reverse("admin:tickets_booking_add"))
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(
+            response.context["adminform"].form,
+            "num_tickets",
+            "Only 0 ticket(s) left for this event.",
+        )
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_raising_tickets_beyond_capacity_shows_form_error(self):
+        booking = make_booking(event=self.event, num_tickets=2)
+        url = reverse("admin:tickets_booking_change", args=[booking.pk])
+        response = self.post_booking(url, num_tickets=4)
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(
+            response.context["adminform"].form,
+            "num_tickets",
+            "Only 1 ticket(s) left for this event.",
+        )
+
+        # Taking the last ticket is fine
+        response = self.post_booking(url, num_tickets=3)
+        self.assertEqual(response.status_code, 302)
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.tickets_sold, 3)
+
+    def test_delete_releases_tickets(self):
+        booking = make_booking(event=self.event, num_tickets=2)
+        response = self.client.post(
+            reverse("admin:tickets_booking_delete", args=[booking.pk]), {"post": "yes"}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.tickets_sold, 0)
+
+
+class BookingChangeListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser("admin", password="password")
+        created_at = timezone.now() - timedelta(days=1)
+        for i in range(7):
+            make_booking(
+                full_name=f"Booker {i}",
+                email=f"booker{i}@example.com",
+                num_tickets=i % 2 + 1,
+                gift_aid=i % 2 == 0,
+                is_paid=i % 3 != 0,
+            )
+        Booking.objects.update(created_at=created_at)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        self.model_admin = admin.site._registry[Booking]
+        patcher = mock.patch.object(self.model_admin, "list_per_page", 3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self, url):
+        response = self.client.get(reverse("admin:tickets_booking_changelist") + url)
+        self.assertEqual(response.status_code, 200)
+        return response.context["cl"]
+
+    def get_pages(self, query=""):
+        """Follow the changelist's next links, returning each page's booking ids."""
+        changelist = self.get(f"?{query}" if query else "")
+        pages = [[booking.pk for booking in changelist.result_list]]
+        while getattr(changelist, "next_page_url", None):
+            changelist = self.get(changelist.next_page_url)
+            pages.append([booking.pk for booking in changelist.result_list])
+        return pages, changelist
+
+    def test_search_by_booking_reference(self):
+        booking = Booking.objects.get(full_name="Booker 4")
+        changelist = self.get(f"?q=SIB-{booking.pk}")
+        self.assertEqual(list(changelist.result_list), [booking])
+
+    def test_pages_with_cursors(self):
+        pages, last = self.get_pages()
+        ids = list(Booking.objects.order_by("-created_at", "-pk").values_list("id", flat=True))
+        self.assertEqual(pages, [ids[0:3], ids[3:6], ids[6:]])
+        self.assertIsNotNone(last.keyset_page)
+
+        changelist = self.get(last.previous_page_url)
+        self.assertEqual([booking.pk for booking in changelist.result_list], ids[3:6])
+
+    def test_column_sorting_adds_pk_tiebreaker(self):
+        # Column 4 is num_tickets, on which the bookings tie
+        for query, expected_order in (
+            ("o=4", ("num_tickets", "-pk")),
+            ("o=-4", ("-num_tickets", "-pk")),
+        ):
+            with self.subTest(query):
+                pages, last = self.get_pages(query)
+                self.assertEqual(last.paginator.ordering[-1], ("pk", True))
+                self.assertEqual(
+                    [pk for page in pages for pk in page],
+                    list(Booking.objects.order_by(*expected_order).values_list("id", flat=True)),
+                )
+
+    def test_pages_with_filters_and_search(self):
+        pages, last = self.get_pages("is_paid__exact=1&q=Booker")
+        self.assertEqual(
+            sorted(pk for page in pages for pk in page),
+            sorted(Booking.objects.filter(is_paid=True).values_list("id", flat=True)),
+        )
+        self.assertIn("is_paid__exact=1", last.previous_page_url)
+        self.assertIn("q=Booker", last.previous_page_url)
+        self.assertEqual(last.result_count, Booking.objects.filter(is_paid=True).count())
+
+    def test_invalid_cursor(self):
+        response = self.client.get(
+            reverse("admin:tickets_booking_changelist"), {"cursor": "garbage"}
+        )
+        self.assertRedirects(
+            response,
+            reverse("admin:tickets_booking_changelist") + "?e=1",
+            fetch_redirect_response=False,
+        )
+
+        request = RequestFactory().get("/", {"cursor": "garbage"})
+        request.user = self.admin
+        with self.assertRaises(IncorrectLookupParameters):
+            self.model_admin.get_changelist_instance(request)
+
+    def test_show_all_and_list_editable_use_page_numbers(self):
+        changelist = self.get("?all=")
+        self.assertIsNone(changelist.keyset_page)
+        self.assertEqual(len(changelist.result_list), 7)
+
+        with mock.patch.object(self.model_admin, "list_editable", ("is_paid",)):
+            changelist = self.get("")
+        self.assertIsNone(changelist.keyset_page)
+        self.assertEqual(changelist.paginator.count, 7)
+        self.assertEqual(len(changelist.result_list), 3)
+
+    def test_result_count_from_summary_for_paid_and_gift_aid_filters(self):
+        totals = BookingSummary.objects.totals
+        for query, from_summary in (
+            ("", True),
+            ("?is_paid__exact=1", True),
+            ("?is_paid__exact=0&gift_aid__exact=1", True),
+            (f"?event__id__exact={make_event().pk}", False),
+            ("?q=Booker", False),
+        ):
+            with self.subTest(query), mock.patch.object(
+                BookingSummary.objects, "totals", wraps=totals
+            ) as summary_totals:
+                changelist = self.get(query)
+            self.assertEqual(summary_totals.called, from_summary)
+            self.assertEqual(changelist.result_count, changelist.queryset.count())
+
+
+class BookingSummaryTests(TestCase):
+    def assertSummaryConsistent(self):
+        self.assertEqual(BookingSummary.objects.compare(), [])
+        self.assertEqual(BookingSummary.objects.totals(), Booking.objects.summary())
+
+    def make_bookings(self):
+        return [
+            make_booking(num_tickets=2, donation_amount=Decimal("50.00")),
+            make_booking(gift_aid=True, donation_amount=Decimal("25.00")),
+            make_booking(is_paid=True, gift_aid=True, donation_amount=Decimal("30.50")),
+        ]
+
+    def test_create(self):
+        self.make_bookings()
+        self.assertSummaryConsistent()
+        self.assertEqual(BookingSummary.objects.count(), 3)
+
+    def test_update(self):
+        unpaid, gift_aid, paid = self.make_bookings()
+        unpaid.is_paid = True
+        unpaid.save()
+        self.assertSummaryConsistent()
+
+        gift_aid.num_tickets = 3
+        gift_aid.donation_amount = Decimal("75.00")
+        gift_aid.save()
+        self.assertSummaryConsistent()
+
+        # An instance loaded without the summary fields
+        paid = Booking.objects.only("id").get(pk=paid.pk)
+        paid.gift_aid = False
+        paid.save()
+        self.assertSummaryConsistent()
+
+        # Saving without changes leaves the summary alone
+        paid.save()
+        self.assertSummaryConsistent()
+
+    def test_delete(self):
+        unpaid, gift_aid, paid = self.make_bookings()
+        unpaid.delete()
+        self.assertSummaryConsistent()
+        Booking.objects.filter(gift_aid=True).delete()
+        self.assertSummaryConsistent()
+        self.assertEqual(BookingSummary.objects.totals()["total_bookings"], 0)
+
+    def test_import(self):
+        self.make_bookings()
+        rows = io.StringIO(
+            "full_name,email,num_tickets,extra_donation,gift_aid,gift_aid_confirmation,"
+            "address_line1,city,postcode,is_paid\n"
+            "Grace Hopper,grace@example.com,2,5,no,,,,,yes\n"
+            "Alan Turing,alan@example.com,1,0,yes,yes,1 High Street,Banbury,OX15 5QL,\n"
+            "Katherine Johnson,katherine@example.com,3,10,yes,yes,2 High Street,Banbury,OX15 5QL,yes\n"
+            "Not Valid,not-an-email,1,0,no,,,,,\n"
+        )
+        booking_import = BookingImport(batch_size=2)
+        self.assertEqual(booking_import.run(read_rows(rows, "csv")), 3)
+        self.assertEqual(len(booking_import.errors), 1)
+        self.assertSummaryConsistent()
+
+    def test_reconcile(self):
+        unpaid, gift_aid, paid = self.make_bookings()
+        today = timezone.localdate()
+        reconciliation = Reconciliation(
+            [
+                StatementLine(1, today, Decimal("50.00"), unpaid.booking_reference()),
+                StatementLine(2, today, Decimal("25.00"), f"LOVELACE {gift_aid.booking_reference()}"),
+                # Already paid, so not applied
+                StatementLine(3, today, Decimal("30.50"), paid.booking_reference()),
+            ]
+        )
+        reconciliation.match()
+        self.assertEqual(reconciliation.apply(), 2)
+        self.assertSummaryConsistent()
+        self.assertFalse(Booking.objects.filter(is_paid=False).exists())
+
+    def test_compare_reports_drift(self):
+        self.make_bookings()
+        Booking.objects.filter(is_paid=False).update(num_tickets=4)
+        self.assertEqual(
+            BookingSummary.objects.compare(),
+            [(False, False, "ticket_count", 2, 4), (False, True, "ticket_count", 1, 4)],
+        )
+        BookingSummary.objects.rebuild()
+        self.assertSummaryConsistent()
+
+
+class BookingImportTests(TestCase):
+    HEADER = (
+        "full_name,email,num_tickets,extra_donation,gift_aid,gift_aid_confirmation,"
+        "address_line1,city,postcode,is_paid,idempotency_key\n"
+    )
+
+    def rows(self, *lines, format="csv"):
+        if format == "csv":
+            return read_rows(io.StringIO(self.HEADER + "".join(lines)), format)
+        return read_rows(io.StringIO("".join(lines)), format)
+
+    def row(self, name, num_tickets=1, key="", gift_aid="no", confirmation="", address=",,"):
+        email = f"{name.split()[0].lower()}@example.com"
+        return (
+            f"{name},{email},{num_tickets},0,{gift_aid},{confirmation},{address},,{key}\n"
+        )
+
+    def assertSummaryConsistent(self):
+        self.assertEqual(BookingSummary.objects.compare(), [])
+
+    def test_validation_errors_skip_rows(self):
+        booking_import = BookingImport()
+        imported = booking_import.run(
+            self.rows(
+                self.row("Grace Hopper"),
+                "Not Valid,not-an-email,1,0,no,,,,,,\n",
+                "Bad Tickets,none@example.com,two,0,no,,,,,,\n",
+                "Bad Paid,paid@example.com,1,0,no,,,,,maybe,\n",
+                "Bad Key,key@example.com,1,0,no,,,,,,not-a-uuid\n",
+            )
+        )
+        self.assertEqual(imported, 1)
+        self.assertEqual(
+            [(error.row, error.field) for error in booking_import.errors],
+            [(3, "email"), (4, "num_tickets"), (5, "is_paid"), (6, "idempotency_key")],
+        )
+        self.assertEqual(Booking.objects.get().full_name, "Grace Hopper")
+        self.assertSummaryConsistent()
+
+    def test_jsonl_errors_and_repeated_keys(self):
+        key = uuid.uuid4()
+        booking = {"full_name": "Grace Hopper", "email": "grace@example.com", "num_tickets": 2}
+        booking_import = BookingImport()
+        imported = booking_import.run(
+            self.rows(
+                json.dumps({**booking, "idempotency_key": str(key), "is_paid": True}) + "\n",
+                "{not json\n",
+                "[1, 2]\n",
+                json.dumps({**booking, "idempotency_key": str(key)}) + "\n",
+                format="jsonl",
+            )
+        )
+        self.assertEqual(imported, 1)
+        self.assertEqual(
+            [(error.row, error.field) for error in booking_import.errors],
+            [(2, None), (3, None), (4, "idempotency_key")],
+        )
+        booking = Booking.objects.get()
+        self.assertEqual((booking.idempotency_key, booking.is_paid), (key, True))
+        self.assertEqual(booking.donation_amount, 2 * BookingFormV3.TICKET_PRICE)
+
+    def test_gift_aid_needs_address_and_declaration(self):
+        booking_import = BookingImport()
+        imported = booking_import.run(
+            self.rows(
+                self.row("Grace Hopper", gift_aid="yes"),
+                self.row(
+                    "Alan Turing", gift_aid="yes", confirmation="yes", address="1 High Street,,"
+                ),
+                self.row(
+                    "Ada Lovelace",
+                    gift_aid="yes",
+                    confirmation="yes",
+                    address="1 High Street,Banbury,OX15 5QL",
+                ),
+                # The declaration alone doesn't make a booking Gift Aid
+                self.row("Katherine Johnson", confirmation="yes"),
+            )
+        )
+        self.assertEqual(imported, 2)
+        self.assertEqual(
+            [(error.row, error.field) for error in booking_import.errors],
+            [
+                (2, "address_line1"),
+                (2, "city"),
+                (2, "postcode"),
+                (2, "gift_aid_confirmation"),
+                (3, "city"),
+                (3, "postcode"),
+            ],
+        )
+        self.assertEqual(
+            dict(Booking.objects.values_list("full_name", "gift_aid")),
+            {"Ada Lovelace": True, "Katherine Johnson": False},
+        )
+
+    def test_rerun_skips_imported_rows(self):
+        event = make_event(capacity=10)
+        lines = [
+            self.row("Grace Hopper", 2, uuid.uuid4()),
+            self.row("Alan Turing", 3, uuid.uuid4()),
+        ]
+
+        first = BookingImport(event=event)
+        self.assertEqual(first.run(self.rows(*lines)), 2)
+
+        second = BookingImport(event=event)
+        lines.append(self.row("Ada Lovelace", 1, uuid.uuid4()))
+        self.assertEqual(second.run(self.rows(*lines)), 1)
+        self.assertEqual(second.already_imported, 2)
+        self.assertEqual(second.errors, [])
+        self.assertEqual(Booking.objects.count(), 3)
+        event.refresh_from_db()
+        self.assertEqual(event.tickets_sold, 6)
+        self.assertSummaryConsistent()
+
+    def test_rows_over_capacity_are_rejected(self):
+        event = make_event(capacity=4)
+        booking_import = BookingImport(event=event)
+        imported = booking_import.run(
+            self.rows(
+                self.row("Grace Hopper", 2),
+                self.row("Alan Turing", 3),
+                self.row("Ada Lovelace", 2),
+            )
+        )
+        self.assertEqual(imported, 2)
+        self.assertEqual(
+            booking_import.errors,
+            [RowError(3, "num_tickets", "Only 2 ticket(s) left for this event.")],
+        )
+        event.refresh_from_db()
+        self.assertEqual(event.tickets_sold, 4)
+
+    def test_sold_out_batch_reports_each_row_once(self):
+        event = make_event(capacity=4)
+        key = uuid.uuid4()
+        make_booking(idempotency_key=key)
+        booking_import = BookingImport(event=event)
+        lines = [
+            self.row("Grace Hopper", 2, key),
+            self.row("Alan Turing", 3),
+            self.row("Ada Lovelace", 2),
+            self.row("Katherine Johnson", 1),
+        ]
+        # Tickets sold on the site between the capacity check and the reservation
+        with mock.patch.object(Event.objects, "reserve", return_value=False):
+            self.assertEqual(booking_import.run(self.rows(*lines)), 0)
+
+        self.assertEqual(
+            booking_import.errors,
+            [
+                RowError(3, "num_tickets", "Not enough tickets left for this event."),
+                RowError(4, "num_tickets", "Only 1 ticket(s) left for this event."),
+                RowError(5, "num_tickets", "Not enough tickets left for this event."),
+            ],
+        )
+        self.assertEqual(booking_import.already_imported, 0)
+        self.assertEqual(Booking.objects.count(), 1)
+        self.assertSummaryConsistent()
+
+
+class ReconciliationTests(TestCase):
+    def setUp(self):
+        self.today = timezone.localdate()
+
+    def reconcile(self, *lines):
+        """Match (amount, description[, date]) statement lines, dated today by default."""
+        statement = [
+            StatementLine(number, date[0] if date else self.today, Decimal(amount), description)
+            for number, (amount, description, *date) in enumerate(lines, start=1)
+        ]
+        reconciliation = Reconciliation(statement)
+        reconciliation.match()
+        return reconciliation
+
+    def matched(self, reconciliation):
+        return [(match.booking_id, match.method) for match in reconciliation.matches]
+
+    def unmatched(self, reconciliation):
+        return [(item.reason, item.booking_ids) for item in reconciliation.unmatched]
+
+    def test_reference_spellings(self):
+        bookings = [
+            make_booking(full_name=f"Booker {i}", donation_amount=Decimal("25.00"))
+            for i in range(4)
+        ]
+        reconciliation = self.reconcile(
+            ("25.00", f"FASTER PAYMENT SIB-{bookings[0].pk}"),
+            ("25.00", f"sib {bookings[1].pk:06d}"),
+            ("30.00", f"BOOKER SIB_{bookings[2].pk} TICKETS"),
+            ("25.00", f"Sib/{bookings[3].pk}"),
+        )
+        self.assertEqual(self.matched(reconciliation), [(b.pk, "reference") for b in bookings])
+        self.assertEqual(reconciliation.unmatched, [])
+
+    def test_reference_problems(self):
+        first = make_booking(donation_amount=Decimal("25.00"))
+        second = make_booking(donation_amount=Decimal("25.00"))
+        paid = make_booking(donation_amount=Decimal("25.00"), is_paid=True)
+        reconciliation = self.reconcile(
+            ("20.00", f"SIB-{first.pk}"),
+            ("25.00", f"SIB-{first.pk} SIB-{second.pk}"),
+            ("25.00", f"SIB-{second.pk}"),
+            ("25.00", f"SIB-{second.pk} again"),
+            ("25.00", f"SIB-{paid.pk}"),
+            ("-25.00", f"SIB-{first.pk} refund"),
+        )
+        self.assertEqual(self.matched(reconciliation), [(second.pk, "reference")])
+        already = "Booking is already paid, or paid twice in this statement"
+        self.assertEqual(
+            self.unmatched(reconciliation),
+            [
+                ("Less than the £25.00 due", [first.pk]),
+                ("Quotes more than one booking reference", [first.pk, second.pk]),
+                (already, [second.pk]),
+                (already, [paid.pk]),
+            ],
+        )
+        self.assertEqual(reconciliation.debits, 1)
+
+    def test_match_by_amount_date_and_surname(self):
+        booking = make_booking(full_name="Grace Hopper", donation_amount=Decimal("30.00"))
+        make_booking(full_name="Alan Turing", donation_amount=Decimal("30.00"))
+        make_booking(full_name="Grace Hopper", donation_amount=Decimal("30.00"), is_paid=True)
+        reconciliation = self.reconcile(("30.00", "FASTER PAYMENT MRS G HOPPER"))
+        self.assertEqual(self.matched(reconciliation), [(booking.pk, "amount, date and name")])
+
+    def test_no_match_by_details(self):
+        booking = make_booking(full_name="Grace Hopper", donation_amount=Decimal("30.00"))
+        reconciliation = self.reconcile(
+            # Wrong amount, another surname, and a payment before the booking
+            ("31.00", "G HOPPER"),
+            ("30.00", "A TURING"),
+            ("30.00", "G HOPPER", self.today - timedelta(days=1)),
+        )
+        self.assertEqual(reconciliation.matches, [])
+        self.assertEqual(self.unmatched(reconciliation), [("No matching booking", [])] * 3)
+
+        # A booking made more than RECONCILE_WINDOW_DAYS before the payment
+        Booking.objects.filter(pk=booking.pk).update(
+            created_at=timezone.now() - timedelta(days=31)
+        )
+        reconciliation = self.reconcile(("30.00", "G HOPPER"))
+        self.assertEqual(self.unmatched(reconciliation), [("No matching booking", [])])
+
+    def test_ambiguous_surname_match(self):
+        grace = make_booking(full_name="Grace Hopper", donation_amount=Decimal("30.00"))
+        george = make_booking(full_name="George Hopper", donation_amount=Decimal("30.00"))
+        reconciliation = self.reconcile(("30.00", "HOPPER"), ("30.00", "G HOPPER"))
+        self.assertEqual(reconciliation.matches, [])
+        reason = "Matches more than one booking equally well"
+        self.assertEqual(
+            [(reason, sorted(ids)) for reason, ids in self.unmatched(reconciliation)],
+            [(reason, sorted([grace.pk, george.pk]))] * 2,
+        )
+
+        # A full first name decides between them, and each booking is matched once
+        reconciliation = self.reconcile(("30.00", "GRACE HOPPER"), ("30.00", "HOPPER"))
+        self.assertEqual(
+            self.matched(reconciliation),
+            [(grace.pk, "amount, date and name"), (george.pk, "amount, date and name")],
+        )
+
+    def test_apply_marks_matched_bookings_paid(self):
+        first = make_booking(donation_amount=Decimal("25.00"))
+        second = make_booking(full_name="Grace Hopper", donation_amount=Decimal("30.00"))
+        reconciliation = self.reconcile(("25.00", f"SIB-{first.pk}"), ("30.00", "G HOPPER"))
+        # Marked paid by hand since the statement was matched
+        Booking.objects.filter(pk=first.pk).update(is_paid=True)
+        BookingSummary.objects.rebuild()
+
+        self.assertEqual(reconciliation.apply(), 1)
+        second.refresh_from_db()
+        self.assertTrue(second.is_paid)
+        self.assertEqual(BookingSummary.objects.compare(), [])
+
+    def test_parse_csv(self):
+        text = (
+            "Account,12345678\n"
+            "\n"
+            "Date,Description,Reference,Paid in,Paid out\n"
+            "01/10/2026,FASTER PAYMENT,SIB-7,\"£1,234.50\",\n"
+            ",,,,\n"
+            "2026-10-02,CARD PAYMENT,,,12.00\n"
+            "3 Oct 2026,BANK GIRO,G HOPPER,30,\n"
+        )
+        self.assertEqual(
+            [
+                (line.line, line.date.isoformat(), line.amount, line.description)
+                for line in parse_csv(text)
+            ],
+            [
+                (4, "2026-10-01", Decimal("1234.50"), "FASTER PAYMENT SIB-7"),
+                (6, "2026-10-02", Decimal("-12.00"), "CARD PAYMENT"),
+                (7, "2026-10-03", Decimal("30"), "BANK GIRO G HOPPER"),
+            ],
+        )
+
+    def test_parse_amounts(self):
+        for value, amount in (
+            ("£1,234.50", Decimal("1234.50")),
+            ("(12.00)", Decimal("-12.00")),
+            ("12.00 CR", Decimal("12.00")),
+            ("5.00DR", Decimal("-5.00")),
+            ("", None),
+        ):
+            with self.subTest(value):
+                self.assertEqual(parse_amount(value), amount)
+
+    def test_csv_statement_errors(self):
+        for text, message in (
+            ("Description,Amount\nSIB-1,25\n", "No date column"),
+            ("Date,Description\n01/10/2026,SIB-1\n", "No amount or paid in column"),
+            ("Date,Amount\n01/10/2026,lots\n", "Line 2: 'lots' is not an amount"),
+            ("Date,Amount\nyesterday,25\n", "Line 2: 'yesterday' is not a date"),
+        ):
+            with self.subTest(message), self.assertRaisesMessage(StatementError, message):
+                list(parse_csv(text))
+
+    def test_parse_ofx(self):
+        sgml = (
+            "OFXHEADER:100\nDATA:OFXSGML\n\n<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS>"
+            "<BANKTRANLIST>\n"
+            "<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20261001120000<TRNAMT>25.00"
+            "<NAME>G HOPPER<MEMO>SIB-7\n"
+            "<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20261002<TRNAMT>-12.00<NAME>CARD\n"
+            "</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>"
+        )
+        xml = (
+            '<?xml version="1.0"?><OFX><BANKTRANLIST>'
+            "<STMTTRN><DTPOSTED>20261003</DTPOSTED><TRNAMT>30.00</TRNAMT>"
+            "<PAYEE>A TURING</PAYEE></STMTTRN></BANKTRANLIST></OFX>"
+        )
+        self.assertEqual(
+            list(parse_ofx(sgml)),
+            [
+                StatementLine(1, datetime(2026, 10, 1).date(), Decimal("25.00"), "G HOPPER SIB-7"),
+                StatementLine(2, datetime(2026, 10, 2).date(), Decimal("-12.00"), "CARD"),
+            ],
+        )
+        self.assertEqual(
+            parse_statement(xml.encode(), "statement.txt"),
+            [StatementLine(1, datetime(2026, 10, 3).date(), Decimal("30.00"), "A TURING")],
+        )
+        with self.assertRaisesMessage(StatementError, "Transaction 1 has no valid amount or date"):
+            list(parse_ofx("<STMTTRN><DTPOSTED>20261001<NAME>NO AMOUNT</STMTTRN>"))
+
+    def test_parse_statement_picks_format_and_encoding(self):
+        csv_text = "Date,Description,Amount\n01/10/2026,CAFÉ,5\n"
+        lines = parse_statement(csv_text.encode("latin-1"), "statement.csv")
+        self.assertEqual(lines[0].description, "CAFÉ")
+        ofx = "<STMTTRN><DTPOSTED>20261001<TRNAMT>5</STMTTRN>"
+        self.assertEqual(len(parse_statement(ofx.encode(), "statement.ofx")), 1)
+
+
+class ReconcileAdminTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser("admin", password="password")
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        self.booking = make_booking(donation_amount=Decimal("25.00"))
+        self.url = reverse("admin:tickets_booking_reconcile")
+
+    def upload(self, content, dry_run=False):
+        data = {"statement": SimpleUploadedFile("statement.csv", content.encode())}
+        if dry_run:
+            data["dry_run"] = "on"
+        return self.client.post(self.url, data)
+
+    def statement(self):
+        date = timezone.localdate().strftime("%d/%m/%Y")
+        return (
+            "Date,Description,Amount\n"
+            f"{date},SIB-{self.booking.pk},25.00\n"
+            f"{date},UNKNOWN,40.00\n"
+            f"{date},CARD,-3.00\n"
+        )
+
+    def test_get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context["reconciliation"])
+
+    def test_dry_run_marks_nothing_paid(self):
+        response = self.upload(self.statement(), dry_run=True)
+        reconciliation = response.context["reconciliation"]
+        self.assertEqual([match.booking_id for match in reconciliation.matches], [self.booking.pk])
+        self.assertEqual(len(reconciliation.unmatched), 1)
+        self.assertEqual(reconciliation.marked_paid, 0)
+        self.booking.refresh_from_db()
+        self.assertFalse(self.booking.is_paid)
+        self.assertContains(response, "1 payment matched.")
+
+    def test_reconcile_marks_bookings_paid(self):
+        response = self.upload(self.statement())
+        self.assertEqual(response.context["reconciliation"].marked_paid, 1)
+        self.booking.refresh_from_db()
+        self.assertTrue(self.booking.is_paid)
+        self.assertContains(response, "1 booking marked paid")
+
+        # Uploading the statement again finds the booking already paid
+        response = self.upload(self.statement())
+        self.assertEqual(response.context["reconciliation"].marked_paid, 0)
+
+    def test_unreadable_statement(self):
+        response = self.upload("Description,Amount\nSIB-1,25\n")
+        self.assertIsNone(response.context["reconciliation"])
+        self.assertFormError(
+            response.context["form"], "statement", "No date column found in the CSV statement"
+        )
+
+    def test_needs_change_permission(self):
+        staff = User.objects.create_user("staff", password="password", is_staff=True)
+        self.client.force_login(staff)
+        response = self.upload(self.statement())
+        self.assertEqual(response.status_code, 403)
+        self.booking.refresh_from_db()
+        self.assertFalse(self.booking.is_paid)
+
+
+class CheckInSyncTests(StaffTestCase):
+    def setUp(self):
+        super().setUp()
+        self.first = make_booking(full_name="Ada Lovelace")
+        self.second = make_booking(full_name="Grace Hopper", email="grace@example.com")
+        self.checked_in_at = timezone.now().replace(microsecond=0) - timedelta(minutes=5)
+
+    def sync(self, check_ins):
+        response = self.client.post(
+            reverse("checkin_sync"), {"check_ins": check_ins}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def check_in(self, *bookings, at=None):
+        at = at or self.checked_in_at
+        return self.sync(
+            [{"id": booking.pk, "checked_in_at": at.isoformat()} for booking in bookings]
+        )
+
+    def assertCheckedInAt(self, booking, checked_in_at):
+        booking.refresh_from_db()
+        self.assertEqual(booking.checked_in_at, checked_in_at)
+
+    def test_replayed_batch_keeps_first_check_in(self):
+        result = self.check_in(self.first, self.second)
+        self.assertEqual(sorted(result["checked_in"]), [self.first.pk, self.second.pk])
+        version = snapshot_version(Booking.objects.all())[0]
+
+        # A resent batch, then the same check-ins from another device later
+        for at in (self.checked_in_at, self.checked_in_at + timedelta(minutes=1)):
+            result = self.check_in(self.first, self.second, at=at)
+            self.assertEqual(result["checked_in"], [])
+            self.assertEqual(result["unknown"], [])
+            self.assertEqual(
+                {
+                    int(booking_id): datetime.fromisoformat(checked_in_at)
+                    for booking_id, checked_in_at in result["already_checked_in"].items()
+                },
+                {self.first.pk: self.checked_in_at, self.second.pk: self.checked_in_at},
+            )
+
+        self.assertCheckedInAt(self.first, self.checked_in_at)
+        self.assertCheckedInAt(self.second, self.checked_in_at)
+        # Replays don't change the bookings, so devices needn't reload the snapshot
+        self.assertEqual(snapshot_version(Booking.objects.all())[0], version)
+
+    def test_replay_mixed_with_new_check_ins(self):
+        self.check_in(self.first)
+        result = self.sync(
+            [
+                {"id": self.first.pk, "checked_in_at": self.checked_in_at.isoformat()},
+                {"id": self.second.pk, "checked_in_at": self.checked_in_at.isoformat()},
+                {"id": 0, "checked_in_at": self.checked_in_at.isoformat()},
+            ]
+        )
+        self.assertEqual(result["checked_in"], [self.second.pk])
+        self.assertEqual(list(result["already_checked_in"]), [str(self.first.pk)])
+        self.assertEqual(result["unknown"], [0])
+        self.assertCheckedInAt(self.second, self.checked_in_at)
+
+        result = self.check_in(self.first, self.second)
+        self.assertEqual(result["checked_in"], [])
+        self.assertEqual(len(result["already_checked_in"]), 2)
+
+
+class GiftAidClaimTests(TestCase):
+    def make_gift_aid_booking(self, **fields):
+        values = {
+            "gift_aid": True,
+            "is_paid": True,
+            "address_line1": "12 High Street",
+            "city": "Banbury",
+            "postcode": "ox155ql",
+            "num_tickets": 2,
+            "donation_amount": Decimal("60.00"),
+        }
+        values.update(fields)
+        return make_booking(**values)
+
+    def read_schedule(self, rows):
+        """Return the text of every cell of a written schedule, row by row."""
+        output = io.BytesIO()
+        write_schedule(rows, output)
+        with zipfile.ZipFile(output) as archive:
+            self.assertEqual(
+                archive.read("mimetype"), b"application/vnd.oasis.opendocument.spreadsheet"
+            )
+            content = ElementTree.fromstring(archive.read("content.xml"))
+        namespaces = {
+            "table": "urn:oasis:names:tc:opendocument:xmlns:table:1.0",
+            "text": "urn:oasis:names:tc:opendocument:xmlns:text:1.0",
+        }
+        return [
+            [
+                cell.findtext("text:p", "", namespaces)
+                for cell in row.iterfind("table:table-cell", namespaces)
+            ]
+            for row in content.iterfind(".//table:table-row", namespaces)
+        ]
+
+    def test_claims_donation_beyond_ticket_price(self):
+        booking = self.make_gift_aid_booking(full_name="Mrs Ada Lovelace")
+        Booking.objects.filter(pk=booking.pk).update(
+            created_at=timezone.make_aware(datetime(2026, 5, 3, 12))
+        )
+        claim = GiftAidClaim(Booking.objects.all())
+        self.assertEqual(
+            list(claim.rows()),
+            [
+                (
+                    booking.pk,
+                    "Mrs",
+                    "Ada",
+                    "Lovelace",
+                    "12",
+                    "OX15 5QL",
+                    "03/05/26",
+                    Decimal("10.00"),
+                )
+            ],
+        )
+
+    def test_skips_bookings_that_only_paid_for_tickets(self):
+        paid_for_tickets = self.make_gift_aid_booking(donation_amount=Decimal("50.00"))
+        unpaid = self.make_gift_aid_booking(is_paid=False)
+        without_gift_aid = self.make_gift_aid_booking(gift_aid=False)
+        claim = GiftAidClaim(Booking.objects.all())
+        self.assertEqual(list(claim.rows()), [])
+        self.assertEqual(
+            claim.skipped, [(paid_for_tickets.pk, "no donation beyond the ticket price")]
+        )
+        self.assertNotIn(unpaid.pk, [booking_id for booking_id, _ in claim.skipped])
+        self.assertNotIn(without_gift_aid.pk, [booking_id for booking_id, _ in claim.skipped])
+
+    def test_schedule_layout(self):
+        for day, name in ((3, "Dr Grace Hopper"), (4, "Alan Turing")):
+            booking = self.make_gift_aid_booking(full_name=name, donation_amount=Decimal("75.50"))
+            Booking.objects.filter(pk=booking.pk).update(
+                created_at=timezone.make_aware(datetime(2026, 5, day, 12))
+            )
+        rows = list(GiftAidClaim(Booking.objects.all()).rows())
+        self.assertEqual(
+            self.read_schedule(rows),
+            [
+                ["Gift Aid schedule"],
+                [""],
+                ["Earliest donation date in the period of claim. (DD/MM/YY)", "03/05/26"],
+                [""],
+                SCHEDULE_HEADINGS,
+                ["1", "Dr", "Grace", "Hopper", "12", "OX15 5QL", "", "", "03/05/26", "25.50"],
+                ["2", "", "Alan", "Turing", "12", "OX15 5QL", "", "", "04/05/26", "25.50"],
+            ],
+        )
+        self.assertEqual(
+            SCHEDULE_HEADINGS,
+            [
+                "Item",
+                "Title",
+                "First name or initial",
+                "Last name",
+                "House name or number",
+                "Postcode",
+                "Aggregated donations",
+                "Sponsored event",
+                "Donation date (DD/MM/YY)",
+                "Amount",
+            ],
+        )
+
+
+class FormPageCacheTests(TestCase):
+    HIDDEN_INPUT = re.compile(r'name="(csrfmiddlewaretoken|idempotency_key)" value="([^"]*)"')
+
+    def setUp(self):
+        cache.clear()
+
+    def get_form(self, client, name):
+        response = client.get(reverse(name))
+        self.assertEqual(response.status_code, 200)
+        return response, dict(self.HIDDEN_INPUT.findall(response.content.decode()))
+
+    def test_each_page_has_fresh_token_and_key(self):
+        for name in ("home", "home_v1", "home_v2"):
+            with self.subTest(name):
+                first, first_values = self.get_form(self.client, name)
+                self.assertTrue(first.templates)
+                cached, cached_values = self.get_form(self.client, name)
+                # Served from the cache, without rendering a template
+                self.assertEqual(cached.templates, [])
+
+                for values in (first_values, cached_values):
+                    self.assertEqual(set(values), {"csrfmiddlewaretoken", "idempotency_key"})
+                    uuid.UUID(values["idempotency_key"])
+                self.assertNotEqual(
+                    first_values["idempotency_key"], cached_values["idempotency_key"]
+                )
+                self.assertNotEqual(
+                    first_values["csrfmiddlewaretoken"], cached_values["csrfmiddlewaretoken"]
+                )
+                self.assertNotIn(b"__csrf_token__", cached.content)
+                self.assertNotIn(b"__idempotency_key__", cached.content)
+
+    def test_cached_page_books(self):
+        client = Client(enforce_csrf_checks=True)
+        self.get_form(client, "home_v3")
+        cached, values = self.get_form(client, "home_v3")
+        self.assertEqual(cached.templates, [])
+
+        response = client.post(
+            reverse("home_v3"),
+            {
+                "full_name": "Grace Hopper",
+                "email": "grace@example.com",
+                "num_tickets": 1,
+                "extra_donation": 0,
+                **values,
+            },
+        )
+        booking = Booking.objects.get()
+        self.assertEqual(str(booking.idempotency_key), values["idempotency_key"])
+        self.assertRedirects(
+            response,
+            reverse("booking_confirmation", args=[booking.pk]),
+            fetch_redirect_response=False,
+        )
+
+
+class ConfirmationPageCacheTests(TestCase):
+    SENT = b"We've sent a confirmation email"
+    FAILED = b"We couldn't send a confirmation email"
+    QUEUED = b"A confirmation email is on its way"
+
+    def setUp(self):
+        cache.clear()
+
+    def book(self):
+        """Book through the form, send the confirmation email, and return the booking."""
+        self.client.post(
+            reverse("home_v3"),
+            {
+                "full_name": "Grace Hopper",
+                "email": "grace@example.com",
+                "num_tickets": 1,
+                "extra_donation": 0,
+                "idempotency_key": uuid.uuid4(),
+            },
+        )
+        booking = Booking.objects.get()
+        self.deliver_emails()
+        return booking
+
+    def deliver_emails(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            deliver_outbox_batch(claim_outbox_batch(10))
+
+    def get(self, booking, etag=None):
+        headers = {"If-None-Match": etag} if etag else {}
+        return self.client.get(reverse("booking_confirmation", args=[booking.pk]), headers=headers)
+
+    def is_cached(self, booking):
+        return cache.get(confirmation_cache_key(booking.pk)) is not None
+
+    def test_first_view_with_message_is_not_cached(self):
+        booking = self.book()
+        response = self.get(booking)
+        self.assertContains(response, "Your booking was successful!")
+        self.assertFalse(self.is_cached(booking))
+
+        response = self.get(booking)
+        self.assertNotContains(response, "Your booking was successful!")
+        self.assertContains(response, self.SENT)
+        self.assertTrue(self.is_cached(booking))
+
+        with self.assertNumQueries(0):
+            cached = self.get(booking)
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(self.get(booking, response["ETag"]).status_code, 304)
+
+    def test_payment_change_drops_page(self):
+        booking = self.book()
+        self.get(booking)
+        etag = self.get(booking)["ETag"]
+
+        booking.is_paid = True
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.save()
+        self.assertFalse(self.is_cached(booking))
+        response = self.get(booking, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertTrue(self.is_cached(booking))
+
+    def test_reconciliation_drops_page(self):
+        booking = self.book()
+        self.get(booking)
+        etag = self.get(booking)["ETag"]
+
+        line = StatementLine(
+            1, timezone.localdate(), booking.donation_amount, booking.booking_reference()
+        )
+        reconciliation = Reconciliation([line])
+        reconciliation.match()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(reconciliation.apply(), 1)
+        self.assertFalse(self.is_cached(booking))
+        response = self.get(booking, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_email_status_changes_drop_page(self):
+        booking = self.book()
+        self.get(booking)
+        self.assertContains(self.get(booking), self.SENT)
+
+        email = OutboxEmail.objects.get(booking=booking)
+        email.status = OutboxEmail.STATUS_FAILED
+        with self.captureOnCommitCallbacks(execute=True):
+            email.save()
+        self.assertFalse(self.is_cached(booking))
+        self.assertContains(self.get(booking), self.FAILED)
+        self.assertTrue(self.is_cached(booking))
+
+        # Retrying from the admin updates the email without saving it
+        admin = Client()
+        admin.force_login(User.objects.create_superuser("admin", password="password"))
+        with self.captureOnCommitCallbacks(execute=True):
+            admin.post(
+                reverse("admin:tickets_outboxemail_changelist"),
+                {"action": "retry_now", "_selected_action": [email.pk]},
+            )
+        self.assertFalse(self.is_cached(booking))
+        # Not cached while the email is queued, as the worker's change
+        # might not reach this process's cache
+        self.assertContains(self.get(booking), self.QUEUED)
+        self.assertFalse(self.is_cached(booking))
+
+        self.deliver_emails()
+        self.assertContains(self.get(booking), self.SENT)
+        self.assertTrue(self.is_cached(booking))
+
+
+class BookingSubmissionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def post(self, key=None, **fields):
+        data = {
+            "full_name": "Grace Hopper",
+            "email": "grace@example.com",
+            "num_tickets": 2,
+            "extra_donation": 5,
+        }
+        if key is not None:
+            data["idempotency_key"] = key
+        data.update(fields)
+        return self.client.post(reverse("home_v3"), data)
+
+    def assertRedirectsToBooking(self, response, booking):
+        self.assertRedirects(
+            response,
+            reverse("booking_confirmation", args=[booking.pk]),
+            fetch_redirect_response=False,
+        )
+
+    def test_reposted_key_shows_original_booking(self):
+        key = uuid.uuid4()
+        self.post(key)
+        booking = Booking.objects.get()
+        self.assertEqual(booking.idempotency_key, key)
+
+        response = self.post(key)
+        self.assertRedirectsToBooking(response, booking)
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_reused_key_with_different_details_shows_original_booking(self):
+        key = uuid.uuid4()
+        self.post(key)
+        booking = Booking.objects.get()
+
+        response = self.post(key, num_tickets=4, email="someone@example.com")
+        self.assertRedirectsToBooking(response, booking)
+        self.assertEqual(Booking.objects.count(), 1)
+        booking.refresh_from_db()
+        self.assertEqual((booking.email, booking.num_tickets), ("grace@example.com", 2))
+
+    def test_new_keys_make_new_bookings(self):
+        # Booking twice on purpose, from two renders of the form
+        self.post(uuid.uuid4())
+        self.post(uuid.uuid4())
+        self.assertEqual(Booking.objects.count(), 2)
+
+    def test_missing_key_falls_back_to_recent_duplicate_check(self):
+        self.post()
+        booking = Booking.objects.get()
+        self.assertIsNone(booking.idempotency_key)
+        self.assertEqual(booking.donation_amount, Decimal("55.00"))
+
+        response = self.post()
+        self.assertRedirectsToBooking(response, booking)
+        self.assertEqual(Booking.objects.count(), 1)
+
+        # Different details are a different booking
+        self.post(num_tickets=1)
+        self.assertEqual(Booking.objects.count(), 2)
+
+    def test_missing_key_allows_repeat_after_window(self):
+        self.post()
+        Booking.objects.update(created_at=timezone.now() - timedelta(minutes=2))
+        self.post()
+        self.assertEqual(Booking.objects.count(), 2)
+
+
+class AsyncBookingViewTests(TestCase):
+    """The booking flow as served under ASGI, with ASYNC_VIEWS on."""
+
+    HIDDEN_INPUT = FormPageCacheTests.HIDDEN_INPUT
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # urls.py picks the views when it's imported, so load it again with
+        # the setting on, and again once the setting is restored
+        cls.addClassCleanup(cls.load_urls)
+        cls.enterClassContext(override_settings(ASYNC_VIEWS=True))
+        cls.load_urls()
+
+    @staticmethod
+    def load_urls():
+        importlib.reload(ticket_urls)
+        importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+        clear_url_caches()
+
+    def setUp(self):
+        cache.clear()
+        self.event = make_event(capacity=4)
+
+    async def post(self, **fields):
+        data = {
+            "full_name": "Grace Hopper",
+            "email": "grace@example.com",
+            "num_tickets": 2,
+            "extra_donation": 5,
+            "idempotency_key": uuid.uuid4(),
+        }
+        data.update(fields)
+        return await self.async_client.post(reverse("home"), data)
+
+    def test_booking_flow_uses_async_views(self):
+        self.assertIs(resolve(reverse("home")).func.view_class, BookingCreateViewAsync)
+        self.assertIs(resolve(reverse("home_v3")).func.view_class, BookingCreateViewAsync)
+        self.assertIs(
+            resolve(reverse("booking_confirmation", args=[1])).func.view_class,
+            BookingConfirmationViewAsync,
+        )
+
+    async def test_get_renders_then_serves_cached_form(self):
+        keys = []
+        for _ in range(2):
+            response = await self.async_client.get(reverse("home"))
+            self.assertEqual(response.status_code, 200)
+            values = dict(self.HIDDEN_INPUT.findall(response.content.decode()))
+            keys.append(uuid.UUID(values["idempotency_key"]))
+        self.assertEqual(response.templates, [])
+        self.assertNotEqual(keys[0], keys[1])
+
+    async def test_post_books_and_shows_confirmation(self):
+        response = await self.post()
+        booking = await Booking.objects.aget()
+        confirmation_url = reverse("booking_confirmation", args=[booking.pk])
+        self.assertRedirects(response, confirmation_url, fetch_redirect_response=False)
+        self.assertEqual(booking.event_id, self.event.pk)
+        self.assertEqual(booking.donation_amount, Decimal("55.00"))
+
+        response = await self.async_client.get(confirmation_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, booking.payment_reference())
+
+    async def test_reposted_key_shows_original_booking(self):
+        key = uuid.uuid4()
+        await self.post(idempotency_key=key)
+        booking = await Booking.objects.aget()
+
+        response = await self.post(idempotency_key=key, num_tickets=1)
+        self.assertRedirects(
+            response,
+            reverse("booking_confirmation", args=[booking.pk]),
+            fetch_redirect_response=False,
+        )
+        self.assertEqual(await Booking.objects.acount(), 1)
+
+    async def test_missing_key_falls_back_to_recent_duplicate_check(self):
+        await self.post(idempotency_key="")
+        booking = await Booking.objects.aget()
+        self.assertIsNone(booking.idempotency_key)
+
+        response = await self.post(idempotency_key="")
+        self.assertRedirects(
+            response,
+            reverse("booking_confirmation", args=[booking.pk]),
+            fetch_redirect_response=False,
+        )
+        self.assertEqual(await Booking.objects.acount(), 1)
+
+    async def test_invalid_form_is_shown_again(self):
+        response = await self.post(email="not an email")
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(response.context["form"], "email", "Enter a valid email address.")
+        self.assertFalse(await Booking.objects.aexists())
+
+    async def test_sold_out_joins_waitlist(self):
+        await sync_to_async(make_booking)(event=self.event, num_tickets=4)
+        response = await self.post()
+        self.assertRedirects(response, reverse("home"), fetch_redirect_response=False)
+        self.assertEqual(await Booking.objects.acount(), 1)
+        entry = await WaitlistEntry.objects.aget()
+        self.assertEqual(
+            (entry.event_id, entry.email, entry.num_tickets),
+            (self.event.pk, "grace@example.com", 2),
+        )
+
+        # The waitlist message means the form isn't served from the cache
+        response = await self.async_client.get(reverse("home"))
+        self.assertContains(response, "added you to the waitlist")
+
+
+@override_settings(EMAIL_POOL_SIZE=1, EMAIL_POOL_IDLE_TIMEOUT=60)
+class PooledEmailBackendTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch("tickets.email_backends.connection_pool", SMTPConnectionPool())
+        self.pool = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.connections = []
+        self.disconnect = False
+        patcher = mock.patch("smtplib.SMTP", side_effect=self.connect)
+        self.smtp = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.now = 1000.0
+        patcher = mock.patch("tickets.email_backends.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def connect(self, *args, **kwargs):
+        connection = mock.Mock()
+        connection.noop.return_value = (250, b"OK")
+        connection.sendmail.return_value = {}
+        if self.disconnect:
+            connection.sendmail.side_effect = SMTPServerDisconnected
+        self.connections.append(connection)
+        return connection
+
+    def send(self):
+        backend = PooledEmailBackend(
+            host="smtp.example.com", username="user", password="password", use_tls=True
+        )
+        message = EmailMessage("Booking", "Thank you", "from@example.com", ["to@example.com"])
+        return backend.send_messages([message])
+
+    def assertStats(self, **expected):
+        stats = pool_stats()
+        self.assertEqual({name: stats[name] for name in expected}, expected)
+
+    def test_reuses_connection(self):
+        self.assertEqual(self.send(), 1)
+        self.assertEqual(self.send(), 1)
+
+        self.assertEqual(self.smtp.call_count, 1)
+        connection = self.connections[0]
+        connection.starttls.assert_called_once()
+        connection.login.assert_called_once_with("user", "password")
+        self.assertEqual(connection.sendmail.call_count, 2)
+        connection.noop.assert_called_once()
+        connection.quit.assert_not_called()
+        self.assertStats(opened=1, reused=1, reconnects=0, stale=0, expired=0)
+
+    def test_pool_keeps_at_most_pool_size_connections(self):
+        first = PooledEmailBackend(host="smtp.example.com")
+        second = PooledEmailBackend(host="smtp.example.com")
+        first.open()
+        second.open()
+        first.close()
+        second.close()
+        self.connections[0].quit.assert_not_called()
+        self.connections[1].quit.assert_called_once()
+
+    def test_idle_connection_expires(self):
+        self.send()
+        self.now += 61
+        self.send()
+
+        self.assertEqual(self.smtp.call_count, 2)
+        self.connections[0].quit.assert_called_once()
+        self.connections[0].noop.assert_not_called()
+        self.assertEqual(self.connections[1].sendmail.call_count, 1)
+        self.assertStats(opened=2, reused=0, reconnects=1, expired=1, stale=0)
+
+    def test_stale_connection_reconnects(self):
+        self.send()
+        self.connections[0].noop.side_effect = SMTPServerDisconnected
+        self.send()
+
+        self.assertEqual(self.smtp.call_count, 2)
+        self.assertEqual(self.connections[0].sendmail.call_count, 1)
+        self.assertEqual(self.connections[1].sendmail.call_count, 1)
+        self.assertStats(opened=2, reused=0, reconnects=1, stale=1, expired=0)
+
+    def test_noop_error_reply_reconnects(self):
+        self.send()
+        self.connections[0].noop.return_value = (421, b"Closing")
+        self.send()
+        self.assertEqual(self.smtp.call_count, 2)
+        self.assertStats(stale=1, reconnects=1)
+
+    def test_resends_once_after_disconnect(self):
+        self.send()
+        # The server drops the connection after the NOOP check
+        self.connections[0].sendmail.side_effect = SMTPServerDisconnected
+        self.assertEqual(self.send(), 1)
+
+        self.assertEqual(self.smtp.call_count, 2)
+        self.assertEqual(self.connections[1].sendmail.call_count, 1)
+        self.assertStats(opened=2, reused=1, reconnects=1, stale=1)
+
+    def test_second_disconnect_is_raised(self):
+        self.disconnect = True
+        with self.assertRaises(SMTPServerDisconnected):
+            self.send()
+        self.assertEqual(
+            [connection.sendmail.call_count for connection in self.connections], [1, 1]
+        )
+
+    def test_pool_stats_default_to_zero(self):
+        self.assertEqual(
+            pool_stats(), {"opened": 0, "reused": 0, "reconnects": 0, "stale": 0, "expired": 0}
+        )
+
+
+@override_settings(
+    EMAIL_OUTBOX_MAX_ATTEMPTS=3,
+    EMAIL_OUTBOX_RETRY_DELAY=60,
+    EMAIL_OUTBOX_MAX_RETRY_DELAY=90,
+    EMAIL_OUTBOX_LEASE=300,
+)
+class OutboxTests(TestCase):
+    def queue_email(self, **fields):
+        values = {
+            "kind": OutboxEmail.KIND_BOOKING_CONFIRMATION,
+            "subject": "Booking Confirmation",
+            "recipients": ["ada@example.com"],
+            "body": "Thank you",
+        }
+        values.update(fields)
+        return OutboxEmail.objects.create(**values)
+
+    def test_claim_leases_due_emails(self):
+        due = self.queue_email()
+        self.queue_email(next_attempt_at=timezone.now() + timedelta(minutes=5))
+        self.queue_email(status=OutboxEmail.STATUS_SENT)
+
+        before = timezone.now()
+        batch = claim_outbox_batch(10)
+        self.assertEqual(batch, [due])
+        due.refresh_from_db()
+        self.assertEqual(due.attempts, 1)
+        self.assertGreaterEqual(due.next_attempt_at, before + timedelta(seconds=300))
+
+        # Leased emails aren't claimed again
+        self.assertEqual(claim_outbox_batch(10), [])
+
+    def test_claim_respects_batch_size_and_order(self):
+        now = timezone.now()
+        emails = [
+            self.queue_email(next_attempt_at=now - timedelta(minutes=minutes))
+            for minutes in (1, 3, 2)
+        ]
+        self.assertEqual(claim_outbox_batch(2), [emails[1], emails[2]])
+        self.assertEqual(claim_outbox_batch(2), [emails[0]])
+
+    def test_only_one_worker_claims_an_email(self):
+        email = self.queue_email()
+        lease_until = timezone.now() + timedelta(minutes=5)
+        # Two workers that both read the email as due
+        first, second = OutboxEmail.objects.get(), OutboxEmail.objects.get()
+        self.assertTrue(claim_outbox_email(first, lease_until))
+        self.assertFalse(claim_outbox_email(second, lease_until))
+        email.refresh_from_db()
+        self.assertEqual(email.attempts, 1)
+        self.assertEqual(second.attempts, 0)
+
+    def test_delivery_marks_sent(self):
+        email = self.queue_email()
+        self.assertEqual(deliver_outbox_batch(claim_outbox_batch(10)), (1, 0))
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.STATUS_SENT)
+        self.assertIsNotNone(email.sent_at)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["ada@example.com"])
+
+    def test_failure_retries_with_backoff_then_fails(self):
+        email = self.queue_email()
+        with mock.patch(
+            "tickets.utils.EmailMultiAlternatives.send", side_effect=SMTPException("refused")
+        ), self.assertLogs("tickets.utils", "WARNING") as logs:
+            for attempt, delay in ((1, 60), (2, 90)):
+                before = timezone.now()
+                self.assertEqual(deliver_outbox_batch(claim_outbox_batch(10)), (0, 1))
+                email.refresh_from_db()
+                self.assertEqual(
+                    (email.status, email.attempts, email.last_error),
+                    (OutboxEmail.STATUS_PENDING, attempt, "refused"),
+                )
+                self.assertGreaterEqual(email.next_attempt_at, before + timedelta(seconds=delay))
+                self.assertLess(
+                    email.next_attempt_at, timezone.now() + timedelta(seconds=delay)
+                )
+                # Make the retry due now
+                OutboxEmail.objects.update(next_attempt_at=timezone.now())
+
+            self.assertEqual(deliver_outbox_batch(claim_outbox_batch(10)), (0, 1))
+        self.assertEqual(len(logs.records), 3)
+        self.assertIn("(attempt 3): refused", logs.records[-1].getMessage())
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboxEmail.STATUS_FAILED, 3))
+        self.assertEqual(claim_outbox_batch(10), [])
+
+    def test_retry_delay_doubles_up_to_maximum(self):
+        self.assertEqual(
+            [outbox_retry_delay(attempts).total_seconds() for attempts in (1, 2, 3)],
+            [60, 90, 90],
+        )
+
+    @override_settings(ADMIN_NOTIFICATION_EMAILS=["admin@example.com"])
+    def test_digest_covers_each_booking_once(self):
+        make_booking()
+        make_booking(full_name="Grace Hopper")
+        digest = queue_admin_notification_digest(force=True)
+        self.assertEqual(digest.kind, OutboxEmail.KIND_ADMIN_DIGEST)
+        self.assertFalse(Booking.objects.filter(admin_notified_at__isnull=True).exists())
+        self.assertIsNone(queue_admin_notification_digest(force=True))
+
+
+class MetricsTests(StaffTestCase):
+    # A sample line: name, optional labels and value
+    SAMPLE = re.compile(
+        r'^[a-z_]+(\{[a-z_]+="[^"]*"(,[a-z_]+="[^"]*")*\})? -?[0-9.]+(e[-+][0-9]+)?$'
+    )
+
+    def scrape(self, **headers):
+        response = self.client.get(reverse("metrics"), headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def sample(self, text, line_start):
+        for line in text.splitlines():
+            if line.startswith(line_start + " "):
+                return float(line.rsplit(" ", 1)[1])
+        return 0
+
+    def test_requires_staff_or_token(self):
+        self.client.logout()
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response["WWW-Authenticate"], "Bearer")
+
+        with override_settings(METRICS_TOKENS=["scraper-token"]):
+            response = self.client.get(
+                reverse("metrics"), headers={"Authorization": "Bearer wrong"}
+            )
+            self.assertEqual(response.status_code, 401)
+            self.scrape(Authorization="Bearer scraper-token")
+
+    def test_prometheus_text_format(self):
+        requests = 'tickets_requests_total{view="BookingReportView",method="GET",status="200"}'
+        before = self.sample(self.scrape().content.decode(), requests)
+        self.client.get(reverse("booking_report"))
+
+        response = self.scrape()
+        self.assertEqual(response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        self.assertIn("no-store", response["Cache-Control"])
+        text = response.content.decode()
+        self.assertTrue(text.endswith("\n"))
+        for line in text.splitlines():
+            if line.startswith("#"):
+                self.assertRegex(line, r"^# (HELP [a-z_]+ .+|TYPE [a-z_]+ (counter|histogram))$")
+            else:
+                self.assertRegex(line, self.SAMPLE)
+        self.assertEqual(self.sample(text, requests), before + 1)
+        self.assertIn("# TYPE tickets_request_duration_seconds histogram", text)
+        self.assertIn(
+            'tickets_request_duration_seconds_bucket{view="BookingReportView",le="+Inf"}', text
+        )
+
+    def test_histogram_buckets_and_label_escaping(self):
+        metrics = Metrics()
+        labels = (("view", 'Say "hi"\\now'),)
+        metrics.observe("tickets_request_duration_seconds", labels, 0.02)
+        metrics.observe("tickets_request_duration_seconds", labels, 3)
+        metrics.inc("tickets_emails_sent_total", labels, 2)
+        text = metrics.render()
+
+        escaped = 'view="Say \\"hi\\"\\\\now"'
+        self.assertIn(f"tickets_emails_sent_total{{{escaped}}} 2", text)
+        # Buckets are cumulative
+        self.assertIn(f'tickets_request_duration_seconds_bucket{{{escaped},le="0.01"}} 0', text)
+        self.assertIn(f'tickets_request_duration_seconds_bucket{{{escaped},le="0.025"}} 1', text)
+        self.assertIn(f'tickets_request_duration_seconds_bucket{{{escaped},le="5"}} 2', text)
+        self.assertIn(f'tickets_request_duration_seconds_bucket{{{escaped},le="+Inf"}} 2', text)
+        self.assertIn(f"tickets_request_duration_seconds_count{{{escaped}}} 2", text)
+        self.assertIn(f"tickets_request_duration_seconds_sum{{{escaped}}} 3.02", text)
+
+
+class SlowQueryLoggingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(SLOW_QUERY_THRESHOLD=0)
+    def test_slow_query_logged_without_parameters(self):
+        with self.assertLogs("tickets.db", "WARNING") as logs:
+            Booking.objects.filter(email="secret@example.com").exists()
+        [record] = logs.records
+        self.assertTrue(record.getMessage().startswith("Slow query in no request ("))
+        self.assertIn("tickets_booking", record.data["sql"])
+        self.assertIsNone(record.data["view"])
+        self.assertEqual(record.data["database"], "default")
+        self.assertNotIn("secret@example.com", json.dumps(record.data, default=str))
+
+    def test_slow_queries_in_request(self):
+        url = reverse("booking_confirmation", args=[make_booking().pk])
+        with override_settings(SLOW_QUERY_THRESHOLD=0, SLOW_REQUEST_THRESHOLD=0):
+            with self.assertLogs("tickets", "WARNING") as logs:
+                self.client.get(url)
+        queries = [record for record in logs.records if record.name == "tickets.db"]
+        self.assertTrue(queries)
+        self.assertEqual(
+            {record.data["view"] for record in queries}, {"BookingConfirmationView"}
+        )
+        [request] = [record for record in logs.records if record.name == "tickets.requests"]
+        self.assertEqual(request.levelname, "WARNING")
+        self.assertEqual(request.data["slow_queries"], len(queries))
+        self.assertEqual(request.data["db_queries"], len(queries))
+
+    def test_fast_queries_not_logged(self):
+        with self.assertNoLogs("tickets.db", "WARNING"):
+            Booking.objects.exists()
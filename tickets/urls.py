@@ -1,22 +1,40 @@
+from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
 from django.urls import path
 
 from .views import (
+    BookingApiView,
     BookingConfirmationView,
+    BookingConfirmationViewAsync,
     BookingCreateView,
+    BookingCreateViewAsync,
     BookingCreateViewV2,
     BookingCreateViewV3,
+    BookingExportView,
     BookingReportView,
+    CheckInServiceWorkerView,
+    CheckInSnapshotView,
+    CheckInSyncView,
+    CheckInView,
+    MetricsView,
 )
 
+# Under ASGI the booking flow is served by async views
+if settings.ASYNC_VIEWS:
+    booking_form_view = BookingCreateViewAsync.as_view()
+    confirmation_view = BookingConfirmationViewAsync.as_view()
+else:
+    booking_form_view = BookingCreateViewV3.as_view()
+    confirmation_view = BookingConfirmationView.as_view()
+
 urlpatterns = [
-    path("", BookingCreateViewV3.as_view(), name="home"),
+    path("", booking_form_view, name="home"),
     path("v1/", BookingCreateView.as_view(), name="home_v1"),
     path("v2/", BookingCreateViewV2.as_view(), name="home_v2"),
-    path("v3/", BookingCreateViewV3.as_view(), name="home_v3"),
+    path("v3/", booking_form_view, name="home_v3"),
     path(
         "confirmation/<int:pk>/",
-        BookingConfirmationView.as_view(),
+        confirmation_view,
         name="booking_confirmation",
     ),
     path(
@@ -24,4 +42,27 @@ urlpatterns = [
         staff_member_required(BookingReportView.as_view()),
         name="booking_report",
     ),
+    path(
+        "report/export/",
+        staff_member_required(BookingExportView.as_view()),
+        name="booking_export",
+    ),
+    path("api/bookings/", BookingApiView.as_view(), name="booking_api"),
+    path("checkin/", staff_member_required(CheckInView.as_view()), name="checkin"),
+    path(
+        "checkin/snapshot.json",
+        staff_member_required(CheckInSnapshotView.as_view()),
+        name="checkin_snapshot",
+    ),
+    path(
+        "checkin/sync/",
+        staff_member_required(CheckInSyncView.as_view()),
+        name="checkin_sync",
+    ),
+    path(
+        "checkin/sw.js",
+        staff_member_required(CheckInServiceWorkerView.as_view()),
+        name="checkin_sw",
+    ),
+    path("metrics", MetricsView.as_view(), name="metrics"),
 ]
@@ -1,23 +1,28 @@
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
+import logging
+from datetime import timedelta
+
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
 from django.conf import settings
 from django.urls import reverse
-from django.contrib.sites.shortcuts import get_current_site
 
-from .models import Booking
+from .email_templates import render_email
+from .models import Booking, OutboxEmail, WaitlistEntry
+
+logger = logging.getLogger(__name__)
 
 
-def send_booking_confirmation_email(request, booking):
+def render_booking_confirmation_email(booking):
     """
-    Send a booking confirmation email to the customer.
-    
+    Render the booking confirmation email for a customer.
+
     Args:
-        request: The HTTP request object
         booking: The Booking instance
-    
+
     Returns:
-        bool: True if email was sent successfully, False otherwise
+        tuple: (subject, plain_message, html_message)
     """
     subject = f'Booking Confirmation - Sibford CATS Event - Reference: {booking.booking_reference()}'
     
@@ -28,76 +33,266 @@ def send_booking_confirmation_email(request, booking):
         'bank_details': settings.BANK_DETAILS,
     }
     
-    # Render HTML message
-    html_message = render_to_string('tickets/emails/booking_confirmation.html', context)
-    
-    # Create plain text version by stripping HTML tags
-    plain_message = strip_tags(html_message)
-    
-    # Send email
-    try:
-        send_mail(
-            subject=subject,
-            message=plain_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[booking.email],
-            html_message=html_message,
-            fail_silently=False,
-        )
-        return True
-    except Exception as e:
-        # Log the error
-        print(f"Error sending booking confirmation email: {str(e)}")
-        return False
+    # Render the HTML message and its plain text version
+    plain_message, html_message = render_email('tickets/emails/booking_confirmation', context)
 
+    return subject, plain_message, html_message
 
-def send_admin_notification_email(request, booking):
+
+def queue_booking_confirmation_email(booking):
     """
-    Send a notification email to admins when a new booking is received.
-    
+    Queue the confirmation email for a booking in the outbox.
+
+    Call this inside the transaction that saves the booking so the booking
+    and its email commit together; the send_queued_emails worker delivers
+    it. Admins hear about the booking through the next notification digest.
+
     Args:
-        request: The HTTP request object
         booking: The Booking instance
-    
+
     Returns:
-        bool: True if email was sent successfully, False otherwise
+        OutboxEmail: The queued email
     """
-    subject = f'New Booking Notification - {booking.full_name} - {booking.num_tickets} tickets'
-    
-    # Get the admin URL (this is an approximation, adjust as needed)
-    if request:
-        site = get_current_site(request)
-        domain = site.domain
-        protocol = 'https' if request.is_secure() else 'http'
-        admin_url = f"{protocol}://{domain}/admin/tickets/booking/{booking.id}/change/"
-    else:
-        admin_url = "#"  # Fallback if no request object is provided
-    
-    # Prepare context for email template
+    subject, plain_message, html_message = render_booking_confirmation_email(booking)
+    return OutboxEmail.objects.create(
+        booking=booking,
+        kind=OutboxEmail.KIND_BOOKING_CONFIRMATION,
+        subject=subject,
+        recipients=[booking.email],
+        body=plain_message,
+        html_body=html_message,
+    )
+
+
+def render_waitlist_offer_email(entry):
+    """
+    Render the email telling someone on the waitlist that tickets are available.
+
+    Args:
+        entry: The WaitlistEntry instance
+
+    Returns:
+        tuple: (subject, plain_message, html_message)
+    """
+    subject = f'Tickets Available - {entry.event.name}'
+
     context = {
-        'booking': booking,
-        'payment_reference': booking.payment_reference(),
-        'admin_url': admin_url,
+        'entry': entry,
+        'event': entry.event,
+        'booking_url': f"{settings.SITE_URL}{reverse('home')}",
     }
-    
-    # Render HTML message
-    html_message = render_to_string('tickets/emails/admin_notification.html', context)
-    
-    # Create plain text version by stripping HTML tags
-    plain_message = strip_tags(html_message)
-    
-    # Send email
-    try:
-        send_mail(
+
+    plain_message, html_message = render_email('tickets/emails/waitlist_offer', context)
+
+    return subject, plain_message, html_message
+
+
+def queue_waitlist_offer_emails(entries):
+    """
+    Queue a tickets-available email for each waitlist entry and mark the
+    entries as offered.
+
+    Args:
+        entries: A queryset of WaitlistEntry instances
+
+    Returns:
+        int: The number of emails queued
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        entries = list(entries.select_related('event').select_for_update(of=('self',)))
+        emails = []
+        for entry in entries:
+            subject, plain_message, html_message = render_waitlist_offer_email(entry)
+            emails.append(OutboxEmail(
+                kind=OutboxEmail.KIND_WAITLIST_OFFER,
+                subject=subject,
+                recipients=[entry.email],
+                body=plain_message,
+                html_body=html_message,
+            ))
+        OutboxEmail.objects.bulk_create(emails)
+        WaitlistEntry.objects.filter(pk__in=[entry.pk for entry in entries]).update(offered_at=now)
+    return len(emails)
+
+
+def render_admin_digest_email(bookings):
+    """
+    Render a digest email summarising several new bookings for admins.
+
+    Args:
+        bookings: A list of Booking instances
+
+    Returns:
+        tuple: (subject, plain_message, html_message)
+    """
+    total_tickets = sum(booking.num_tickets for booking in bookings)
+    subject = (
+        f'New Bookings Digest - {len(bookings)} booking{"s" if len(bookings) != 1 else ""}'
+        f' - {total_tickets} tickets'
+    )
+
+    context = {
+        'bookings': bookings,
+        'total_tickets': total_tickets,
+        'total_amount': sum(booking.donation_amount for booking in bookings),
+        'gift_aid_count': sum(1 for booking in bookings if booking.gift_aid),
+        'admin_url': f"{settings.SITE_URL}{reverse('admin:tickets_booking_changelist')}",
+    }
+
+    plain_message, html_message = render_email('tickets/emails/admin_digest', context)
+
+    return subject, plain_message, html_message
+
+
+def queue_admin_notification_digest(force=False):
+    """
+    Queue one digest email covering every booking admins haven't heard about.
+
+    A digest is only queued once ADMIN_NOTIFICATION_DIGEST_SIZE bookings are
+    waiting, or the oldest waiting booking is ADMIN_NOTIFICATION_DIGEST_INTERVAL
+    seconds old, unless ``force`` is set.
+
+    Returns:
+        OutboxEmail: The queued digest, or None if no digest was due
+    """
+    waiting = Booking.objects.filter(admin_notified_at__isnull=True)
+    if not force:
+        window_start = timezone.now() - timedelta(
+            seconds=settings.ADMIN_NOTIFICATION_DIGEST_INTERVAL
+        )
+        size = settings.ADMIN_NOTIFICATION_DIGEST_SIZE
+        oldest_due = waiting.filter(created_at__lte=window_start).exists()
+        if not oldest_due and len(waiting.values("id")[:size]) < size:
+            return None
+
+    with transaction.atomic():
+        bookings = list(
+            waiting.select_for_update(skip_locked=True).order_by("created_at")
+        )
+        if not bookings:
+            return None
+
+        subject, plain_message, html_message = render_admin_digest_email(bookings)
+        digest = OutboxEmail.objects.create(
+            kind=OutboxEmail.KIND_ADMIN_DIGEST,
             subject=subject,
-            message=plain_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=settings.ADMIN_NOTIFICATION_EMAILS,
-            html_message=html_message,
-            fail_silently=False,
+            recipients=list(settings.ADMIN_NOTIFICATION_EMAILS),
+            body=plain_message,
+            html_body=html_message,
         )
-        return True
+        # Without row locks (on SQLite), another worker may have read the
+        # same bookings; whichever marks them first sends the digest
+        marked = Booking.objects.filter(
+            id__in=[booking.id for booking in bookings], admin_notified_at__isnull=True
+        ).update(admin_notified_at=timezone.now())
+        if marked != len(bookings):
+            transaction.set_rollback(True)
+            return None
+    return digest
+
+
+def outbox_retry_delay(attempts):
+    """Return the exponential backoff delay after a failed delivery attempt."""
+    delay = settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** max(attempts - 1, 0)
+    return timedelta(seconds=min(delay, settings.EMAIL_OUTBOX_MAX_RETRY_DELAY))
+
+
+def claim_outbox_batch(batch_size):
+    """
+    Claim up to ``batch_size`` due outbox emails for delivery.
+
+    Claimed rows have their attempt counted and their next attempt pushed
+    out by the lease period, so a worker that dies mid-batch leaves them to
+    be retried rather than lost. Each row is claimed by claim_outbox_email,
+    so two workers that read the same due rows never both send them. On
+    PostgreSQL, SKIP LOCKED also keeps workers from reading each other's
+    rows in the first place; SQLite has no row locks.
+    """
+    now = timezone.now()
+    lease_until = now + timedelta(seconds=settings.EMAIL_OUTBOX_LEASE)
+    with transaction.atomic():
+        due = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboxEmail.STATUS_PENDING, next_attempt_at__lte=now)
+            .order_by("next_attempt_at", "id")[:batch_size]
+        )
+        return [email for email in due if claim_outbox_email(email, lease_until)]
+
+
+def claim_outbox_email(email, lease_until):
+    """
+    Lease an outbox email read as due until ``lease_until``, and return
+    whether this caller got it.
+
+    The UPDATE only matches the row while it's still pending with the next
+    attempt time it was read with. A worker that has claimed or sent it
+    since will have changed one or the other, so the row count says
+    whether this caller got there first.
+    """
+    claimed = OutboxEmail.objects.filter(
+        pk=email.pk,
+        status=OutboxEmail.STATUS_PENDING,
+        next_attempt_at=email.next_attempt_at,
+    ).update(attempts=F("attempts") + 1, next_attempt_at=lease_until)
+    if claimed:
+        email.attempts += 1
+        email.next_attempt_at = lease_until
+    return bool(claimed)
+
+
+def deliver_outbox_batch(batch):
+    """
+    Send a claimed batch of outbox emails over a single SMTP connection.
+
+    Successful sends are marked sent. Failures are rescheduled with
+    exponential backoff, or marked failed once they reach
+    EMAIL_OUTBOX_MAX_ATTEMPTS.
+
+    Returns:
+        tuple: (number sent, number failed)
+    """
+    sent = failed = 0
+    connection = get_connection()
+    try:
+        connection.open()
     except Exception as e:
-        # Log the error
-        print(f"Error sending admin notification email: {str(e)}")
-        return False
\ No newline at end of file
+        logger.error('Error opening email connection: %s', e)
+        connection = None
+
+    for email in batch:
+        try:
+            if connection is None:
+                raise ConnectionError("No email connection available")
+            message = EmailMultiAlternatives(
+                subject=email.subject,
+                body=email.body,
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                to=email.recipients,
+                connection=connection,
+            )
+            if email.html_body:
+                message.attach_alternative(email.html_body, "text/html")
+            message.send()
+        except Exception as e:
+            logger.warning(
+                'Error sending %s email %s (attempt %s): %s', email.kind, email.id, email.attempts, e
+            )
+            email.last_error = str(e)
+            if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+                email.status = OutboxEmail.STATUS_FAILED
+            else:
+                email.next_attempt_at = timezone.now() + outbox_retry_delay(
+                    email.attempts
+                )
+            failed += 1
+        else:
+            email.status = OutboxEmail.STATUS_SENT
+            email.sent_at = timezone.now()
+            email.last_error = ""
+            sent += 1
+        email.save(update_fields=["status", "next_attempt_at", "last_error", "sent_at"])
+
+    if connection is not None:
+        connection.close()
+    return sent, failed
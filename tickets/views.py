@@ -1,112 +1,191 @@
+import hashlib
+import json
 from datetime import timedelta
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib import messages
-from django.db.models import Q, Sum
-from django.shortcuts import redirect
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect
+from django.templatetags.static import static
+from django.urls import reverse
 from django.utils import timezone
-from django.views.generic import CreateView, ListView, TemplateView
-
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.views.generic import CreateView, ListView, TemplateView, View
+
+from .api import (
+    InvalidParameter,
+    bookings_etag,
+    has_api_access,
+    has_bearer_token,
+    parse_fields,
+    parse_limit,
+    serialize_booking,
+    source_fields,
+)
+from .caching import ConfirmationPageCacheMixin, FormShellCacheMixin
+from .checkin import (
+    CHECK_IN_ASSETS,
+    CHECK_IN_BATCH_SIZE,
+    SNAPSHOT_FIELDS,
+    InvalidCheckIn,
+    door_event,
+    parse_check_ins,
+    record_check_ins,
+    snapshot_bookings,
+    snapshot_rows,
+    snapshot_version,
+)
+from .exports import export_rows, stream_csv, stream_xlsx
 from .forms import BookingForm, BookingFormV2, BookingFormV3, ReportFilterForm
-from .models import Booking
-from .utils import send_admin_notification_email, send_booking_confirmation_email
-
-
-class BookingCreateView(CreateView):
-    model = Booking
-    form_class = BookingForm
-    template_name = "tickets/booking_form.html"
+from .instrumentation import metrics
+from .models import Booking, BookingSummary, Event, OutboxEmail, SoldOut, WaitlistEntry
+from .pagination import CURSOR_VAR, InvalidCursor, KeysetPaginator
+from .routers import use_replica
+from .search import get_search_backend
+from .utils import queue_booking_confirmation_email
+
+
+class BookingSubmissionMixin:
+    """
+    Save a valid booking form exactly once, for the current event.
+
+    Each form carries an idempotency key, and the unique constraint on
+    Booking.idempotency_key makes a second submission of the same form fail
+    to insert, however many workers it reaches at once. That submission is
+    sent to the original booking's confirmation page instead. A form posted
+    without a key (from a page rendered before keys were issued, or by a
+    script) is checked the old way: if a booking with the same email,
+    tickets and donation was made in the last DUPLICATE_WINDOW, that's
+    taken to be the original.
+
+    If an event is open, saving the booking reserves its tickets (see
+    EventQuerySet.reserve); when it has sold out the booker joins the
+    waitlist.
+    """
+
+    DUPLICATE_WINDOW = timedelta(seconds=60)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["suggested_donation"] = self.form_class.SUGGESTED_DONATION
+        context["event"] = Event.objects.current()
         return context
 
     def form_valid(self, form):
-        # Save the booking to the database
-        self.object = form.save()
-
-        # Send confirmation email to the customer
-        email_sent = send_booking_confirmation_email(self.request, self.object)
-        if email_sent:
-            messages.success(
-                self.request,
-                "Your booking was successful! A confirmation email has been sent.",
-            )
-        else:
-            messages.warning(
-                self.request,
-                "Your booking was successful, but there was an issue sending the confirmation email.",
-            )
+        key = form.cleaned_data.get("idempotency_key")
+        form.instance.idempotency_key = key
+        form.instance.event = Event.objects.current()
+
+        if key is None:
+            duplicate = self.recent_duplicate(form)
+            if duplicate is not None:
+                return self.already_submitted(duplicate)
+
+        try:
+            self.object = self.save_booking(form)
+        except SoldOut as e:
+            return self.sold_out(form, e)
+        except IntegrityError:
+            original = key and Booking.objects.filter(idempotency_key=key).first()
+            if not original:
+                raise
+            return self.already_submitted(original)
+        return self.booked()
+
+    def save_booking(self, form):
+        # Save the booking and queue its confirmation email in one
+        # transaction; the send_queued_emails worker delivers it and sends
+        # admins a digest of new bookings
+        with transaction.atomic():
+            booking = form.save()
+            queue_booking_confirmation_email(booking)
+        return booking
+
+    def recent_duplicate(self, form):
+        """
+        Return a booking made without a key in the last DUPLICATE_WINDOW
+        with the same details as ``form``, or None.
+        """
+        booking = form.save(commit=False)
+        return Booking.objects.filter(
+            idempotency_key=None,
+            email=booking.email,
+            num_tickets=booking.num_tickets,
+            donation_amount=booking.donation_amount,
+            created_at__gte=timezone.now() - self.DUPLICATE_WINDOW,
+        ).first()
+
+    def already_submitted(self, original):
+        messages.info(
+            self.request,
+            "This booking was already submitted. Showing your confirmation details.",
+        )
+        return redirect("booking_confirmation", pk=original.id)
 
-        # Send notification email to admins
-        send_admin_notification_email(self.request, self.object)
+    def booked(self):
+        messages.success(
+            self.request,
+            "Your booking was successful! A confirmation email is on its way.",
+        )
 
         # Redirect to the confirmation page with the booking ID
         return redirect("booking_confirmation", pk=self.object.id)
 
+    def sold_out(self, form, error):
+        """Offer the tickets that are left, or add the booker to the waitlist."""
+        Event.objects.clear_cache()
+        event = Event.objects.get(pk=error.event_id)
+        if event.tickets_remaining:
+            form.add_error(
+                "num_tickets",
+                f"Sorry, only {event.tickets_remaining} ticket(s) are left.",
+            )
+            return self.form_invalid(form)
+
+        WaitlistEntry.objects.get_or_create(
+            event=event,
+            email=form.cleaned_data["email"],
+            defaults={
+                "full_name": form.cleaned_data["full_name"],
+                "num_tickets": form.cleaned_data["num_tickets"],
+            },
+        )
+        messages.warning(
+            self.request,
+            "Sorry, this event has sold out. We've added you to the waitlist "
+            "and will email you if tickets become available.",
+        )
+        return redirect(self.request.path)
 
-class BookingCreateViewV2(CreateView):
-    """Version 2: Fixed £25 per ticket + optional extra donation."""
 
+class BookingCreateView(FormShellCacheMixin, BookingSubmissionMixin, CreateView):
     model = Booking
-    form_class = BookingFormV2
-    template_name = "tickets/booking_form_v2.html"
+    form_class = BookingForm
+    template_name = "tickets/booking_form.html"
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["ticket_price"] = self.form_class.TICKET_PRICE
+        context["suggested_donation"] = self.form_class.SUGGESTED_DONATION
         return context
 
-    def form_valid(self, form):
-        # Check for duplicate submissions (same email within last 60 seconds)
-        email = form.cleaned_data.get("email")
-        num_tickets = form.cleaned_data.get("num_tickets")
-        donation_amount = num_tickets * self.form_class.TICKET_PRICE + (
-            form.cleaned_data.get("extra_donation") or 0
-        )
 
-        # Look for recent bookings with same email, tickets, and donation amount
-        cutoff_time = timezone.now() - timedelta(seconds=60)
-        recent_duplicate = Booking.objects.filter(
-            email=email,
-            num_tickets=num_tickets,
-            donation_amount=donation_amount,
-            created_at__gte=cutoff_time,
-        ).first()
-
-        if recent_duplicate:
-            # Redirect to the existing booking's confirmation page
-            messages.info(
-                self.request,
-                "This booking was already submitted. Showing your confirmation details.",
-            )
-            return redirect("booking_confirmation", pk=recent_duplicate.id)
-
-        # Save the booking to the database
-        self.object = form.save()
-
-        # Send confirmation email to the customer
-        email_sent = send_booking_confirmation_email(self.request, self.object)
-        if email_sent:
-            messages.success(
-                self.request,
-                "Your booking was successful! A confirmation email has been sent.",
-            )
-        else:
-            messages.warning(
-                self.request,
-                "Your booking was successful, but there was an issue sending the confirmation email.",
-            )
+class BookingCreateViewV2(FormShellCacheMixin, BookingSubmissionMixin, CreateView):
+    """Version 2: Fixed £25 per ticket + optional extra donation."""
 
-        # Send notification email to admins
-        send_admin_notification_email(self.request, self.object)
+    model = Booking
+    form_class = BookingFormV2
+    template_name = "tickets/booking_form_v2.html"
 
-        # Redirect to the confirmation page with the booking ID
-        return redirect("booking_confirmation", pk=self.object.id)
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["ticket_price"] = self.form_class.TICKET_PRICE
+        return context
 
 
-class BookingCreateViewV3(CreateView):
+class BookingCreateViewV3(FormShellCacheMixin, BookingSubmissionMixin, CreateView):
     """Version 3: Fixed £20 per ticket + separate optional extra donation field."""
 
     model = Booking
@@ -118,116 +197,161 @@ class BookingCreateViewV3(CreateView):
         context["ticket_price"] = self.form_class.TICKET_PRICE
         return context
 
-    def form_valid(self, form):
-        # Check for duplicate submissions (same email within last 60 seconds)
-        email = form.cleaned_data.get("email")
-        num_tickets = form.cleaned_data.get("num_tickets")
-        donation_amount = num_tickets * self.form_class.TICKET_PRICE + (
-            form.cleaned_data.get("extra_donation") or 0
-        )
 
-        # Look for recent bookings with same email, tickets, and donation amount
-        cutoff_time = timezone.now() - timedelta(seconds=60)
-        recent_duplicate = Booking.objects.filter(
-            email=email,
-            num_tickets=num_tickets,
-            donation_amount=donation_amount,
-            created_at__gte=cutoff_time,
-        ).first()
+class BookingCreateViewAsync(BookingCreateViewV3):
+    """
+    Version 3 as an async view, used when the site runs under ASGI.
 
-        if recent_duplicate:
-            # Redirect to the existing booking's confirmation page
-            messages.info(
-                self.request,
-                "This booking was already submitted. Showing your confirmation details.",
-            )
-            return redirect("booking_confirmation", pk=recent_duplicate.id)
+    A cached form page and the booking's form validation are handled on
+    the event loop. Rendering a fresh page, and saving a booking (which
+    needs a transaction, so can't use the async ORM), run in a thread.
+    """
 
-        # Save the booking to the database
-        self.object = form.save()
+    http_method_names = ["get", "post", "head", "options"]
 
-        # Send confirmation email to the customer
-        email_sent = send_booking_confirmation_email(self.request, self.object)
-        if email_sent:
-            messages.success(
-                self.request,
-                "Your booking was successful! A confirmation email has been sent.",
-            )
-        else:
-            messages.warning(
-                self.request,
-                "Your booking was successful, but there was an issue sending the confirmation email.",
-            )
+    async def get(self, request, *args, **kwargs):
+        response = await self.aget_shell(request)
+        if response is None:
+            response = await sync_to_async(super().get)(request, *args, **kwargs)
+        return response
 
-        # Send notification email to admins
-        send_admin_notification_email(self.request, self.object)
+    async def post(self, request, *args, **kwargs):
+        self.object = None
+        form = self.get_form()
+        if not form.is_valid():
+            return await sync_to_async(self.form_invalid)(form)
 
-        # Redirect to the confirmation page with the booking ID
-        return redirect("booking_confirmation", pk=self.object.id)
+        key = form.cleaned_data.get("idempotency_key")
+        form.instance.idempotency_key = key
+        form.instance.event = await Event.objects.acurrent()
 
+        if key is None:
+            duplicate = await sync_to_async(self.recent_duplicate)(form)
+            if duplicate is not None:
+                return self.already_submitted(duplicate)
 
-class BookingConfirmationView(TemplateView):
+        try:
+            self.object = await sync_to_async(self.save_booking)(form)
+        except SoldOut as e:
+            return await sync_to_async(self.sold_out)(form, e)
+        except IntegrityError:
+            original = key and await Booking.objects.filter(idempotency_key=key).afirst()
+            if not original:
+                raise
+            return self.already_submitted(original)
+        return self.booked()
+
+
+class BookingConfirmationView(ConfirmationPageCacheMixin, TemplateView):
     template_name = "tickets/booking_confirmation.html"
 
     def get_context_data(self, **kwargs):
+        booking = Booking.objects.filter(id=self.kwargs.get("pk")).first()
+        confirmation_email = booking and self.get_confirmation_emails(booking).first()
+        return self.get_booking_context(booking, confirmation_email, **kwargs)
+
+    def get_confirmation_emails(self, booking):
+        return booking.outbox_emails.filter(
+            kind=OutboxEmail.KIND_BOOKING_CONFIRMATION
+        ).order_by("-created_at")
+
+    def get_booking_context(self, booking, confirmation_email, **kwargs):
         context = super().get_context_data(**kwargs)
-        booking_id = self.kwargs.get("pk")
-        try:
-            booking = Booking.objects.get(id=booking_id)
-            context["booking"] = booking
-            context["payment_reference"] = booking.payment_reference()
-            # Use bank details from settings
-            context["bank_details"] = {
-                **settings.BANK_DETAILS,
-                "reference": booking.payment_reference(),
-            }
-        except Booking.DoesNotExist:
+        if booking is None:
             messages.error(self.request, "Booking not found.")
             context["error"] = "Booking information not found."
-
+            return context
+
+        context["booking"] = booking
+        context["payment_reference"] = booking.payment_reference()
+        context["confirmation_email"] = confirmation_email
+        # Use bank details from settings
+        context["bank_details"] = {
+            **settings.BANK_DETAILS,
+            "reference": booking.payment_reference(),
+        }
         return context
 
 
+class BookingConfirmationViewAsync(BookingConfirmationView):
+    """The confirmation page as an async view, used when the site runs under ASGI."""
+
+    async def get(self, request, *args, **kwargs):
+        can_cache = await self.acan_cache_page(request)
+        if can_cache and (page := await self.aget_page(kwargs.get("pk"))) is not None:
+            return self.page_response(request, page)
+
+        booking = await Booking.objects.filter(id=kwargs.get("pk")).afirst()
+        confirmation_email = booking and await self.get_confirmation_emails(booking).afirst()
+        response = self.render_to_response(
+            self.get_booking_context(booking, confirmation_email, **kwargs)
+        )
+        if not can_cache:
+            return response
+        return await self.acache_page(request, kwargs.get("pk"), response)
+
+
 # No longer needed since we're using the BookingCreateView directly at the root URL
 
 
-class BookingReportView(ListView):
+class ReplicaReadMixin:
+    """Read from the database replica, if there is one (see tickets.routers)."""
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method in ("GET", "HEAD"):
+            use_replica()
+        return super().dispatch(request, *args, **kwargs)
+
+
+class BookingReportView(ReplicaReadMixin, ListView):
     model = Booking
     template_name = "tickets/booking_report.html"
     context_object_name = "bookings"
     paginate_by = 20
 
     def get_queryset(self):
-        queryset = Booking.objects.all().order_by("-created_at")
+        queryset = Booking.objects.all()
 
         # Apply filters from form
         form = ReportFilterForm(self.request.GET)
-        if form.is_valid():
-            # Filter by payment status
-            payment_status = form.cleaned_data.get("payment_status")
-            if payment_status == "paid":
-                queryset = queryset.filter(is_paid=True)
-            elif payment_status == "unpaid":
-                queryset = queryset.filter(is_paid=False)
-
-            # Filter by gift aid status
-            gift_aid = form.cleaned_data.get("gift_aid")
-            if gift_aid == "yes":
-                queryset = queryset.filter(gift_aid=True)
-            elif gift_aid == "no":
-                queryset = queryset.filter(gift_aid=False)
-
-            # Search by name or email
-            search_query = form.cleaned_data.get("search")
-            if search_query:
-                queryset = queryset.filter(
-                    Q(full_name__icontains=search_query)
-                    | Q(email__icontains=search_query)
-                )
+        self.filters = form.cleaned_data if form.is_valid() else {}
+        queryset = self.filtered_queryset = queryset.filter_for_report(self.filters)
+
+        # Show the best search matches first
+        search_query = self.filters.get("search")
+        if search_query:
+            queryset = get_search_backend(queryset.db).rank(queryset, search_query)
 
         return queryset
 
+    def get_ordering(self):
+        if self.filters.get("search"):
+            return ["-search_rank", "-created_at", "-id"]
+        return ["-created_at", "-id"]
+
+    def paginate_queryset(self, queryset, page_size):
+        """Paginate with cursors rather than page numbers, so that every
+        page costs the same as the first and no COUNT is needed."""
+        paginator = KeysetPaginator(queryset, page_size, self.get_ordering())
+        try:
+            page = paginator.page(self.request.GET.get(CURSOR_VAR))
+        except InvalidCursor:
+            raise Http404("Invalid page.")
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def get_page_url(self, cursor):
+        query = self.request.GET.copy()
+        query[CURSOR_VAR] = cursor
+        query.pop("page", None)
+        return f"?{query.urlencode()}"
+
     def get_context_data(self, **kwargs):
+        # Unless there's a search, the summary statistics come straight from
+        # the BookingSummary table; otherwise from one aggregate query.
+        self.summary = BookingSummary.objects.for_report(self.filters)
+        if self.summary is None:
+            self.summary = self.filtered_queryset.summary()
+
         context = super().get_context_data(**kwargs)
 
         # Add filter form to context
@@ -235,30 +359,240 @@ class BookingReportView(ListView):
         context["filter_form"] = form
 
         # Add summary statistics
-        bookings = self.get_queryset()
-        context["total_bookings"] = bookings.count()
-        context["total_tickets"] = (
-            bookings.aggregate(Sum("num_tickets"))["num_tickets__sum"] or 0
-        )
-        context["total_amount"] = (
-            bookings.aggregate(Sum("donation_amount"))["donation_amount__sum"] or 0
-        )
-        context["paid_amount"] = (
-            bookings.filter(is_paid=True).aggregate(Sum("donation_amount"))[
-                "donation_amount__sum"
-            ]
-            or 0
-        )
-        context["unpaid_amount"] = (
-            bookings.filter(is_paid=False).aggregate(Sum("donation_amount"))[
-                "donation_amount__sum"
-            ]
-            or 0
-        )
-        context["gift_aid_count"] = bookings.filter(gift_aid=True).count()
+        context.update(self.summary)
+
+        # Links to the neighbouring pages, keeping the current filters
+        page = context["page_obj"]
+        if page.has_next():
+            context["next_page_url"] = self.get_page_url(page.next_cursor)
+        if page.has_previous():
+            context["previous_page_url"] = self.get_page_url(page.previous_cursor)
+
+        # Export links for the same filters
+        query = self.request.GET.copy()
+        query.pop(CURSOR_VAR, None)
+        query.pop("page", None)
+        context["export_query"] = query.urlencode()
 
         # Make booking references available for all bookings in the template
         for booking in context["bookings"]:
             booking.ref = booking.booking_reference()
 
         return context
+
+
+class BookingExportView(ReplicaReadMixin, View):
+    """Stream every booking matching the report filters as CSV or XLSX."""
+
+    formats = {
+        "csv": (stream_csv, "text/csv; charset=utf-8"),
+        "xlsx": (
+            stream_xlsx,
+            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        ),
+    }
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.GET.get("format", "csv")
+        if export_format not in self.formats:
+            raise Http404("Unknown export format.")
+        stream, content_type = self.formats[export_format]
+
+        form = ReportFilterForm(request.GET)
+        filters = form.cleaned_data if form.is_valid() else {}
+        queryset = Booking.objects.filter_for_report(filters).order_by("-created_at", "-id")
+        # Pick the database now: the rows are read as the response streams,
+        # after the request's routing has finished
+        queryset = queryset.using(queryset.db)
+
+        response = StreamingHttpResponse(stream(export_rows(queryset)), content_type=content_type)
+        filename = f"bookings-{timezone.localdate():%Y-%m-%d}.{export_format}"
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+
+class BookingApiView(ReplicaReadMixin, View):
+    """
+    Read-only JSON list of bookings, filtered like the booking report, with
+    cursor pagination, field selection and conditional GET (see tickets.api).
+    """
+
+    ordering = ["-created_at", "-id"]
+
+    def dispatch(self, request, *args, **kwargs):
+        if not has_api_access(request):
+            response = JsonResponse({"error": "Authentication required."}, status=401)
+            response["WWW-Authenticate"] = "Bearer"
+            return response
+        return super().dispatch(request, *args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        form = ReportFilterForm(request.GET)
+        if not form.is_valid():
+            return JsonResponse({"errors": form.errors}, status=400)
+        try:
+            fields = parse_fields(request.GET.get("fields"))
+            limit = parse_limit(request.GET.get("limit"))
+        except InvalidParameter as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        queryset = Booking.objects.filter_for_report(form.cleaned_data)
+
+        # MAX(updated_at) comes from its index and the count from
+        # BookingSummary; with a search, both from one aggregate query
+        summary = BookingSummary.objects.for_report(form.cleaned_data)
+        if summary is not None:
+            count = summary["total_bookings"]
+            last_modified = queryset.aggregate(last_modified=Max("updated_at"))["last_modified"]
+        else:
+            aggregate = queryset.aggregate(last_modified=Max("updated_at"), count=Count("id"))
+            count, last_modified = aggregate["count"], aggregate["last_modified"]
+        etag = bookings_etag(last_modified, count, request.GET.urlencode())
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            paginator = KeysetPaginator(
+                queryset.only(*source_fields(fields), "created_at"), limit, self.ordering
+            )
+            try:
+                page = paginator.page(request.GET.get(CURSOR_VAR))
+            except InvalidCursor:
+                return JsonResponse({"error": "Invalid cursor."}, status=400)
+            response = JsonResponse(
+                {
+                    "results": [serialize_booking(booking, fields) for booking in page],
+                    "next": self.get_page_url(page.next_cursor),
+                    "previous": self.get_page_url(page.previous_cursor),
+                }
+            )
+
+        response["ETag"] = etag
+        if timestamp is not None:
+            response["Last-Modified"] = http_date(timestamp)
+        # Clients may keep responses but must check they're current
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ("Authorization", "Cookie"))
+        return response
+
+    def get_page_url(self, cursor):
+        if cursor is None:
+            return None
+        query = self.request.GET.copy()
+        query[CURSOR_VAR] = cursor
+        return self.request.build_absolute_uri(f"?{query.urlencode()}")
+
+
+class CheckInEventMixin:
+    """Find the event being checked in, from ?event= or door_event()."""
+
+    def get_event(self):
+        event_id = self.request.GET.get("event")
+        if not event_id:
+            return door_event()
+        if not event_id.isdigit():
+            raise Http404("Unknown event.")
+        return get_object_or_404(Event, pk=event_id)
+
+
+class CheckInView(CheckInEventMixin, TemplateView):
+    """Door check-in page, which works offline once loaded (see tickets.checkin)."""
+
+    template_name = "tickets/checkin.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        event = self.get_event()
+        query = f"?event={event.pk}" if event else ""
+        context["event"] = event
+        context["snapshot_url"] = reverse("checkin_snapshot") + query
+        context["sync_batch_size"] = CHECK_IN_BATCH_SIZE
+        return context
+
+
+class CheckInSnapshotView(CheckInEventMixin, View):
+    """The event's bookings as a compact, versioned JSON snapshot."""
+
+    def get(self, request, *args, **kwargs):
+        event = self.get_event()
+        bookings = snapshot_bookings(event)
+        version, last_modified = snapshot_version(bookings)
+        etag = f'"{version}"'
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = JsonResponse(
+                {
+                    "version": version,
+                    "event": event.name if event else None,
+                    "generated_at": timezone.now(),
+                    "fields": SNAPSHOT_FIELDS,
+                    "rows": list(snapshot_rows(bookings)),
+                }
+            )
+        response["ETag"] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class CheckInSyncView(View):
+    """Record a batch of check-ins queued by the check-in page."""
+
+    def post(self, request, *args, **kwargs):
+        try:
+            check_ins = parse_check_ins(json.loads(request.body))
+        except ValueError:
+            return JsonResponse({"error": "Invalid JSON."}, status=400)
+        except InvalidCheckIn as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        checked_in, already_checked_in, unknown = record_check_ins(check_ins)
+        return JsonResponse(
+            {
+                "checked_in": checked_in,
+                "already_checked_in": already_checked_in,
+                "unknown": unknown,
+            }
+        )
+
+
+class CheckInServiceWorkerView(TemplateView):
+    """
+    The check-in page's service worker. It's served from /checkin/ rather
+    than as a static file so that its scope covers the page.
+    """
+
+    template_name = "tickets/checkin_sw.js"
+    content_type = "application/javascript"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        assets = [static(path) for path in CHECK_IN_ASSETS]
+        context["assets"] = assets
+        # A new deploy's hashed file names give the worker a new cache
+        context["cache_version"] = hashlib.sha1("".join(assets).encode()).hexdigest()[:12]
+        return context
+
+    def render_to_response(self, context, **response_kwargs):
+        response = super().render_to_response(context, **response_kwargs)
+        patch_cache_control(response, no_cache=True)
+        return response
+
+
+class MetricsView(View):
+    """
+    Request metrics in Prometheus' text format (see tickets.instrumentation),
+    for staff or a scraper with one of METRICS_TOKENS.
+    """
+
+    def get(self, request, *args, **kwargs):
+        if not (
+            request.user.is_active and request.user.is_staff
+        ) and not has_bearer_token(request, settings.METRICS_TOKENS):
+            response = HttpResponse("Authentication required.\n", status=401)
+            response["WWW-Authenticate"] = "Bearer"
+            return response
+        response = HttpResponse(
+            metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
+        patch_cache_control(response, no_store=True)
+        return response